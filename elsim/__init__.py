@@ -17,8 +17,19 @@
 # along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from collections import defaultdict
+import time
+from statistics import NormalDist
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import numpy as np
+
 from elsim.similarity import Similarity, Compress
+from elsim.checkpoint import Checkpoint, format_hash
+from elsim.report import similarity_value, print_summary, print_stats
+from elsim.result import ElsimResult, join_hash, SIDE_FIRST, SIDE_SECOND, KIND_SIMILAR, KIND_DELETED
+from elsim.store import ElementStore, DiskRows
 
 ELSIM_VERSION = 0.2
 
@@ -63,6 +74,22 @@ FILTER_ELEMENT_METH = "FILTER_ELEMENT_METH"
 # function to calculate the similarity between two elements
 # Arguments: Similarity(), Element_1, Element_2
 FILTER_SIM_METH = "FILTER_SIM_METH"
+# (optional) function to get the bytes of an element, which are compared
+# Arguments: Element
+FILTER_BUFFER_METH = "FILTER_BUFFER_METH"
+# (optional) function to calculate the similarity between one and many buffers at once,
+# i.e. a whole row of the similarity matrix. Requires FILTER_BUFFER_METH.
+# If both are given, they are used instead of FILTER_SIM_METH and must give the same result.
+# Arguments: Similarity(), buffer of Element_1, list of buffers
+# Returns a list of distances
+FILTER_SIM_BATCH_METH = "FILTER_SIM_BATCH_METH"
+# (optional) function to calculate the similarity between many buffers and one buffer at once,
+# i.e. a whole column of the similarity matrix. Requires FILTER_BUFFER_METH.
+# Must give the same result as FILTER_SIM_METH for each Element_1 with Element_2,
+# note that the NCD is not symmetric.
+# Arguments: Similarity(), list of buffers, buffer of Element_2
+# Returns a list of distances
+FILTER_SIM_COLUMN_METH = "FILTER_SIM_COLUMN_METH"
 # function to sort all similar elements using threshold
 FILTER_SORT_METH = "FILTER_SORT_METH"
 # object to skip elements
@@ -83,6 +110,37 @@ SIMILARITY_ELEMENTS = "similarity_elements"
 SIMILARITY_SORT_ELEMENTS = "similarity_sort_elements"
 
 DIFF = "diff"
+# Optional keys to compute the diffs of Eldiff in a pool of processes.
+# DIFF_PREPARE extracts a picklable state from two elements,
+# DIFF_COMPARE calculates a picklable result from the state inside the worker process
+# and DIFF_FINISH creates the same object as DIFF from both elements and the result.
+# DIFF_COMPARE must be picklable.
+DIFF_PREPARE = "diff_prepare"
+DIFF_COMPARE = "diff_compare"
+DIFF_FINISH = "diff_finish"
+
+
+def _callable_name(f):
+    f = getattr(f, "func", f)  # functools.partial
+    if not hasattr(f, "__qualname__"):
+        # a callable object
+        f = type(f)
+    return "{}.{}".format(f.__module__, f.__qualname__)
+
+
+def filter_identity(F):
+    """
+    Returns the names of the functions of a filter dict, which define the distances.
+
+    Distances, which were stored with a different identity, must not be reused.
+
+    :param dict F: Some Filter dictionary
+    :rtype: dict
+    """
+    identity = {"element": _callable_name(F[FILTER_ELEMENT_METH]), "similarity": _callable_name(F[FILTER_SIM_METH])}
+    if FILTER_BUFFER_METH in F:
+        identity["buffer"] = _callable_name(F[FILTER_BUFFER_METH])
+    return identity
 
 
 class ElsimNeighbors:
@@ -131,6 +189,277 @@ class Proxy:
         return len(self.iterable)
 
 
+# Progress information, passed to the progress callback of Elsim after each row
+# rows_done/rows_total: number of finished rows and the total number of rows
+# pairs_done/pairs_total: number of evaluated pairs and the total number of pairs
+# elapsed: time in seconds since the start of the calculation
+# eta: estimated time in seconds until all rows are finished
+ElsimProgress = namedtuple("ElsimProgress", ["rows_done", "rows_total", "pairs_done", "pairs_total", "elapsed", "eta"])
+
+# Estimate of the work that is left, if the calculation was stopped early
+# rows: the number of rows, which were not calculated
+# pairs: the number of pairs, which were not evaluated
+# seconds: the estimated time in seconds to evaluate the remaining pairs
+ElsimRemainder = namedtuple("ElsimRemainder", ["rows", "pairs", "seconds"])
+
+# A finished row of the similarity matrix
+# element: the element from the first iterable
+# similar: the list of (element, distance) tuples as returned by FILTER_SORT_METH
+ElsimRow = namedtuple("ElsimRow", ["element", "similar"])
+
+# Estimate of the similarity value, calculated from a sample of the rows
+# value: the estimated similarity value in percent
+# low/high: the confidence interval of the value in percent
+# pairs: the number of pairs, which were evaluated
+# rows_sampled/rows_total: the number of rows in the sample and the total number of rows
+ElsimEstimate = namedtuple("ElsimEstimate", ["value", "low", "high", "pairs", "rows_sampled", "rows_total"])
+
+
+class ElsimIndex:
+    """
+    The ElsimIndex holds all elements of a single iterable, together with their hashes.
+
+    Building the elements, calculating the hashes and checksums might be expensive.
+    If a single iterable is compared to many others (one-vs-many),
+    the index can be built once and queried with all the other iterables.
+    The compressed sizes of the elements are cached in the :class:`~elsim.similarity.Similarity`
+    object of the index and hence are reused as well.
+
+    Querying the index gives the same result as creating the :class:`Elsim` object
+    with the reference iterable directly::
+
+        index = ElsimIndex(ProxyDalvik(dx1), FILTERS_DALVIK_SIM, "BZ2")
+        for dx in others:
+            el = index.query(ProxyDalvik(dx), threshold=0.6)
+            el.show()
+    """
+    def __init__(self, iterable, F, compressor=None, sim=None, on_element=None):
+        """
+        :param Proxy iterable: the iterable to index
+        :param dict F: Some Filter dictionary
+        :param str compressor: compression method name, or None to use the default one
+        :param elsim.similarity.Similarity sim: use the given Similarity object instead of creating a new one.
+            If given, the compressor is taken from the Similarity object.
+        :param on_element: a callable, which is called with every element that is not skipped,
+            as soon as its checksum was created (optional)
+        """
+        if F is None:
+            raise ValueError("A valid filter dict is required!")
+
+        self.iterable = iterable
+        self.F = F
+
+        if sim is not None:
+            self.sim = sim
+            self.compressor = sim.ctype
+        else:
+            self.sim = Similarity()
+            if compressor:
+                self.compressor = Compress.by_name(compressor.upper())
+            else:
+                self.compressor = Compress.BZ2
+            self.sim.set_compress_type(self.compressor)
+
+        # Note that there is a 1:n relation between Elements and their hashes.
+        # While an Element might be unique, several Elements might produce the same hash.
+        # Think of this easy example: We take strings as input but trim excess whitespaces.
+        # Hence 'hello world' and ' hello world ' are different Elements, but produce the
+        # same hash (as both transform to 'hello world')
+        # That means we use hashes for easy lookup of unique hashes, but to get all
+        # Elements for a certain hash, we need another lookup.
+
+        self.elements = []  # contains all unique elements, ordered by their hash
+        # Contains the sorted unique hashes and a lookup for the hash to get all elements that share the same hash
+        self.ref_set_ident = None
+        self.skipped = set()  # contains all skipped elements
+        # time in seconds spent on creating the elements, their checksum objects and on hashing them
+        self.timings = dict(elements=0.0, checksum=0.0, hashing=0.0)
+        self.on_element = on_element
+
+        self.__init_index_elements()
+
+    def __init_index_elements(self):
+        """
+        Iterate over all elements and create the Element objects and CheckSum objects
+        """
+        start = time.time()
+        checksum = 0.0
+        elements = []
+        for element in self.iterable:
+            # Generate the Elements for storing the hashes in
+            # This element must have the methods set_checksum, hash
+            e = self.F[FILTER_ELEMENT_METH](element, self.iterable, self.sim)
+
+            # Check if the element shall be skipped
+            if self.F[FILTER_SKIPPED_METH].skip(e):
+                self.skipped.add(e)
+                continue
+
+            # If not skipped, add the element to the list of elements for the given Iterable
+            elements.append(e)
+
+            if self.on_element is not None:
+                # The element is passed on right away, hence the checksum is needed now
+                checksum_start = time.time()
+                e.checksum
+                checksum += time.time() - checksum_start
+                self.on_element(e)
+
+        self.timings["elements"] = time.time() - start - checksum
+
+        # Create the Checksum object, which might transform the content
+        # and is used to calculate distances and checksum.
+        start = time.time()
+        for e in elements:
+            e.checksum
+        self.timings["checksum"] = time.time() - start + checksum
+
+        # Hash the content and store the elements by their hash
+        start = time.time()
+        self.ref_set_ident = ElementStore(elements)
+        self.elements = self.ref_set_ident.elements
+        self.timings["hashing"] = time.time() - start
+
+    @property
+    def hashes(self):
+        """
+        The unique hashes of the elements
+
+        :rtype: elsim.store.ElementStore
+        """
+        return self.ref_set_ident
+
+    def __len__(self):
+        return len(self.elements)
+
+    def query(self, iterable, threshold=0.8, similarity_threshold=0.2, **kwargs):
+        """
+        Compare the indexed iterable against another one.
+
+        All further keyword arguments are passed to :class:`Elsim`.
+
+        :param Proxy iterable: the iterable to compare against
+        :param float threshold: value which used in the sort method to eliminate not interesting comparisons
+        :param float similarity_threshold: value to threshold similarity values with
+        :rtype: Elsim
+        """
+        return Elsim(self, iterable, self.F, threshold=threshold, similarity_threshold=similarity_threshold, **kwargs)
+
+
+# The state of a worker process of the ColumnPipeline, set by _init_pipeline_worker
+_pipeline_worker = dict()
+
+
+def _init_pipeline_worker(compressor, level, column_meth, buffers):
+    sim = Similarity()
+    sim.set_compress_type(Compress.by_name(compressor))
+    sim.set_level(level)
+    _pipeline_worker.update(sim=sim, column_meth=column_meth, buffers=buffers)
+
+
+def _compare_column(buff):
+    """
+    Compare all buffers of the index against a single buffer inside a worker process
+    """
+    return np.array(_pipeline_worker["column_meth"](_pipeline_worker["sim"], _pipeline_worker["buffers"], buff),
+                    dtype=np.float64)
+
+
+class ColumnPipeline:
+    """
+    Compares the elements of the second iterable against an :class:`ElsimIndex`
+    in a pool of processes, while the second iterable is still being extracted.
+
+    Each element with a hash that is not part of the index is a column of
+    the similarity matrix. It is compared against one element of every hash in the index,
+    as soon as it is passed to :meth:`submit`.
+    At this point, it is not known yet which elements of the index are identical to
+    elements of the second iterable, thus some of these distances are never used.
+
+    At most queue_size columns are in flight, :meth:`submit` blocks if the queue is full.
+
+    Empty buffers can not be compared, their distances are NaN and have to be
+    evaluated as usual.
+
+    Requires FILTER_BUFFER_METH and FILTER_SIM_COLUMN_METH, the latter must be picklable.
+    The distances are calculated from the elements of the index to the column,
+    as FILTER_SIM_METH does for the rows.
+    """
+    def __init__(self, index, jobs=None, queue_size=16):
+        """
+        :param ElsimIndex index: the index to compare against
+        :param int jobs: number of processes, None to use all CPUs
+        :param int queue_size: maximal number of columns, which are waiting for a result
+        """
+        F = index.F
+        if FILTER_SIM_COLUMN_METH not in F or FILTER_BUFFER_METH not in F:
+            raise ValueError("The filter dict requires FILTER_SIM_COLUMN_METH and FILTER_BUFFER_METH!")
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1!")
+
+        self.store = index.ref_set_ident
+        self.F = F
+        self.queue_size = queue_size
+        # The distances of each column, in the order of the hashes of the index
+        self.columns = dict()
+        self.__pending = deque()
+        buffers = [F[FILTER_BUFFER_METH](self.store.first(i)) for i in range(len(self.store))]
+        # The positions of the buffers which are compared
+        self.__positions = np.flatnonzero([len(b) > 0 for b in buffers])
+        self.__executor = ProcessPoolExecutor(jobs, initializer=_init_pipeline_worker,
+                                              initargs=(index.compressor.name, index.sim.level,
+                                                        F[FILTER_SIM_COLUMN_METH],
+                                                        [buffers[i] for i in self.__positions]))
+
+    def submit(self, element):
+        """
+        Queue the comparison of an element, if it is a new column
+
+        :param element: an element of the second iterable
+        """
+        h = element.hash
+        if h in self.columns or h in self.store:
+            return
+        buff = self.F[FILTER_BUFFER_METH](element)
+        if not buff:
+            return
+        self.columns[h] = None
+
+        while len(self.__pending) >= self.queue_size:
+            self.__collect()
+        self.__pending.append((h, self.__executor.submit(_compare_column, buff)))
+
+    def __collect(self):
+        h, future = self.__pending.popleft()
+        distances = np.full(len(self.store), np.nan)
+        distances[self.__positions] = future.result()
+        self.columns[h] = distances
+
+    def results(self):
+        """
+        Wait for all columns and shut down the processes.
+
+        Returns a dictionary with the hash of each column and the distances to the hashes of the index.
+
+        :rtype: dict
+        """
+        try:
+            while self.__pending:
+                self.__collect()
+        finally:
+            self.__executor.shutdown()
+        return self.columns
+
+    def close(self):
+        """
+        Stop all processes without waiting for the results
+        """
+        for _, future in self.__pending:
+            future.cancel()
+        self.__pending.clear()
+        self.__executor.shutdown()
+
+
 class Elsim:
     """
     This is the main class to use when calculating similarities between objects.
@@ -236,15 +565,44 @@ class Elsim:
     Moreover we can calculate a similarity "score" using the number of
     identical elements and the value of the similar elements.
     """
-    def __init__(self, e1, e2, F, threshold=0.8, compressor=None, similarity_threshold=0.2):
+    def __init__(self, e1, e2, F, threshold=0.8, compressor=None, similarity_threshold=0.2,
+                 lazy=False, progress=None, cancel=None, max_pairs=None, max_time=None, checkpoint=None,
+                 previous=None, max_memory=None, spill_dir=None, jobs=None, queue_size=16, best_match=False,
+                 epsilon=0.0, cache=None):
         """
         
-        :param Proxy e1: the first element to compare
+        :param e1: the first element to compare, either a Proxy or a prebuilt :class:`ElsimIndex`
+        :type e1: Proxy or ElsimIndex
         :param Proxy e2: the second element to compare
         :param dict F: Some Filter dictionary
         :param float threshold: value which used in the sort method to eliminate not interesting comparisons
         :param str compressor: compression method name, or None to use the default one
         :param float similarity_threshold: value to threshold similarity values with
+        :param bool lazy: do not calculate the similarities on creation, use :meth:`run` or :meth:`iter_rows` instead
+        :param progress: a callable, which is called with an :class:`ElsimProgress` after each finished row
+        :param cancel: an object with a method `is_set()` (like :class:`threading.Event`),
+            the calculation stops as soon as it returns True
+        :param int max_pairs: maximal number of pairs to evaluate with FILTER_SIM_METH (optional)
+        :param float max_time: maximal time in seconds to spend on the similarity matrix (optional)
+        :param str checkpoint: filename of a checkpoint file, which is used to store finished rows
+            and to resume from (optional)
+        :param elsim.result.ElsimResult previous: the result of an earlier comparison with the same
+            first iterable, which is used to skip pairs that were already evaluated (optional)
+        :param int max_memory: maximal number of bytes the similarity matrix may use in memory (optional).
+            Larger matrices are written to a temporary file.
+        :param str spill_dir: directory for the temporary file of the similarity matrix,
+            the default temporary directory is used if not given
+        :param int jobs: if given, the elements of the second iterable are compared in this number of processes
+            while they are extracted, see :class:`ColumnPipeline`. Requires FILTER_SIM_COLUMN_METH
+            and FILTER_BUFFER_METH.
+        :param int queue_size: maximal number of elements waiting for the processes, if jobs is given
+        :param bool best_match: only search for the closest element of each row, see :meth:`iter_rows`.
+            Requires FILTER_BUFFER_METH.
+        :param float epsilon: if best_match is used, stop a row as soon as an element with
+            at most this distance is found
+        :param elsim.cache.DistanceCache cache: a persistent cache of distances, which is used
+            instead of evaluating the pairs again and stores all evaluated pairs (optional).
+            The distances are stored under the metric of the cache and the names of the filter functions.
         """
         if F is None:
             raise ValueError("A valid filter dict is required!")
@@ -257,19 +615,27 @@ class Elsim:
             raise ValueError("similarity_threshold must be a number between 0 and 1!")
         self.similarity_threshold = similarity_threshold
 
-        self.e1 = e1
-        self.e2 = e2
-
-        self.sim = Similarity()
+        if isinstance(e1, ElsimIndex):
+            # The first iterable was already indexed, we can simply use it
+            if F is not e1.F:
+                raise ValueError("The filter dict must be the same as the one of the ElsimIndex!")
+            if compressor and Compress.by_name(compressor.upper()) != e1.compressor:
+                raise ValueError("The compressor must be the same as the one of the ElsimIndex!")
+            index1 = e1
+        else:
+            index1 = ElsimIndex(e1, F, compressor)
 
-        self.__base = F  # contains the filter functions
+        self.e1 = index1.iterable
+        self.e2 = e2
 
-        if compressor:
-            self.compressor = Compress.by_name(compressor.upper())
-        else:
-            self.compressor = Compress.BZ2
+        # The Similarity object is shared with the index,
+        # as the elements of the index hold a reference to it.
+        self.sim = index1.sim
+        self.compressor = index1.compressor
+        # Make sure the compressor is set, another object might have changed it in the meantime.
         self.sim.set_compress_type(self.compressor)
 
+        self.__base = F  # contains the filter functions
 
         # Initialize the filters
         # FIXME: this could be replaced by attributes on this class instead of the large dict.
@@ -277,120 +643,684 @@ class Elsim:
         # is that we need a hashable object. We could work around this by creating two keys for the
         # two elements and not use the iterable itself.
 
-        # Note that there is a 1:n relation between Elements and their hashes.
-        # While an Element might be unique, several Elements might produce the same hash.
-        # Think of this easy example: We take strings as input but trim excess whitespaces.
-        # Hence 'hello world' and ' hello world ' are different Elements, but produce the
-        # same hash (as both transform to 'hello world')
-        # That means we use __hashes for easy lookup of unique hashes, but to get all
-        # Elements for a certain hash, we need another dictionary.
-        
-        # We never remove items from those sets, only add them on startup.
-        self.__elements = defaultdict(set)  # for each iterable, contains all unique elements
-        self.__hashes = defaultdict(set)  # for each iterable, contains all unique hashes
-        # Contains a lookup for the hash to get all elements that share the same hash, for each iterable
-        self.ref_set_ident = defaultdict(lambda: defaultdict(set))
+        # Index all elements of the second iterable, the first one is already indexed.
+        # The distances of the columns which were calculated while indexing, by the hash of the column
+        self.__pipelined = dict()
+        if jobs is not None:
+            pipeline = ColumnPipeline(index1, jobs, queue_size)
+            try:
+                index2 = ElsimIndex(e2, F, sim=self.sim, on_element=pipeline.submit)
+                self.__pipelined = pipeline.results()
+            finally:
+                pipeline.close()
+        else:
+            index2 = ElsimIndex(e2, F, sim=self.sim)
+
+        # Contains the unique hashes and a lookup for the hash to get all elements that share the same hash, for each iterable
+        self.ref_set_ident = {self.e1: index1.ref_set_ident, self.e2: index2.ref_set_ident}
 
         self.filters = {
             IDENTICAL_ELEMENTS: set(),  # contains all identical elements from both iterables
             SIMILAR_ELEMENTS: set(),  # contains all similar elements from both iterables
             NEW_ELEMENTS: set(),  # contains new elements, only from s2
             DELETED_ELEMENTS: set(),  # contains deleted elements, only from s1
-            SKIPPED_ELEMENTS: set(),  # contains all skipped elements from both iterables
+            SKIPPED_ELEMENTS: index1.skipped | index2.skipped,  # contains all skipped elements from both iterables
 
             HASHSUM_SIMILAR_ELEMENTS: [],
             SIMILARITY_ELEMENTS: dict(),
             SIMILARITY_SORT_ELEMENTS: dict(),
             }
 
-        # Starts to add all elements from the two iterators
-        # to the filter structure and calculate hashes for all elements.
-        self.__init_index_elements(self.e1)
-        self.__init_index_elements(self.e2)
-
-        # get all identical items and calculate similarity
-        self._init_similarity()
-        # Get Most similar item(s) and deletd items
-        self._init_sort_elements()
-        # Get new items
-        self._init_new_elements()
+        # Cache for the similarity scores, the key is the tuple (new, deleted)
+        self.__scores = dict()
+
+        self.progress = progress
+        self.cancel = cancel
+        # Set if the calculation was stopped by the cancel object or by stopping iter_rows
+        self.cancelled = False
+
+        if max_pairs is not None and max_pairs < 0:
+            raise ValueError("max_pairs must be a positive number!")
+        if max_time is not None and max_time < 0:
+            raise ValueError("max_time must be a positive number!")
+        self.max_pairs = max_pairs
+        self.max_time = max_time
+
+        if max_memory is not None and max_memory < 0:
+            raise ValueError("max_memory must be a positive number!")
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+
+        if best_match and FILTER_BUFFER_METH not in F:
+            raise ValueError("best_match requires FILTER_BUFFER_METH in the filter dict!")
+        if not (0 <= epsilon <= 1):
+            raise ValueError("epsilon must be a number between 0 and 1!")
+        self.best_match = best_match
+        self.epsilon = epsilon
+        # Set if the similarity matrix is stored on disk
+        self.spilled = False
+        # Set if the calculation was stopped because the budget was exhausted
+        self.budget_exhausted = False
+        # Set if not all rows of the similarity matrix were calculated
+        self.partial = False
+
+        # Everything which defines the distances and how they are sorted
+        self.identity = {"compressor": self.compressor.name, "level": self.sim.level,
+                         "filters": filter_identity(F), "threshold": self.threshold}
+
+        # For each row element from the previous result: the hash of the closest element and the distance
+        self.__previous = dict()
+        # All hashes, which were columns in the previous result
+        self.__previous_columns = set()
+        if previous is not None:
+            self.__init_previous(previous)
+
+        self.cache = cache
+        if cache is not None:
+            # Distances of other filter functions must not be reused
+            filters = sorted(self.identity["filters"].items())
+            self.__cache_metric = " ".join([cache.metric] + ["{}={}".format(*item) for item in filters])
+
+        self.checkpoint = None
+        if checkpoint is not None:
+            self.checkpoint = Checkpoint(checkpoint, self.identity)
+
+        self.__finished = False
+        self.__unevaluated = []
+        self.__pairs_done = 0
+        self.__pairs_resumed = 0
+        self.__pairs_skipped = 0
+        self.__column_sizes = None
+        self.__batch = False
+        self.__column_buffers = dict()
+        self.__column_hashes = set()
+        self.__elapsed = 0.0
+
+        # Time in seconds spent in the phases of the calculation
+        self.__timings = {k: index1.timings[k] + index2.timings[k] for k in index1.timings}
+        self.__timings.update(identical=0.0, similarity=0.0, sorting=0.0, new=0.0)
+        self.__sim_counters = (0, 0, 0)
+
+        # get all identical items
+        start = time.time()
+        self._init_identical_elements()
+        self.__timings["identical"] = time.time() - start
+
+        if not lazy:
+            # calculate similarity, get the most similar item(s) and deleted items and new items
+            self.run()
+
+    def __init_previous(self, result):
+        """
+        Extract the closest elements of all rows from a previous result
 
-    def __init_index_elements(self, iterable):
+        :param elsim.result.ElsimResult result:
         """
-        Iterate over all elements and create the Element objects and CheckSum objects
+        found = dict(compressor=result.compressor, level=result.meta.get("level"),
+                     filters=result.meta.get("filters"), threshold=result.threshold,
+                     similarity_threshold=result.similarity_threshold)
+        expected = dict(self.identity, similarity_threshold=self.similarity_threshold)
+        for key, value in expected.items():
+            if found[key] != value:
+                raise ValueError("The previous result was calculated with a different {}: {} != {}".format(
+                    key.replace("_", " "), found[key], value))
+
+        hashes = [join_hash(*h) for h in result.hashes]
+        first = {h for h, side in zip(hashes, result.sides) if side == SIDE_FIRST}
+        # Elements of the second iterable which were identical to the first one, were never compared
+        self.__previous_columns = {h for h, side in zip(hashes, result.sides) if side == SIDE_SECOND} - first
+
+        for i in np.flatnonzero(((result.kinds == KIND_SIMILAR) | (result.kinds == KIND_DELETED)) &
+                                (result.matches >= 0)):
+            self.__previous[hashes[i]] = (hashes[result.matches[i]], float(result.distances[i]))
+
+    def _init_identical_elements(self):
         """
-        for element in iterable:
-            # Generate the Elements for storing the hashes in
-            # This element must have the methods set_checksum, hash
-            e = self.__base[FILTER_ELEMENT_METH](element, iterable, self.sim)
+        Identify all identical elements and prepare the rows and columns
+        of the similarity matrix from the leftovers.
+        """
+        store1 = self.ref_set_ident[self.e1]
+        store2 = self.ref_set_ident[self.e2]
 
-            # Check if the element shall be skipped
-            if self.__base[FILTER_SKIPPED_METH].skip(e):
-                self.filters[SKIPPED_ELEMENTS].add(e)
-                continue
+        # Get all hashes which are in common -> these are identical
+        # and all hashes which are different, from both sides
+        intersection_elements, _, to_test = store1.intersect(store2)
+        _, _, difference_elements = store2.intersect(store1)
+        self.__difference = difference_elements
 
-            # If not skipped, add the element to the list of elements for the given Iterable
-            self.__elements[iterable].add(e)
+        # Update the IDENTICAL_ELEMENTS with the actual Elements, including identical elements
+        self.filters[IDENTICAL_ELEMENTS].update([x for i in intersection_elements for x in store1.group(i)])
 
-            # Create the Checksum object, which might transform the content
-            # and is used to calculate distances and checksum.
-            # Hash the content and add the hash to our list of known hashes
-            self.__hashes[iterable].add(e.hash)
-            # Add it to the reverse lookup
-            self.ref_set_ident[iterable][e.hash].add(e)
+        # Now, we only take one element, as we do not require to test for all identical ones.
+        # These are the columns of the similarity matrix
+        self.__columns = [store2.first(i) for i in difference_elements]
+        # and these the rows
+        self.__rows = [store1.first(i) for i in to_test]
 
     def _init_similarity(self):
         """
         Calculate the similarites between all elements
+        """
+        for _ in self.iter_rows():
+            pass
 
-        As a first step, we identify all identical elements.
-        Then we iterate over the leftovers and calculate the similarity.
+    def run(self):
         """
-        # Get all elements which are in common -> these are identical
-        intersection_elements = self.__hashes[self.e2].intersection(self.__hashes[self.e1])
-        # Get all elements which are different
-        difference_elements = self.__hashes[self.e2].difference(intersection_elements)
-        # We remove the set of intersected elements from e1
-        to_test = self.__hashes[self.e1].difference(intersection_elements)
+        Calculate the similarities and sort the elements into the categories.
 
-        # Update the IDENTICAL_ELEMENTS with the actual Elements, including identical elements
-        self.filters[IDENTICAL_ELEMENTS].update([x for i in intersection_elements for x in self.ref_set_ident[self.e1][i]])
+        This is done automatically on creation, unless the object was created with `lazy=True`.
 
-        # Now, we only take one element, as we do not require to test for all identical ones.
-        available_e2_elements = [next(iter(self.ref_set_ident[self.e2][i])) for i in difference_elements]
-
-        # Check if some elements in the first file has been modified
-        # We compare all different elements from e1 with all different elements from e2
-        # Hence, we create a similarity matrix with size n * m
-        # where n is the number of different items in e1
-        # and m is the number of different items in e2
-        for j in [next(iter(self.ref_set_ident[self.e1][i])) for i in to_test]:
-            self.filters[SIMILARITY_ELEMENTS][j] = dict()
-            for k in available_e2_elements:
+        :returns: the object itself
+        """
+        self._init_similarity()
+        return self
+
+    def __should_stop(self, start, pairs):
+        """
+        Check if the calculation must stop before evaluating the next pairs
+
+        :param float start: start time of the calculation
+        :param int pairs: number of pairs, which are about to be evaluated
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            self.cancelled = True
+            return True
+        if self.max_pairs is not None and self.__pairs_done + pairs > self.max_pairs:
+            self.budget_exhausted = True
+            return True
+        if self.max_time is not None and time.time() - start > self.max_time:
+            self.budget_exhausted = True
+            return True
+        return False
+
+    # Approximate size in bytes of a single distance in the dictionaries of the similarity matrix
+    _ENTRY_SIZE = 100
+
+    @staticmethod
+    def _priority(element):
+        """
+        The priority of a row if a budget is used.
+        The largest elements are evaluated first, as they contain the most information.
+        """
+        return len(element.checksum.get_buff())
+
+    def iter_rows(self):
+        """
+        Calculate the similarity matrix row by row and yield an :class:`ElsimRow` as soon
+        as a row is finished.
+
+        Check if some elements in the first file has been modified:
+        We compare all different elements from e1 with all different elements from e2.
+        Hence, we create a similarity matrix with size n * m,
+        where n is the number of different items in e1
+        and m is the number of different items in e2.
+
+        After each row, the progress callback is called.
+        If the cancel object is set, the calculation stops and the current row is discarded.
+        Stopping the iteration early has the same effect.
+        In both cases, :attr:`cancelled` is set.
+
+        If a budget (max_pairs or max_time) is given, the rows are evaluated in the
+        order of their size, largest first. A row is never started if it would exceed max_pairs,
+        a row which exceeds max_time is discarded.
+        Only the pairs, which are actually evaluated, count towards max_pairs.
+        Pairs taken from the checkpoint, the previous result or the cache are not counted.
+        If the budget runs out, :attr:`budget_exhausted` is set.
+
+        Once the iteration has stopped, the elements are sorted into the categories,
+        considering only the finished rows.
+        If not all rows were finished, :attr:`partial` is set and :meth:`get_remainder`
+        gives an estimate of the remaining work.
+
+        If a checkpoint is used, the distances stored in the checkpoint are taken
+        instead of evaluating the pairs again, and every finished row is written to the checkpoint.
+
+        If the filter dict contains FILTER_SIM_BATCH_METH and FILTER_BUFFER_METH,
+        each row is calculated by a single call to FILTER_SIM_BATCH_METH.
+        In this case, the calculation can only be stopped between rows.
+
+        If a previous result is given and the closest element of a row is still
+        part of the second iterable, only the elements with new hashes are compared.
+        The other elements can not be closer than the previous closest element.
+        This requires that FILTER_SORT_METH only depends on the closest elements,
+        which is true for :func:`~elsim.filters.filter_sort_meth_basic`,
+        and that the rows contain only the evaluated distances.
+
+        If the similarity matrix would need more than max_memory bytes as dictionaries,
+        it is written to a memory-mapped file of float32 values instead and :attr:`spilled` is set.
+        The rows are sorted as soon as they are finished, thus only a single row
+        is kept in memory at a time. Note that the distances are stored with single precision.
+
+        If a cache is used, the distances stored in the cache are taken and every
+        evaluated distance is added to the cache.
+
+        If the object was created with jobs, the distances calculated by the :class:`ColumnPipeline`
+        are used and only the remaining pairs are evaluated.
+
+        If best_match is set, the columns of each row are evaluated in the order of their
+        compressed size, closest to the size of the row first.
+        The NCD can not be smaller than 1 - min(C(x), C(y)) / max(C(x), C(y)),
+        hence the row stops once this bound is larger than the closest distance so far,
+        or if a distance of at most epsilon was found.
+        The rows contain only the evaluated distances, which is sufficient for
+        :func:`~elsim.filters.filter_sort_meth_basic`.
+        As real compressors are not perfectly monotonic, the bound may be slightly off
+        and a different, almost equally close element might be found for short buffers.
+        """
+        if self.__finished:
+            return
+
+        rows = self.__rows
+        if self.max_pairs is not None or self.max_time is not None:
+            rows = sorted(rows, key=self._priority, reverse=True)
+
+        rows_total = len(rows)
+        columns = len(self.__columns)
+        pairs_total = rows_total * columns
+        start = time.time()
+
+        self.__prepare_columns()
+        if self.max_memory is not None and pairs_total * self._ENTRY_SIZE > self.max_memory:
+            self.filters[SIMILARITY_ELEMENTS] = DiskRows(self.__columns, rows_total, self.spill_dir)
+            self.spilled = True
+        sim_counters = (self.sim.calls, self.sim.cache_hits, self.sim.compressed_bytes)
+
+        try:
+            for rows_done, j in enumerate(rows, 1):
+                stored = self.checkpoint.get_row(j.hash) if self.checkpoint is not None else dict()
+                if self.__should_stop(start, 0):
+                    break
+
+                row_start = time.time()
+                skipped = self.__pairs_skipped
+                row, evaluated = self.__evaluate_row(j, stored, start)
+                if row is not None:
+                    self.__timings["similarity"] += time.time() - row_start
+                    self.__pairs_done += len(evaluated)
+                    self.__pairs_resumed += columns - len(evaluated) - (self.__pairs_skipped - skipped)
+                    self.filters[SIMILARITY_ELEMENTS][j] = row
+                    # A score taken during the iteration is outdated by the new row
+                    self.__scores = dict()
+                    if evaluated and self.checkpoint is not None:
+                        self.checkpoint.add_row(j.hash, evaluated)
+                    if evaluated and self.cache is not None:
+                        self.cache.add_row(j.hash, self.compressor.name, self.sim.level, evaluated,
+                                           metric=self.__cache_metric)
+
+                    # Store, that j has similar elements
+                    if j.hash not in self.filters[HASHSUM_SIMILAR_ELEMENTS]:
+                        self.filters[SIMILAR_ELEMENTS].add(j)
+                        self.filters[HASHSUM_SIMILAR_ELEMENTS].append(j.hash)
+
+                    sort_start = time.time()
+                    sort_h = self._sort_row(j)
+                    self.__timings["sorting"] += time.time() - sort_start
+
+                    if self.progress is not None:
+                        elapsed = time.time() - start
+                        pairs_done = self.__pairs_done + self.__pairs_resumed + self.__pairs_skipped
+                        eta = elapsed / self.__pairs_done * (pairs_total - pairs_done) if self.__pairs_done else None
+                        self.progress(ElsimProgress(rows_done, rows_total, pairs_done, pairs_total, elapsed, eta))
+
+                    yield ElsimRow(j, sort_h)
+                    continue
+
+                # the row was stopped
+                break
+        except GeneratorExit:
+            # The iteration was stopped from the outside
+            self.cancelled = True
+            raise
+        finally:
+            self.__finished = True
+            self.__elapsed = time.time() - start
+            self.__pipelined = dict()
+            self.__sim_counters = (self.sim.calls - sim_counters[0],
+                                   self.sim.cache_hits - sim_counters[1],
+                                   self.sim.compressed_bytes - sim_counters[2])
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+            self.__unevaluated = [j for j in rows if j not in self.filters[SIMILARITY_ELEMENTS]]
+            self.partial = len(self.__unevaluated) > 0
+            # Get Most similar item(s) and deletd items
+            sort_start = time.time()
+            self._init_sort_elements()
+            self.__timings["sorting"] += time.time() - sort_start
+            self.__scores = dict()
+            # Get new items
+            new_start = time.time()
+            self._init_new_elements()
+            self.__timings["new"] = time.time() - new_start
+
+    def __prepare_columns(self):
+        """
+        Collect the information about the columns, which is needed to evaluate rows
+        """
+        self.__column_hashes = {k.hash for k in self.__columns}
+        self.__batch = FILTER_SIM_BATCH_METH in self.__base and FILTER_BUFFER_METH in self.__base
+        if self.__batch and not self.__column_buffers:
+            # The buffers of the columns are needed for every row
+            self.__column_buffers = {k: self.__base[FILTER_BUFFER_METH](k) for k in self.__columns}
+        if self.best_match and self.__column_sizes is None:
+            self.__column_sizes = {k: self.sim.compressed_size(self.__base[FILTER_BUFFER_METH](k))
+                                   for k in self.__columns}
+
+    def estimate_similarity_value(self, sample_size=100, confidence=0.95, new=True, deleted=True, strata=4,
+                                  seed=None):
+        """
+        Estimate the similarity value of :meth:`get_similarity_value` from a sample of the rows.
+
+        The identical elements are known exactly from their hashes.
+        Of the other elements of the first iterable, a random sample is compared against all
+        columns. The rows are stratified by their size into equally large strata and each stratum is
+        sampled proportionally. The number of similar and deleted elements and the sum of the distances
+        are extrapolated from the sample, the confidence interval is calculated by linearizing
+        the ratio of the similarity value.
+
+        The number of new elements depends on how many distinct columns are matched.
+        It is assumed that the ratio of distinct matched columns to similar rows is the same as in the sample.
+
+        The object is not modified and can be used to calculate the exact value afterwards.
+        The budget (max_pairs and max_time) and the cancel object stop the sampling,
+        in which case the estimate is calculated from the rows that were finished.
+
+        :param int sample_size: the number of rows to sample
+        :param float confidence: the confidence level of the interval
+        :param bool new: Should new elements regarded as beeing dissimilar
+        :param bool deleted: Should deleted elements regarded as beeing dissimilar
+        :param int strata: the number of strata
+        :param seed: seed for the random number generator (optional)
+        :rtype: ElsimEstimate
+        """
+        if sample_size < 1:
+            raise ValueError("sample_size must be at least 1!")
+        if not (0 < confidence < 1):
+            raise ValueError("confidence must be a number between 0 and 1!")
+
+        rng = np.random.default_rng(seed)
+        rows = sorted(self.__rows, key=self._priority)
+        sample_size = min(sample_size, len(rows))
+        # Each stratum needs at least two rows to estimate its variance
+        strata = max(min(strata, sample_size // 2), 1)
+        groups = [g for g in np.array_split(np.arange(len(rows)), strata) if len(g)]
+
+        # Proportional allocation, the remaining rows go to the largest remainders
+        allocation = np.array([sample_size * len(g) / len(rows) for g in groups])
+        counts = np.floor(allocation).astype(int)
+        for i in np.argsort(counts - allocation)[:sample_size - counts.sum()]:
+            counts[i] += 1
+        sample = [rng.permutation(g)[:n] for g, n in zip(groups, counts)]
+
+        self.__prepare_columns()
+        store2 = self.ref_set_ident[self.e2]
+        # All elements of the second iterable, which are not identical
+        different = sum(len(store2.group(i)) for i in self.__difference)
+        identical = len(self.filters[IDENTICAL_ELEMENTS])
+
+        start = time.time()
+        flags = (self.cancelled, self.budget_exhausted)
+        pairs = 0
+        # For each stratum: the contribution to the similarity value and if the row is similar
+        samples = [([], []) for _ in groups]
+        matched = set()
+        stopped = False
+        for (values, similar), idx in zip(samples, sample):
+            for i in idx:
+                j = rows[i]
+                stored = self.checkpoint.get_row(j.hash) if self.checkpoint is not None else dict()
+                if self.__should_stop(start, pairs):
+                    stopped = True
+                    break
+                row, evaluated = self.__evaluate_row(j, stored, start, pairs)
+                if row is None:
+                    stopped = True
+                    break
+                pairs += len(evaluated)
+                if evaluated and self.cache is not None:
+                    self.cache.add_row(j.hash, self.compressor.name, self.sim.level, evaluated,
+                                       metric=self.__cache_metric)
+                sort_h = self.__base[FILTER_SORT_METH](j, row, self.threshold)
+                similar.append(1.0 if sort_h else 0.0)
+                values.append(1.0 - self._similarity_threshold(sort_h[0][1]) if sort_h else 0.0)
+                if sort_h:
+                    matched.add(sort_h[0][0])
+            if stopped:
+                break
+        # Stopping the sampling does not change the state of the calculation
+        self.cancelled, self.budget_exhausted = flags
+
+        sampled = [len(v) for v, _ in samples]
+        # Strata without a sample take the values of all sampled rows
+        pooled = ([x for v, _ in samples for x in v], [x for _, s in samples for x in s])
+        samples = [(np.array(v if v else pooled[0]), np.array(s if s else pooled[1])) for v, s in samples]
+
+        # The ratio of distinct matched columns to similar rows
+        distinct = len(matched) / sum(pooled[1]) if sum(pooled[1]) else 1.0
+
+        def per_row_den(s):
+            # A similar row counts itself and removes the matched column from the new elements,
+            # a deleted row counts itself, if deleted elements are counted.
+            return s * (1.0 - distinct * new) + (1.0 - s) * deleted
+
+        # The similarity value is the ratio of the numerator and the denominator
+        numerator = identical * (1.0 - self._similarity_threshold(0.0)) + \
+            sum(len(g) * v.mean() for g, (v, _) in zip(groups, samples) if len(v))
+        denominator = identical + new * different + \
+            sum(len(g) * per_row_den(s).mean() for g, (_, s) in zip(groups, samples) if len(s))
+        if denominator <= 0:
+            return ElsimEstimate(0.0, 0.0, 0.0, pairs, sum(sampled), len(rows))
+        value = float(numerator) / float(denominator)
+
+        # Variance of the stratified sum of the linearized ratio, with finite population correction
+        variance = 0.0
+        for g, n, (v, s) in zip(groups, sampled, samples):
+            if n > 1:
+                z = v - value * per_row_den(s)
+                variance += len(g) ** 2 * (1.0 - n / len(g)) * z.var(ddof=1) / n
+        z = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+        error = z * float(np.sqrt(variance)) / float(denominator)
+
+        return ElsimEstimate(value * 100, max(value - error, 0.0) * 100, min(value + error, 1.0) * 100,
+                             pairs, sum(sampled), len(rows))
+
+    def __search_best_match(self, j, row, evaluated, missing, start, done):
+        """
+        Evaluate the missing columns of a row until no column can be closer than the closest one so far
+        """
+        size = self.sim.compressed_size(self.__base[FILTER_BUFFER_METH](j))
+        sizes = np.array([self.__column_sizes[k] for k in missing], dtype=np.float64)
+        bounds = 1.0 - np.minimum(sizes, size) / np.maximum(np.maximum(sizes, size), 1)
+        best = min(row.values()) if row else np.inf
+
+        order = np.argsort(bounds, kind='stable')
+        for n, i in enumerate(order):
+            if best <= self.epsilon or bounds[i] > best:
+                self.__pairs_skipped += len(order) - n
+                break
+            if self.__should_stop(start, done + n + 1):
+                return None, None
+            k = missing[i]
+            row[k] = evaluated[k.hash] = self.__base[FILTER_SIM_METH](self.sim, j, k)
+            best = min(best, row[k])
+        # Keep the order of the columns, such that equally close elements are sorted as usual
+        return {k: row[k] for k in self.__columns if k in row}, evaluated
+
+    def __evaluate_row(self, j, stored, start, done=0):
+        """
+        Calculate the distances between j and all columns
+
+        :param j: the element of the row
+        :param dict stored: distances taken from the checkpoint
+        :param float start: start time of the calculation
+        :param int done: pairs evaluated so far, which are not counted in pairs_evaluated yet
+        :returns: the row and the distances which were actually evaluated, keyed by hash,
+            or None, None if the calculation was stopped
+        """
+        row = dict()
+        evaluated = dict()
+        missing = []
+        # The position of j in the distances of the pipeline
+        pos = self.ref_set_ident[self.e1].find(j.hash) if self.__pipelined else -1
+
+        # If the closest element of the previous result is still there,
+        # none of the other elements from the previous result can be closer.
+        # Thus, only the elements with new hashes must be evaluated.
+        previous = self.__previous.get(j.hash)
+        if previous is not None and previous[0] not in self.__column_hashes:
+            previous = None
+
+        for k in self.__columns:
+            if previous is not None and k.hash in self.__previous_columns:
+                if k.hash == previous[0]:
+                    row[k] = previous[1]
+                continue
+            distance = stored.get(format_hash(k.hash)) if stored else None
+            if distance is not None:
+                row[k] = distance
+            elif pos >= 0 and k.hash in self.__pipelined and not np.isnan(self.__pipelined[k.hash][pos]):
+                row[k] = evaluated[k.hash] = float(self.__pipelined[k.hash][pos])
+            else:
+                missing.append(k)
+
+        if self.cache is not None and missing:
+            cached = self.cache.get_row(j.hash, self.compressor.name, self.sim.level, [k.hash for k in missing],
+                                        metric=self.__cache_metric)
+            for k in missing:
+                if k.hash in cached:
+                    row[k] = cached[k.hash]
+            missing = [k for k in missing if k.hash not in cached]
+
+        if self.best_match and missing:
+            return self.__search_best_match(j, row, evaluated, missing, start, done)
+
+        # The row is only started if all missing pairs fit into the budget
+        if self.__should_stop(start, done + len(missing)):
+            return None, None
+
+        if self.__batch and missing:
+            # The whole row is calculated at once, hence it can only be stopped before
+            distances = self.__base[FILTER_SIM_BATCH_METH](self.sim,
+                                                           self.__base[FILTER_BUFFER_METH](j),
+                                                           [self.__column_buffers[k] for k in missing])
+            for k, distance in zip(missing, distances):
+                row[k] = evaluated[k.hash] = distance
+        else:
+            for k in missing:
+                if self.__should_stop(start, 1):
+                    return None, None
                 # Calculate and store the similarity between j and k
-                self.filters[SIMILARITY_ELEMENTS][j][k] = self.__base[FILTER_SIM_METH](self.sim, j, k)
+                row[k] = evaluated[k.hash] = self.__base[FILTER_SIM_METH](self.sim, j, k)
+
+        if self.cache is not None:
+            # Keep the order of the columns, such that equally close elements are sorted as usual
+            row = {k: row[k] for k in self.__columns if k in row}
+        return row, evaluated
+
+    def get_unevaluated_elements(self):
+        """
+        Returns the elements of the first iterable, for which the similarity
+        was not calculated, because the calculation was stopped.
+        These elements are in none of the categories.
+        """
+        return list(self.__unevaluated)
+
+    def get_remainder(self):
+        """
+        Returns an estimate of the work that was not done, because the calculation was stopped.
 
-            # Store, that j has similar elements
-            if j.hash not in self.filters[HASHSUM_SIMILAR_ELEMENTS]:
-                self.filters[SIMILAR_ELEMENTS].add(j)
-                self.filters[HASHSUM_SIMILAR_ELEMENTS].append(j.hash)
+        The time is estimated from the average time per pair so far
+        and is None if no pair was evaluated.
+
+        :rtype: ElsimRemainder
+        """
+        pairs = len(self.__unevaluated) * len(self.__columns)
+        seconds = None
+        if self.__pairs_done:
+            seconds = self.__elapsed / self.__pairs_done * pairs
+        return ElsimRemainder(len(self.__unevaluated), pairs, seconds)
+
+    def stats(self):
+        """
+        Returns counters and timings of the calculation.
+
+        The following keys are in the dictionary:
+
+        * elements1, elements2: number of (not skipped) elements in each iterable
+        * skipped: number of skipped elements
+        * identical, similar, new, deleted: number of elements in each category
+        * rows, columns: the size of the similarity matrix
+        * pairs_total: the number of pairs in the similarity matrix
+        * pairs_evaluated: the number of pairs, for which FILTER_SIM_METH was called
+        * pairs_resumed: the number of pairs, which were taken from the checkpoint,
+          the previous result or the cache
+        * pairs_pruned: the number of pairs, which were never evaluated
+        * compressor_calls, compressor_cache_hits, compressor_bytes: the calls to the
+          :class:`~elsim.similarity.Similarity` object during the calculation of the similarity matrix,
+          the number of compressed sizes, which were taken from the cache, and the number
+          of bytes given to the compressor
+        * spilled: True if the similarity matrix was stored on disk
+        * time: a dictionary with the time in seconds, spent in the phases
+          elements (FILTER_ELEMENT_METH), checksum (creating the checksum objects, e.g. signatures),
+          hashing, identical, similarity (FILTER_SIM_METH),
+          sorting (FILTER_SORT_METH) and new.
+
+        If the first iterable is an :class:`ElsimIndex`, the time for creating its elements
+        and hashes is only spent once, but is included here.
+
+        :rtype: dict
+        """
+        pairs_total = len(self.__rows) * len(self.__columns)
+        calls, cache_hits, compressed_bytes = self.__sim_counters
+        return dict(
+            elements1=len(self.ref_set_ident[self.e1].elements),
+            elements2=len(self.ref_set_ident[self.e2].elements),
+            skipped=len(self.filters[SKIPPED_ELEMENTS]),
+            identical=len(self.filters[IDENTICAL_ELEMENTS]),
+            similar=len(self.filters[SIMILAR_ELEMENTS]),
+            new=len(self.filters[NEW_ELEMENTS]),
+            deleted=len(self.filters[DELETED_ELEMENTS]),
+            rows=len(self.__rows),
+            columns=len(self.__columns),
+            pairs_total=pairs_total,
+            pairs_evaluated=self.__pairs_done,
+            pairs_resumed=self.__pairs_resumed,
+            pairs_pruned=pairs_total - self.__pairs_done - self.__pairs_resumed,
+            compressor_calls=calls,
+            compressor_cache_hits=cache_hits,
+            compressor_bytes=compressed_bytes,
+            spilled=self.spilled,
+            time=dict(self.__timings),
+        )
+
+    def show_stats(self):
+        """
+        Print the counters and timings of :meth:`stats` to stdout
+        """
+        print_stats(self.stats())
+
+    def _sort_row(self, j):
+        """
+        Threshold the similarity values of a row and store the most similar item(s).
+
+        In theory, you could return more than one similar item, but this was never done before.
+
+        :returns: the list returned by FILTER_SORT_METH
+        """
+        sort_h = self.__base[FILTER_SORT_METH](j, self.filters[SIMILARITY_ELEMENTS][j], self.threshold)
+
+        # Store the similar Element(s)
+        self.filters[SIMILARITY_SORT_ELEMENTS][j] = set(i[0] for i in sort_h)
+        return sort_h
 
     def _init_sort_elements(self):
         """
-        Now we threshold the similarity value and get the most similar item(s)
+        Now we use the thresholded similarity values of each row.
         If there is no similar item with respect to the threhsold,
         we think this item got deleted.
-
-        In theory, you could return more than one similar item, but this was never done before.
         """
         deleted_elements = []
         for j in self.filters[SIMILAR_ELEMENTS]:
-            sort_h = self.__base[FILTER_SORT_METH](j, self.filters[SIMILARITY_ELEMENTS][j], self.threshold)
-
-            # Store the similar Element(s)
-            self.filters[SIMILARITY_SORT_ELEMENTS][j] = set(i[0] for i in sort_h)
-
-            if sort_h == []:
+            if not self.filters[SIMILARITY_SORT_ELEMENTS][j]:
                 # After thresholding, the element is not similar to anything
                 deleted_elements.append(j)
 
@@ -405,19 +1335,17 @@ class Elsim:
         We regard all items as new, if they are in the second iterable
         but do not have any connection from the first.
         """
-        # Check if some elements in the second file are totally new
-        for j in self.__elements[self.e2]:
-            # new elements can't be in similar elements
-            # and hashes can't be in first file, i.e. unique to second file
-            if j not in self.filters[SIMILAR_ELEMENTS] and j.hash not in self.__hashes[self.e1]:
-                is_new = True
-                # new elements can't be compared to another one
-                for diff_element in self.filters[SIMILAR_ELEMENTS]:
-                    if j in self.filters[SIMILARITY_SORT_ELEMENTS][diff_element]:
-                        is_new = False
-                        break
-
-                if is_new and j not in self.filters[NEW_ELEMENTS]:
+        # new elements can't be compared to another one
+        compared = set()
+        for diff_element in self.filters[SIMILAR_ELEMENTS]:
+            compared.update(self.filters[SIMILARITY_SORT_ELEMENTS][diff_element])
+
+        # Check if some elements in the second file are totally new,
+        # i.e. the hashes are unique to the second file
+        store2 = self.ref_set_ident[self.e2]
+        for i in self.__difference:
+            for j in store2.group(i):
+                if j not in compared:
                     self.filters[NEW_ELEMENTS].add(j)
 
     def split_elements(self):
@@ -505,6 +1433,35 @@ class Elsim:
         """
         return list(self.filters[SIMILARITY_SORT_ELEMENTS][i])[0]
 
+    def get_distance(self, i, j):
+        """
+        Returns the distance between element i from the first
+        and element j from the second iterable, as calculated by FILTER_SIM_METH.
+
+        The value is not calculated again but taken from the similarity matrix.
+        """
+        return self.filters[SIMILARITY_ELEMENTS][i][j]
+
+    def get_closest_element(self, i):
+        """
+        Returns a tuple of the closest element and its distance for element i,
+        regardless of the threshold.
+        If there are no elements to compare to, None is returned.
+        """
+        row = self.filters[SIMILARITY_ELEMENTS].get(i)
+        if not row:
+            return None
+        return min(row.items(), key=itemgetter(1))
+
+    def get_result(self):
+        """
+        Returns a detached snapshot of the comparison, which does not keep
+        any references to the elements.
+
+        :rtype: elsim.result.ElsimResult
+        """
+        return ElsimResult.from_elsim(self)
+
     def _similarity_threshold(self, value):
         """This basically sets the distance to maximum if a certain value is reached"""
         # TODO: I do not fully understand the rationale behind this...
@@ -534,32 +1491,25 @@ class Elsim:
         It is questionable if this is the correct way, as two empty sets are
         perfectly similar, but this shall be fixed in the future.
 
+        The score is only calculated once per combination of the flags,
+        until new rows are evaluated.
+
         :param bool new: Should new elements regarded as beeing dissimilar
         :param bool deleted: Should deleted elements regarded as beeing dissimilar
         """
-        values = []
-
-        for j in self.filters[SIMILAR_ELEMENTS]:
-            k = self.get_associated_element(j)
-            value = self.__base[FILTER_SIM_METH](self.sim, j, k)
-            # filter value
-            values.append(self._similarity_threshold(value))
-
-        # Identical Elements have a distance of 0
-        values.extend([self._similarity_threshold(0.0) for i in self.filters[IDENTICAL_ELEMENTS]])
-
-        if new:
-            # New Elements have a distance of 1
-            values.extend([self._similarity_threshold(1.0) for i in self.filters[NEW_ELEMENTS]])
-
-        if deleted:
-            # Deleted Elements have a distance of 1
-            values.extend([self._similarity_threshold(1.0) for i in self.filters[DELETED_ELEMENTS]])
-
-        # So actually we are calculating the NCS here from all the NCD values...
-        # As NCS = 1 - NCD, we just need to calculate that.
-        # Then we take the arithmetic mean and return it as percentage
-        return sum([1.0 - i for i in values]) / max(len(values), 1) * 100
+        key = (bool(new), bool(deleted))
+        if key not in self.__scores:
+            self.__scores[key] = self.__calculate_similarity_value(new, deleted)
+        return self.__scores[key]
+
+    def __calculate_similarity_value(self, new, deleted):
+        # The distances were already calculated in the similarity matrix
+        distances = [self.get_distance(j, self.get_associated_element(j)) for j in self.filters[SIMILAR_ELEMENTS]]
+        return similarity_value(distances,
+                                len(self.filters[IDENTICAL_ELEMENTS]),
+                                len(self.filters[NEW_ELEMENTS]) if new else 0,
+                                len(self.filters[DELETED_ELEMENTS]) if deleted else 0,
+                                self.similarity_threshold)
 
     def show(self, new=True, deleted=True, details=False):
         """
@@ -578,17 +1528,10 @@ class Elsim:
         d = len(self.get_deleted_elements())
         sk = len(self.get_skipped_elements())
 
-        # get the length of the digits and at least 3 digits
-        max_digits = max(max(map(len, map(str, [ik, s, n, d, sk]))), 3)
-
-        print("Compression:   {}".format(self.compressor.name))
-        print("    IDENTICAL: {:>{width}}".format(ik, width=max_digits))
-        print("    SIMILAR:   {:>{width}}".format(s, width=max_digits))
-        print("    NEW:       {:>{width}}{}".format(n, " **" if not new else "", width=max_digits))
-        print("    DELETED:   {:>{width}}{}".format(d, " **" if not deleted else "", width=max_digits))
-        print("    SKIPPED:   {:>{width}}".format(sk, width=max_digits))
-        print("")
-        print("Similarity:    {:>{width}.4f}%".format(self.get_similarity_value(new, deleted), width=max_digits+5))
+        print_summary(self.compressor.name, (ik, s, n, d, sk), self.get_similarity_value(new, deleted), new, deleted)
+        if self.partial:
+            remainder = self.get_remainder()
+            print("PARTIAL:       {} elements ({} pairs) were not evaluated".format(remainder.rows, remainder.pairs))
 
         if details:
             print()
@@ -623,12 +1566,39 @@ class Elsim:
 
 
 class Eldiff:
-    def __init__(self, iterator, F):
+    """
+    Calculates the differences between pairs of similar elements.
+
+    The diffs are calculated lazily: :meth:`show` prints every pair as soon as its diff is ready
+    and :meth:`get_added_elements` and :meth:`get_deleted_elements` calculate all diffs on first access.
+    Each diff is calculated only once.
+
+    If jobs or an executor is given and the filter dict contains DIFF_PREPARE, DIFF_COMPARE and
+    DIFF_FINISH, the diffs are calculated in a pool of processes, while at most queue_size
+    pairs are in flight.
+    """
+    def __init__(self, iterator, F, jobs=None, executor=None, queue_size=16):
+        """
+        :param iterator: yields tuples of similar elements
+        :param dict F: Some Filter dictionary
+        :param int jobs: number of processes to calculate the diffs (optional)
+        :param concurrent.futures.Executor executor: an existing pool of processes to use instead (optional)
+        :param int queue_size: maximal number of pairs, which are waiting for a result
+        """
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1!")
         self.iterator = iterator
         self.F = F
+        self.jobs = jobs
+        self.executor = executor
+        self.queue_size = queue_size
+
+        self.pairs = list(iterator)
+        # The diff of each pair, by the position of the pair
+        self.__diffs = dict()
 
         self._init_filters()
-        self._init_diff()
+        self.__filled = False
 
     def _init_filters(self):
         self.filters = {}
@@ -638,36 +1608,95 @@ class Eldiff:
         self.filters[LINK_ELEMENTS] = {}
 
     def _init_diff(self):
-        for i, j in self.iterator:
+        for i, j, x in self.diffs():
             self.filters[NEW_ELEMENTS][j] = []
             self.filters[DELETED_ELEMENTS][i] = []
 
-            x = self.F[DIFF](i, j)
-
             self.filters[NEW_ELEMENTS][j].extend(x.get_added_elements())
             self.filters[DELETED_ELEMENTS][i].extend(x.get_deleted_elements())
 
             self.filters[LINK_ELEMENTS][j] = i
+        self.__filled = True
 
-    def show(self):
-        for bb in self.filters[LINK_ELEMENTS]:
-            print(str(bb), str(self.filters[LINK_ELEMENTS][bb]))
+    def __parallel(self):
+        return (self.jobs is not None or self.executor is not None) and \
+            all(k in self.F for k in (DIFF_PREPARE, DIFF_COMPARE, DIFF_FINISH))
 
-            print("Added Elements(%d)" %
-                  (len(self.filters[NEW_ELEMENTS][bb])))
-            for i in self.filters[NEW_ELEMENTS][bb]:
+    def diffs(self, positions=None):
+        """
+        Yield a tuple of both elements and their diff for each pair, in the order of the pairs
+
+        :param list positions: only yield the pairs at these positions (optional)
+        """
+        if positions is None:
+            positions = range(len(self.pairs))
+        if not self.__parallel() or all(pos in self.__diffs for pos in positions):
+            for pos in positions:
+                i, j = self.pairs[pos]
+                if pos not in self.__diffs:
+                    self.__diffs[pos] = self.F[DIFF](i, j)
+                yield i, j, self.__diffs[pos]
+            return
+
+        executor = self.executor if self.executor is not None else ProcessPoolExecutor(self.jobs)
+        pending = deque()
+        try:
+            for pos in positions:
+                i, j = self.pairs[pos]
+                future = None
+                if pos not in self.__diffs:
+                    future = executor.submit(self.F[DIFF_COMPARE], self.F[DIFF_PREPARE](i, j))
+                pending.append((pos, future))
+                while len(pending) > self.queue_size:
+                    yield self.__collect(pending)
+            while pending:
+                yield self.__collect(pending)
+        finally:
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+            if executor is not self.executor:
+                executor.shutdown()
+
+    def __collect(self, pending):
+        pos, future = pending.popleft()
+        i, j = self.pairs[pos]
+        if future is not None:
+            self.__diffs[pos] = self.F[DIFF_FINISH](i, j, future.result())
+        return i, j, self.__diffs[pos]
+
+    def show(self):
+        # Like in the filters, only the last pair of each element of the second iterable is shown,
+        # at the position of its first pair
+        links = dict()
+        for pos, (_, j) in enumerate(self.pairs):
+            if j in links:
+                links[j][1] = pos
+            else:
+                links[j] = [pos, pos]
+
+        for i, bb, x in self.diffs([last for _, last in links.values()]):
+            added = list(x.get_added_elements())
+            deleted = list(x.get_deleted_elements())
+            print(str(bb), str(i))
+
+            print("Added Elements(%d)" % (len(added)))
+            for e in added:
                 print("\t", end=' ')
-                i.show()
+                e.show()
 
-            print("Deleted Elements(%d)" % (
-                len(self.filters[DELETED_ELEMENTS][self.filters[LINK_ELEMENTS][bb]])))
-            for i in self.filters[DELETED_ELEMENTS][self.filters[LINK_ELEMENTS][bb]]:
+            print("Deleted Elements(%d)" % (len(deleted)))
+            for e in deleted:
                 print("\t", end=' ')
-                i.show()
+                e.show()
             print()
 
     def get_added_elements(self):
+        if not self.__filled:
+            self._init_diff()
         return self.filters[NEW_ELEMENTS]
 
     def get_deleted_elements(self):
+        if not self.__filled:
+            self._init_diff()
         return self.filters[DELETED_ELEMENTS]
@@ -0,0 +1,195 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Persistent cache of pairwise distances
+
+The same pairs of elements are often compared again and again, for example
+the methods of a library which is shipped with many applications.
+The :class:`DistanceCache` stores the distance of each evaluated pair in a SQLite database,
+keyed by the hashes of both elements, the compressor, the compression level and the metric.
+:class:`~elsim.Elsim` looks up the distances of a row before evaluating FILTER_SIM_METH::
+
+    cache = DistanceCache("distances.sqlite", max_entries=10000000)
+    el = Elsim(ProxyDalvik(dx1), ProxyDalvik(dx2), FILTERS_DALVIK_SIM, cache=cache)
+    print(cache.stats())
+
+Elsim stores the distances under the metric of the cache and the names of the filter functions,
+thus the distances of different filter dicts are never mixed up.
+The metric is a free text, which must change whenever the filter functions compute
+distances differently, without changing their names.
+
+The database is opened in write-ahead-log mode and can be shared by many processes.
+A :class:`DistanceCache` can be pickled, each process opens its own connection.
+If the database grows beyond max_entries, the least recently used rows are removed.
+"""
+import sqlite3
+import time
+
+from elsim.checkpoint import format_hash
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS distances (
+    h1 TEXT NOT NULL,
+    h2 TEXT NOT NULL,
+    compressor TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    distance REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (h1, compressor, level, metric, h2)
+);
+CREATE INDEX IF NOT EXISTS distances_last_used ON distances (last_used);
+"""
+
+
+class DistanceCache:
+    """
+    Stores the distances of pairs of elements in a SQLite database
+    """
+    def __init__(self, filename, metric="default", max_entries=None, timeout=60.0):
+        """
+        :param str filename: path of the database, created if it does not exist
+        :param str metric: the name of the metric, which identifies the filter dict
+        :param int max_entries: maximal number of distances to keep (optional)
+        :param float timeout: seconds to wait for a lock, held by another process
+        """
+        if max_entries is not None and max_entries < 1:
+            raise ValueError("max_entries must be at least 1!")
+        self.filename = filename
+        self.metric = metric
+        self.max_entries = max_entries
+        self.timeout = timeout
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        self.__db = None
+        # Approximate number of entries, the database might be changed by other processes
+        self.__entries = None
+
+    def __getstate__(self):
+        # Every process opens its own connection and counts its own lookups
+        state = self.__dict__.copy()
+        state.update(hits=0, misses=0, stores=0, evictions=0,
+                     _DistanceCache__db=None, _DistanceCache__entries=None)
+        return state
+
+    @property
+    def db(self):
+        """
+        The connection to the database, opened on first use
+        """
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.filename, timeout=self.timeout)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.executescript(_SCHEMA)
+            self.__db.commit()
+        return self.__db
+
+    def get_row(self, h, compressor, level, columns, metric=None):
+        """
+        Returns the stored distances between the element h and the given columns
+
+        :param int h: the hash of the element of the row
+        :param str compressor: name of the compressor
+        :param int level: compression level
+        :param list columns: hashes of the elements of the columns
+        :param str metric: the metric of the distances, the metric of the cache if omitted
+        :returns: a dictionary of the hash of the column to the distance
+        :rtype: dict
+        """
+        if not columns:
+            return dict()
+        key = (format_hash(h), compressor, level, metric if metric is not None else self.metric)
+        wanted = {format_hash(c): c for c in columns}
+        with self.db:
+            cursor = self.db.execute("SELECT h2, distance FROM distances "
+                                     "WHERE h1 = ? AND compressor = ? AND level = ? AND metric = ?", key)
+            found = {wanted[h2]: distance for h2, distance in cursor if h2 in wanted}
+            if found and self.max_entries is not None:
+                # The whole row is marked as used, which is good enough for the eviction
+                self.db.execute("UPDATE distances SET last_used = ? "
+                                "WHERE h1 = ? AND compressor = ? AND level = ? AND metric = ?",
+                                (time.time(),) + key)
+        self.hits += len(found)
+        self.misses += len(columns) - len(found)
+        return found
+
+    def add_row(self, h, compressor, level, distances, metric=None):
+        """
+        Store the distances between the element h and other elements
+
+        :param int h: the hash of the element of the row
+        :param str compressor: name of the compressor
+        :param int level: compression level
+        :param dict distances: the hashes of the other elements and their distance
+        :param str metric: the metric of the distances, the metric of the cache if omitted
+        """
+        if not distances:
+            return
+        if metric is None:
+            metric = self.metric
+        now = time.time()
+        h1 = format_hash(h)
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO distances VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                [(h1, format_hash(k), compressor, level, metric, float(v), now)
+                                 for k, v in distances.items()])
+        self.stores += len(distances)
+
+        if self.max_entries is not None:
+            if self.__entries is None:
+                self.__entries = len(self)
+            else:
+                self.__entries += len(distances)
+            if self.__entries > self.max_entries:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries, until only 90% of max_entries are left
+        """
+        entries = len(self)
+        excess = entries - int(self.max_entries * 0.9)
+        if excess > 0:
+            with self.db:
+                self.db.execute("DELETE FROM distances WHERE rowid IN "
+                                "(SELECT rowid FROM distances ORDER BY last_used LIMIT ?)", (excess,))
+            self.evictions += excess
+            entries -= excess
+        self.__entries = entries
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM distances").fetchone()[0]
+
+    def stats(self):
+        """
+        Returns the number of hits, misses, stored and evicted distances of this object and the hit rate
+
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, stores=self.stores, evictions=self.evictions,
+                    hit_rate=self.hits / lookups if lookups else 0.0)
+
+    def close(self):
+        if self.__db is not None:
+            self.__db.close()
+            self.__db = None
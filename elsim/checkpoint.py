@@ -0,0 +1,162 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Checkpoints of the similarity matrix
+
+Calculating the similarity matrix of large iterables can take hours.
+A checkpoint file stores every finished row of the matrix, such that
+an interrupted comparison can be resumed without evaluating the same pairs again.
+
+The file is written in the JSON lines format. The first line contains the configuration,
+all other lines contain the distances of a single row::
+
+    {"version": 1, "compressor": "BZ2", "level": 9, "filters": {...}, "threshold": 0.6}
+    {"row": "<hash of element>", "distances": {"<hash of element>": 0.42, ...}}
+
+Elements are identified by their hash, hence the checkpoint is independent of the
+order of elements and can be reused, if elements are added or removed.
+If a row is resumed and new columns are evaluated, only their distances are appended
+in another line of the same row.
+Only the offsets of the lines are kept in memory, the distances are read from the file
+once a row is requested.
+
+The configuration contains everything, which changes the distances or their use:
+the compressor, the compression level, the functions of the filter dict and the threshold.
+It must be the same for the checkpoint to be valid.
+"""
+import json
+import logging
+import os
+
+CHECKPOINT_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+
+def format_hash(h):
+    """
+    Returns the hash as a hex string
+
+    :param int h: the 128bit hash
+    :rtype: str
+    """
+    return format(h, '032x')
+
+
+class Checkpoint:
+    """
+    Stores the rows of a similarity matrix in a file and reads them back
+
+    If the file exists, the positions of all rows are loaded and new rows are appended.
+    """
+    def __init__(self, filename, config):
+        """
+        :param str filename: path of the checkpoint file
+        :param dict config: the configuration which must match to resume, must be JSON serializable
+        """
+        self.filename = filename
+        # A round trip through JSON, such that tuples compare equal to the lists of the file
+        self.config = json.loads(json.dumps(dict(config, version=CHECKPOINT_VERSION)))
+        # The offsets of the lines of each row in the file, by the hex hash of the row
+        self.offsets = dict()
+        self.__fd = None
+        self.__reader = None
+
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self.__load()
+
+    def __load(self):
+        with open(self.filename, 'rb') as fp:
+            header = fp.readline()
+            if json.loads(header) != self.config:
+                raise ValueError("The checkpoint '{}' was created with a different configuration: {} != {}".format(
+                    self.filename, json.loads(header), self.config))
+
+            offset = len(header)
+            for line in iter(fp.readline, b''):
+                try:
+                    row = json.loads(line)["row"]
+                except ValueError:
+                    # The last line might be incomplete, if the process was killed while writing it
+                    log.warning("Ignoring incomplete line in checkpoint '%s'", self.filename)
+                else:
+                    self.offsets.setdefault(row, []).append(offset)
+                offset += len(line)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __contains__(self, h):
+        return format_hash(h) in self.offsets
+
+    def get_row(self, h):
+        """
+        Returns the stored distances of the row as a dictionary of hex hash to distance,
+        or an empty dictionary if the row was not stored.
+
+        :param int h: the hash of the element of the row
+        :rtype: dict
+        """
+        offsets = self.offsets.get(format_hash(h))
+        if not offsets:
+            return dict()
+        if self.__reader is None:
+            self.__reader = open(self.filename, 'rb')
+        row = dict()
+        for offset in offsets:
+            self.__reader.seek(offset)
+            row.update(json.loads(self.__reader.readline())["distances"])
+        return row
+
+    def add_row(self, h, distances):
+        """
+        Append the evaluated distances of a finished row to the checkpoint file
+
+        :param int h: the hash of the element of the row
+        :param dict distances: the hashes of the elements of the columns and their distance
+        """
+        if self.__fd is None:
+            write_header = not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0
+            self.__fd = open(self.filename, 'ab')
+            if write_header:
+                self.__fd.write(json.dumps(self.config).encode('utf-8') + b"\n")
+            elif not self.__ends_with_newline():
+                # terminate a partially written line
+                self.__fd.write(b"\n")
+
+        offset = self.__fd.tell()
+        line = {"row": format_hash(h), "distances": {format_hash(k): float(v) for k, v in distances.items()}}
+        self.__fd.write(json.dumps(line).encode('utf-8') + b"\n")
+        self.__fd.flush()
+        self.offsets.setdefault(format_hash(h), []).append(offset)
+
+    def __ends_with_newline(self):
+        with open(self.filename, 'rb') as fp:
+            fp.seek(-1, os.SEEK_END)
+            return fp.read(1) == b"\n"
+
+    def close(self):
+        if self.__fd is not None:
+            self.__fd.close()
+            self.__fd = None
+        if self.__reader is not None:
+            self.__reader.close()
+            self.__reader = None
@@ -0,0 +1,170 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+
+import click
+import numpy as np
+from tqdm import tqdm
+
+from elsim import ELSIM_VERSION
+from elsim import corpus
+from elsim.similarity import Compress
+
+
+def collect_files(paths):
+    """
+    Returns all files, directories are walked recursively.
+
+    The order of the files is stable, as it is used to distribute the work to shards.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path, followlinks=True):
+                dirs.sort()
+                files.extend(os.path.join(root, f) for f in sorted(names))
+        else:
+            files.append(path)
+    return files
+
+
+def parse_shard(ctx, param, value):
+    """
+    Parse the shard specification 'i/N'
+    """
+    if value is None:
+        return None
+    try:
+        shard, shards = map(int, value.split("/"))
+    except ValueError:
+        raise click.BadParameter("The shard must be given as i/N")
+    if shards < 1 or not 0 <= shard < shards:
+        raise click.BadParameter("The shard i/N requires 0 <= i < N")
+    return shard, shards
+
+
+@click.group()
+@click.version_option(ELSIM_VERSION)
+def cli():
+    """
+    Calculate the similarity of all samples in a corpus against each other
+    """
+
+
+@cli.command()
+@click.option("-o", "--output", required=True, type=click.Path(dir_okay=False),
+        help="The .npy file to write the similarity matrix to. "
+        "The names of the samples are written to the same filename with .json appended.")
+@click.option("--type", "sample_type", default="dalvik", type=click.Choice(sorted(corpus.SAMPLE_TYPES)),
+        show_default=True, help="The type of the samples")
+@click.option("-c", "--compressor", default="BZ2", type=click.Choice([x.name for x in Compress]),
+        show_default=True,
+        show_choices=True,
+        help="Set the compression method")
+@click.option("-t", "--threshold", default=0.6, type=click.FloatRange(0, 1),
+        help="Threshold when sorting interesting items")
+@click.option("-j", "--jobs", type=click.IntRange(1), help="Number of processes to use, all CPUs by default")
+@click.option("--progress", is_flag=True, help="Show the progress of the calculation on stderr")
+@click.option("--shard", callback=parse_shard,
+        help="Only calculate the shard i of N (i/N, starting at 0/N) and write it to the output as .npz file. "
+        "Use the merge command to combine all shards.")
+@click.argument("paths", nargs=-1, required=True)
+def compare(output, sample_type, compressor, threshold, jobs, progress, shard, paths):
+    """
+    Compare all samples against each other
+
+    The arguments are files or directories, which are searched recursively.
+    Files which can not be loaded are skipped.
+
+    The calculation can be split into N shards, which can run on different machines.
+    All shards must be given the same arguments, except for --shard and --output:
+
+        elsimcorpus compare --shard 0/2 -o shard0.npz corpus/
+
+        elsimcorpus compare --shard 1/2 -o shard1.npz corpus/
+
+        elsimcorpus merge -o matrix.npy shard0.npz shard1.npz
+    """
+    files = collect_files(paths)
+
+    if shard is not None:
+        total = sum(len(columns) for _, columns in corpus.shard_triangle(len(files), *shard))
+        bar = tqdm(total=total, unit="pairs", file=sys.stderr, disable=not progress)
+        try:
+            corpus.compute_shard(files, output, shard[0], shard[1], sample_type, threshold, compressor, jobs,
+                                 progress=bar.update)
+        finally:
+            bar.close()
+        return
+
+    samples = []
+    for f, sample in zip(files, corpus.extract_samples(files, sample_type, compressor, jobs, skip_errors=True)):
+        if sample is None:
+            click.echo(click.style("The file '{}' could not be loaded. Skipping.".format(f), fg='red'), err=True)
+            continue
+        samples.append(sample)
+
+    n = len(samples)
+    bar = tqdm(total=n * (n - 1) // 2, unit="pairs", file=sys.stderr, disable=not progress)
+    try:
+        corpus.compute_matrix(samples, output, threshold, compressor, jobs, progress=bar.update)
+    finally:
+        bar.close()
+
+
+@cli.command()
+@click.option("-o", "--output", required=True, type=click.Path(dir_okay=False),
+        help="The .npy file to write the similarity matrix to")
+@click.argument("shards", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def merge(output, shards):
+    """
+    Combine the shards of a sharded comparison into a similarity matrix
+    """
+    try:
+        matrix = corpus.merge_shards(shards, output)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    missing = int(np.count_nonzero(np.isnan(matrix)))
+    if missing:
+        click.echo(click.style("{} values are missing, as some files could not be loaded.".format(missing // 2),
+                               fg='red'), err=True)
+
+
+@cli.command()
+@click.option("-t", "--threshold", default=0.5, type=click.FloatRange(0, 1), show_default=True,
+        help="The maximal distance (1 - similarity) of samples inside a cluster")
+@click.option("-m", "--method", default="average", show_default=True,
+        type=click.Choice(["single", "complete", "average", "weighted", "centroid", "median", "ward"]),
+        help="The linkage method")
+@click.argument("matrix", type=click.Path(exists=True, dir_okay=False))
+def cluster(threshold, method, matrix):
+    """
+    Hierarchical clustering of a similarity matrix
+
+    Prints the cluster number and the name of each sample.
+    """
+    m, meta = corpus.load_matrix(matrix)
+    labels = corpus.cluster(m, threshold, method)
+    for label, name in sorted(zip(labels, meta["names"])):
+        click.echo("{}\t{}".format(label, name))
+
+
+if __name__ == "__main__":
+    cli()
@@ -15,13 +15,21 @@
 #
 # You should have received a copy of the GNU Lesser General Public License
 # along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import click
+from tqdm import tqdm
 
-from elsim import ELSIM_VERSION, Elsim, Eldiff
+from elsim import ELSIM_VERSION, Elsim, ElsimIndex, Eldiff
+from elsim.library import LibraryDB
+from elsim.qgram import ElsimQGram
+from elsim.result import ElsimResult
 from elsim.similarity import Compress
 from elsim.dalvik import (
+        AppFeatures,
         ProxyDalvikString,
         FILTERS_DALVIK_SIM_STRING,
         ProxyDalvik,
@@ -36,12 +44,79 @@ import elsim
 from elsim.utils import load_analysis
 
 
-def check_one_file(dx1, dx2, FS, threshold, compressor, details, view_strings, new, deleted, diff, score):
+class ProgressBar:
+    """
+    Shows the progress of an Elsim calculation on stderr
+    """
+    def __init__(self, desc):
+        self.bar = tqdm(desc=desc, unit="rows", file=sys.stderr, leave=False)
+
+    def __call__(self, progress):
+        """
+        :param elsim.ElsimProgress progress:
+        """
+        self.bar.total = progress.rows_total
+        self.bar.set_postfix(pairs="{}/{}".format(progress.pairs_done, progress.pairs_total))
+        self.bar.update(progress.rows_done - self.bar.n)
+
+    def close(self):
+        self.bar.close()
+
+
+def query(index, iterable, threshold, desc, progress, checkpoint=None, previous=None, jobs=None):
+    """
+    Query the index and show a progress bar if requested
+    """
+    if not progress:
+        return index.query(iterable, threshold, checkpoint=checkpoint, previous=previous, jobs=jobs)
+
+    bar = ProgressBar(desc)
+    try:
+        return index.query(iterable, threshold, progress=bar, checkpoint=checkpoint, previous=previous, jobs=jobs)
+    finally:
+        bar.close()
+
+
+def checkpoint_prefix(directory, filename):
+    """
+    Returns the prefix of the checkpoint files for comparing against filename,
+    or None if no checkpoint directory is used.
+    """
+    if not directory:
+        return None
+    return os.path.join(directory, hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest())
+
+
+def show_libraries(FS, el, features1, score):
+    """
+    Show the number of skipped methods of known libraries in both files
+    """
+    libraries = FS[elsim.FILTER_SKIPPED_METH].libraries(el.get_skipped_elements())
+    counts = dict()
+    for key, methods in libraries.items():
+        n1 = sum(1 for m in methods if m.features is features1)
+        counts[key] = (n1, len(methods) - n1)
+
+    if score:
+        click.echo("Libraries: {} / {}".format(sum(n1 for n1, _ in counts.values()),
+                                               sum(n2 for _, n2 in counts.values())))
+        return
+    print("Known library methods (first file / second file):")
+    for (library, version), (n1, n2) in sorted(counts.items()):
+        print("    {} {}: {} / {}".format(library, version, n1, n2))
+    print()
+
+
+def check_one_file(dx1, dx2, FS, threshold, compressor, details, view_strings, new, deleted, diff, score,
+                   index=None, index_strings=None, progress=False, checkpoint=None, stats=False,
+                   previous=None, save=None, jobs=None, qgram=False):
     """
     Show similarities between two dalvik containers
 
-    :param androguard.core.analysis.analysis.Analysis dx1: first file
-    :param androguard.core.analysis.analysis.Analysis dx2: second file
+    :param dx1: first file
+    :type dx1: androguard.core.analysis.analysis.Analysis or elsim.dalvik.AppFeatures
+    :param dx2: second file
+    :type dx2: androguard.core.analysis.analysis.Analysis or elsim.dalvik.AppFeatures
     :param dict FS: the filter basis
     :param str compressor: compressor name
     :param bool details: should extra information be shown
@@ -50,32 +125,69 @@ def check_one_file(dx1, dx2, FS, threshold, compressor, details, view_strings, n
     :param bool deleted: should the similarity score include deleted elements
     :param bool diff: display the difference
     :param bool score: only print the score
+    :param elsim.ElsimIndex index: prebuilt index of the methods of the first file (optional)
+    :param elsim.ElsimIndex index_strings: prebuilt index of the strings of the first file (optional)
+    :param bool progress: show the progress on stderr
+    :param str checkpoint: prefix of the checkpoint files to use (optional)
+    :param bool stats: print counters and timings of the calculation
+    :param elsim.result.ElsimResult previous: result of an earlier comparison of the methods (optional)
+    :param str save: filename to save the result of the comparison of the methods to (optional)
+    :param int jobs: number of processes to compare the methods and strings while they are extracted
+        and to calculate the diffs (optional)
+    :param bool qgram: compare each string of the first file only to the strings of the second file,
+        which share enough q-grams
     """
-    el = Elsim(ProxyDalvik(dx1), ProxyDalvik(dx2), FS, threshold, compressor)
+    # The elements of each file are shared by the comparisons of methods, strings and basic blocks
+    dx1 = AppFeatures.of(dx1, cache=True)
+    dx2 = AppFeatures.of(dx2, cache=True)
+    if index is None:
+        index = ElsimIndex(ProxyDalvik(dx1), FS, compressor)
+    el = query(index, ProxyDalvik(dx2), threshold, "Methods", progress,
+               checkpoint + ".methods.jsonl" if checkpoint else None, previous, jobs)
+    if save:
+        el.get_result().save(save)
     if score:
         click.echo("Methods: {:7.4f}".format(el.get_similarity_value(new, deleted)))
     else:
         print("Calculating similarity based on methods")
         el.show(new, deleted, details)
+    if getattr(FS[elsim.FILTER_SKIPPED_METH], "library", None) is not None:
+        show_libraries(FS, el, dx1, score)
+    if stats:
+        el.show_stats()
 
     if view_strings:
-        els = Elsim(ProxyDalvikString(dx1), ProxyDalvikString(dx2), FILTERS_DALVIK_SIM_STRING, threshold, compressor)
+        if index_strings is None:
+            index_strings = ElsimIndex(ProxyDalvikString(dx1), FILTERS_DALVIK_SIM_STRING, compressor)
+        if qgram:
+            els = ElsimQGram(index_strings, ProxyDalvikString(dx2), threshold=threshold)
+        else:
+            els = query(index_strings, ProxyDalvikString(dx2), threshold, "Strings", progress,
+                        checkpoint + ".strings.jsonl" if checkpoint else None, jobs=jobs)
         if score:
             click.echo("Strings: {:7.4f}".format(els.get_similarity_value(new, deleted)))
         else:
             print("Calculating similarity based on strings")
             els.show(new, deleted, details)
+        if stats:
+            els.show_stats()
 
     if diff and not score:
-        for i, j in el.split_elements():
-            # split_elements returns tuples of similar elements
-            # Get a list if "Method" objects
-            # Instead of using the similarity on the whole Method, we calculate the similarites between the basic blocks
-            # FIXME: having like thousand classes here seems to be overcomplicated...
-            elb = Elsim(ProxyDalvikMethod(i), ProxyDalvikMethod(j), FILTERS_DALVIK_BB, threshold, compressor)
-            eld = Eldiff(ProxyDalvikBasicBlock(elb), FILTERS_DALVIK_DIFF_BB)
-            ddm = DiffDalvikMethod(i, j, elb, eld)
-            ddm.show()
+        # A single pool of processes is shared by the diffs of all methods
+        executor = ProcessPoolExecutor(jobs) if jobs else None
+        try:
+            for i, j in el.split_elements():
+                # split_elements returns tuples of similar elements
+                # Get a list if "Method" objects
+                # Instead of using the similarity on the whole Method, we calculate the similarites between the basic blocks
+                # FIXME: having like thousand classes here seems to be overcomplicated...
+                elb = Elsim(ProxyDalvikMethod(i), ProxyDalvikMethod(j), FILTERS_DALVIK_BB, threshold, compressor)
+                eld = Eldiff(ProxyDalvikBasicBlock(elb), FILTERS_DALVIK_DIFF_BB, executor=executor)
+                ddm = DiffDalvikMethod(i, j, elb, eld)
+                ddm.show()
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
 
 @click.command()
@@ -100,8 +212,29 @@ def check_one_file(dx1, dx2, FS, threshold, compressor, details, view_strings, n
 @click.option("-x", "--xstrings", is_flag=True, help="display similarites of strings")
 @click.option("--score", is_flag=True, help="Only display the similarity score for the given APKs. "
         "The flags --deleted and --new still apply")
+@click.option("--progress", is_flag=True, help="Show the progress of the calculation on stderr")
+@click.option("--checkpoint", type=click.Path(file_okay=False),
+        help="Store finished parts of the calculation in this directory and resume from it, "
+        "if the calculation was interrupted")
+@click.option("--stats", is_flag=True, help="Print counters and timings of the calculation")
+@click.option("--save", type=click.Path(dir_okay=False),
+        help="Save the result of the comparison of the methods to this file (.json or .npz). "
+        "Only if the second argument is a file.")
+@click.option("--previous", type=click.Path(exists=True, dir_okay=False),
+        help="A result saved by --save from an earlier comparison against the same first file. "
+        "Only methods with new hashes are compared again.")
+@click.option("--library", type=click.Path(exists=True, dir_okay=False),
+        help="A database of known library methods, built by elsimlibrary. "
+        "These methods are skipped and reported separately.")
+@click.option("-j", "--jobs", type=click.IntRange(1),
+        help="Compare the elements of the second file in this number of processes, while they are extracted. "
+        "Also used to calculate the diffs of --diff")
+@click.option("--qgram", is_flag=True,
+        help="Compare each string only to the strings of the other file, which share enough q-grams (3-grams). "
+        "Much faster for files with many strings, but very short or reordered strings might not be found.")
 @click.argument('comp', nargs=2)
-def cli(details, diff, compressor, threshold, size, exclude, new, deleted, xstrings, score, comp):
+def cli(details, diff, compressor, threshold, size, exclude, new, deleted, xstrings, score, progress, checkpoint, stats,
+        save, previous, library, jobs, qgram, comp):
     """
     Compare a Dalvik based file against another file or a whole directory.
 
@@ -113,18 +246,37 @@ def cli(details, diff, compressor, threshold, size, exclude, new, deleted, xstri
 
     If --deleted or --new is not used, a '**' after the numbers indicates
     that these items were not used to calculate the similarity score.
+
+    With --checkpoint, the calculation can be resumed by running
+    the same command again.
     """
     dx1 = load_analysis(comp[0])
     if dx1 is None:
         raise click.BadParameter("The supplied file '{}' is not an APK or a DEX file!".format(comp[0]))
+    # The first file is used for all comparisons
+    dx1 = AppFeatures(dx1)
 
     FS = FILTERS_DALVIK_SIM
     if exclude:
         FS[elsim.FILTER_SKIPPED_METH].set_regexp(exclude)
     if size:
         FS[elsim.FILTER_SKIPPED_METH].set_size(size)
+    if library:
+        FS[elsim.FILTER_SKIPPED_METH].set_library(LibraryDB(library))
+
+    if checkpoint:
+        os.makedirs(checkpoint, exist_ok=True)
+
+    if previous:
+        previous = ElsimResult.load(previous)
 
     if os.path.isdir(comp[1]):
+        # The first file is compared against many others, hence we index it only once
+        index = ElsimIndex(ProxyDalvik(dx1), FS, compressor)
+        index_strings = None
+        if xstrings:
+            index_strings = ElsimIndex(ProxyDalvikString(dx1), FILTERS_DALVIK_SIM_STRING, compressor)
+
         for root, _, files in os.walk(comp[1], followlinks=True):
             for f in files:
                 real_filename = os.path.join(root, f)
@@ -132,12 +284,17 @@ def cli(details, diff, compressor, threshold, size, exclude, new, deleted, xstri
                 dx2 = load_analysis(real_filename)
                 if dx2 is None:
                     click.echo(click.style("The file '{}' is not an APK or DEX. Skipping.".format(real_filename), fg='red'), err=True)
-                check_one_file(dx1, dx2, FS, threshold, compressor, details, xstrings, new, deleted, diff, score)
+                    continue
+                check_one_file(dx1, dx2, FS, threshold, compressor, details, xstrings, new, deleted, diff, score,
+                               index, index_strings, progress, checkpoint_prefix(checkpoint, real_filename), stats,
+                               previous, jobs=jobs, qgram=qgram)
     else:
         dx2 = load_analysis(comp[1])
         if dx2 is None:
             raise click.BadParameter("The supplied file '{}' is not an APK or a DEX file!".format(comp[1]))
-        check_one_file(dx1, dx2, FS, threshold, compressor, details, xstrings, new, deleted, diff, score)
+        check_one_file(dx1, dx2, FS, threshold, compressor, details, xstrings, new, deleted, diff, score,
+                       progress=progress, checkpoint=checkpoint_prefix(checkpoint, comp[1]), stats=stats,
+                       previous=previous, save=save, jobs=jobs, qgram=qgram)
 
 
 if __name__ == "__main__":
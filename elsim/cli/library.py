@@ -0,0 +1,106 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import os
+from collections import Counter
+
+import click
+
+from elsim import ELSIM_VERSION
+from elsim.dalvik import ProxyDalvik
+from elsim.library import LibraryDB
+from elsim.similarity import Similarity
+from elsim.utils import load_analysis
+
+
+@click.group()
+@click.version_option(ELSIM_VERSION)
+@click.option("-d", "--database", required=True, type=click.Path(dir_okay=False), help="Use this database file")
+@click.pass_context
+def cli(ctx, database):
+    """
+    Build and query a database of methods of known libraries
+
+    The database can be used by dalviksim --library to skip the methods of known libraries.
+    """
+    ctx.obj = LibraryDB(database)
+
+
+@cli.command()
+@click.option("-l", "--library", required=True, help="The name of the library")
+@click.option("-v", "--version", "version", required=True, help="The version of the library")
+@click.option("-i", "--include", help="Only add classes whose name matches this regex, e.g. '^Lokhttp3/'")
+@click.option("-e", "--exclude", help="Do not add classes whose name matches this regex")
+@click.option("-s", "--size", default=1, type=click.IntRange(1), show_default=True,
+        help="The minimal length (bytes) of a method")
+@click.argument("filenames", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.pass_obj
+def add(database, library, version, include, exclude, size, filenames):
+    """
+    Add the methods of the given APK or DEX files as one version of a library
+    """
+    for f in filenames:
+        dx = load_analysis(f)
+        if dx is None:
+            click.echo(click.style("The file '{}' is not an APK or DEX. Skipping.".format(f), fg='red'), err=True)
+            continue
+        n = database.add(dx, library, version, include, exclude, size)
+        click.echo("{}: {} new methods".format(f, n))
+
+
+@cli.command()
+@click.pass_obj
+def show(database):
+    """
+    Shows the libraries and their number of methods
+    """
+    for library, version, n in database.libraries():
+        click.echo("{}\t{}\t{}".format(library, version, n))
+
+
+@cli.command()
+@click.argument("filenames", nargs=-1, required=True, type=click.Path(exists=True))
+@click.pass_obj
+def lookup(database, filenames):
+    """
+    Shows the number of methods of known libraries in the given files or directories
+    """
+    for path in filenames:
+        if os.path.isdir(path):
+            files = [os.path.join(root, f) for root, _, names in os.walk(path, followlinks=True) for f in names]
+        else:
+            files = [path]
+        for f in files:
+            dx = load_analysis(f)
+            if dx is None:
+                continue
+            proxy = ProxyDalvik(dx)
+            sim = Similarity()
+            counts = Counter()
+            total = 0
+            for m in proxy:
+                total += 1
+                found = database.lookup(proxy.features.method(m, sim).hash)
+                if found:
+                    counts[found[0]] += 1
+            click.echo("{}: {} of {} methods from known libraries".format(f, sum(counts.values()), total))
+            for (library, version), n in sorted(counts.items()):
+                click.echo("\t{}\t{}\t{}".format(library, version, n))
+
+
+if __name__ == "__main__":
+    cli()
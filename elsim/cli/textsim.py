@@ -29,8 +29,11 @@ from elsim.similarity import Compress
         show_choices=True,
         help="Set the compression method")
 @click.option("-t", "--threshold", default=0.6, type=click.FloatRange(0, 1), help="Threshold when sorting interesting items")
+@click.option("--stats", is_flag=True, help="Print counters and timings of the calculation")
+@click.option("-j", "--jobs", type=click.IntRange(1),
+        help="Compare the elements of the second file in this number of processes, while they are extracted")
 @click.argument('comp', nargs=2)
-def cli(details, compressor, threshold, comp):
+def cli(details, compressor, threshold, stats, jobs, comp):
     """
     Run a similarity measure on two text files
     """
@@ -39,8 +42,10 @@ def cli(details, compressor, threshold, comp):
     with open(comp[1], 'rb') as fp:
         b2 = fp.read()
 
-    el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=threshold, compressor=compressor)
+    el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=threshold, compressor=compressor, jobs=jobs)
     el.show(details=details)
+    if stats:
+        el.show_stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,524 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Pairwise similarity of a whole corpus of samples
+
+Comparing every sample of a corpus against every other sample with :class:`~elsim.Elsim`
+would analyse every sample over and over again.
+Instead, the elements of each sample are extracted once into a :class:`Sample`,
+which only contains the names, hashes and buffers of the elements and can be sent to
+other processes.
+The upper triangle of the sample-by-sample similarity matrix is then calculated
+in parallel and stored in a memory-mapped NumPy file.
+
+As the similarity value is not exactly symmetric (the rows of the similarity matrix
+are always taken from the first sample), only the value of comparing sample i
+against sample j with i < j is calculated and mirrored.
+
+Example::
+
+    samples = extract_samples(filenames, "dalvik", jobs=4)
+    matrix = compute_matrix(samples, "corpus.npy", jobs=4)
+    labels = cluster(matrix, 0.5)
+"""
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import elsim
+from elsim.filters import DetachedElement, FILTERS_DETACHED
+from elsim.similarity import Similarity, Compress
+
+CORPUS_VERSION = 1
+
+
+# The elements of a sample are detached elements
+CorpusElement = DetachedElement
+FILTERS_CORPUS = FILTERS_DETACHED
+
+
+class Sample:
+    """
+    The extracted elements of a single sample
+
+    The sample can be used as the iterable for :class:`~elsim.Elsim` together with
+    :data:`FILTERS_CORPUS`.
+    Skipped elements are not stored, as they do not change the similarity value.
+    """
+    def __init__(self, name, names, hashes, buffers):
+        """
+        :param str name: name of the sample, usually the filename
+        :param list names: the names of the elements
+        :param list hashes: the hashes of the elements
+        :param list buffers: the buffers of the elements, which are compared
+        """
+        self.name = name
+        self.names = names
+        self.hashes = hashes
+        self.buffers = buffers
+
+    @classmethod
+    def from_iterable(cls, name, iterable, F, sim):
+        """
+        Extract the elements of an iterable
+
+        :param str name: name of the sample
+        :param iterable: the iterable, e.g. :class:`~elsim.dalvik.ProxyDalvik`
+        :param dict F: the filter dictionary for the iterable, which must contain FILTER_BUFFER_METH
+        :param elsim.similarity.Similarity sim:
+        :rtype: Sample
+        """
+        if elsim.FILTER_BUFFER_METH not in F:
+            raise ValueError("The filter dict requires FILTER_BUFFER_METH!")
+        index = elsim.ElsimIndex(iterable, F, sim=sim)
+        return cls(name,
+                   [str(e) for e in index.elements],
+                   [e.hash for e in index.elements],
+                   [F[elsim.FILTER_BUFFER_METH](e) for e in index.elements])
+
+    def __iter__(self):
+        for args in zip(self.names, self.hashes, self.buffers):
+            yield CorpusElement(*args)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _load_dalvik(filename):
+    from elsim.utils import load_analysis
+    from elsim.dalvik import ProxyDalvik, FILTERS_DALVIK_SIM
+
+    dx = load_analysis(filename)
+    if dx is None:
+        raise ValueError("The file '{}' is not an APK or a DEX file!".format(filename))
+    return ProxyDalvik(dx), FILTERS_DALVIK_SIM
+
+
+def _load_dalvik_strings(filename):
+    from elsim.utils import load_analysis
+    from elsim.dalvik import ProxyDalvikString, FILTERS_DALVIK_SIM_STRING
+
+    dx = load_analysis(filename)
+    if dx is None:
+        raise ValueError("The file '{}' is not an APK or a DEX file!".format(filename))
+    return ProxyDalvikString(dx), FILTERS_DALVIK_SIM_STRING
+
+
+def _load_text(filename):
+    from elsim.text import ProxyText, FILTERS_TEXT
+
+    with open(filename, 'rb') as fp:
+        return ProxyText(fp.read()), FILTERS_TEXT
+
+
+# Maps the type of the samples to a function, which returns the iterable
+# and the filter dict for a file.
+SAMPLE_TYPES = {
+    "dalvik": _load_dalvik,
+    "dalvik-strings": _load_dalvik_strings,
+    "text": _load_text,
+}
+
+
+def _get_sim(compressor):
+    sim = Similarity()
+    sim.set_compress_type(Compress.by_name(compressor.upper()))
+    return sim
+
+
+def extract_sample(filename, sample_type="dalvik", compressor="BZ2"):
+    """
+    Load a single file and extract its elements
+
+    :param str filename: the file to load
+    :param str sample_type: one of :data:`SAMPLE_TYPES`
+    :param str compressor: the compressor, which is used when creating the elements
+    :rtype: Sample
+    """
+    if sample_type not in SAMPLE_TYPES:
+        raise ValueError("Unknown sample type '{}'".format(sample_type))
+    iterable, F = SAMPLE_TYPES[sample_type](filename)
+    return Sample.from_iterable(filename, iterable, F, _get_sim(compressor))
+
+
+def _extract_sample_or_none(filename, sample_type, compressor):
+    try:
+        return extract_sample(filename, sample_type, compressor)
+    except ValueError:
+        return None
+
+
+def extract_samples(filenames, sample_type="dalvik", compressor="BZ2", jobs=None, skip_errors=False):
+    """
+    Extract the elements of many files in parallel
+
+    :param list filenames: the files to load
+    :param str sample_type: one of :data:`SAMPLE_TYPES`
+    :param str compressor: the compressor, which is used when creating the elements
+    :param int jobs: number of processes, None to use all CPUs and 1 to not use extra processes
+    :param bool skip_errors: return None for files which can not be loaded, instead of raising a ValueError
+    :rtype: List[Sample]
+    """
+    func = _extract_sample_or_none if skip_errors else extract_sample
+    if jobs == 1:
+        return [func(f, sample_type, compressor) for f in filenames]
+
+    with ProcessPoolExecutor(jobs) as executor:
+        return list(executor.map(func, filenames,
+                                 [sample_type] * len(filenames),
+                                 [compressor] * len(filenames)))
+
+
+def compare_samples(a, b, sim, threshold=0.6):
+    """
+    Returns the similarity value of two samples in percent
+
+    :param Sample a:
+    :param Sample b:
+    :param elsim.similarity.Similarity sim:
+    :param float threshold: the threshold for the sort method
+    :rtype: float
+    """
+    return elsim.ElsimIndex(a, FILTERS_CORPUS, sim=sim).query(b, threshold).get_similarity_value()
+
+
+# The state of a worker process, set by _init_worker
+_worker = dict()
+
+
+def _init_worker(compressor, threshold):
+    _worker["sim"] = _get_sim(compressor)
+    _worker["threshold"] = threshold
+
+
+def _compare_row(samples, i, columns):
+    """
+    Compare sample i against the given samples
+
+    Samples which could not be loaded are None and result in NaN.
+
+    :param samples: maps the position of a sample to the :class:`Sample`
+    """
+    if samples[i] is None:
+        return i, columns, [np.nan] * len(columns)
+    # The index of sample i is built once for the whole row
+    index = elsim.ElsimIndex(samples[i], FILTERS_CORPUS, sim=_worker["sim"])
+    return i, columns, [np.nan if samples[j] is None else
+                        index.query(samples[j], _worker["threshold"]).get_similarity_value() for j in columns]
+
+
+def _compare_tile(samples, parts):
+    """
+    Compare the parts of a tile inside a worker process
+
+    :param dict samples: the samples of the rows and columns of the tile, by their position
+    :param list parts: list of tuples (row, columns)
+    """
+    return [_compare_row(samples, i, columns) for i, columns in parts]
+
+
+def _tiles(tasks, block_size):
+    """
+    Split the tasks into tiles of at most block_size rows and block_size columns
+
+    Yields a list of tuples (row, columns) for each tile.
+    """
+    tasks = sorted(tasks)
+    for start in range(0, len(tasks), block_size):
+        group = tasks[start:start + block_size]
+        columns = sorted({j for _, c in group for j in c})
+        for column_start in range(0, len(columns), block_size):
+            block = set(columns[column_start:column_start + block_size])
+            parts = [(i, [j for j in c if j in block]) for i, c in group]
+            parts = [(i, c) for i, c in parts if c]
+            if parts:
+                yield parts
+
+
+def upper_triangle(n):
+    """
+    Returns the rows of the upper triangle of a n x n matrix, without the diagonal,
+    as a list of tuples (row, columns)
+
+    :param int n:
+    :rtype: List[Tuple[int, List[int]]]
+    """
+    return [(i, list(range(i + 1, n))) for i in range(n - 1)]
+
+
+def shard_triangle(n, shard, shards):
+    """
+    Returns the part of the upper triangle, which belongs to the given shard,
+    in the same format as :func:`upper_triangle`.
+
+    The samples are split into B consecutive blocks, where B is the smallest number
+    with B * B >= 2 * shards. The upper triangle consists of the tiles between two blocks
+    and the halves of the tiles of a single block.
+    The tiles are distributed by their number of pairs, largest first, each to the shard
+    with the least pairs so far. Of equally loaded shards, the one which already requires
+    most of the samples of the tile is taken.
+    Thus, a shard only requires the samples of a few blocks, the shards have
+    roughly the same amount of work and the partitioning only depends on the number of samples.
+
+    :param int n: number of samples
+    :param int shard: the number of the shard, starting at 0
+    :param int shards: the total number of shards
+    :rtype: List[Tuple[int, List[int]]]
+    """
+    if not 0 <= shard < shards:
+        raise ValueError("The shard must be between 0 and {}".format(shards - 1))
+
+    count = min(max(n, 1), int(np.ceil(np.sqrt(2 * shards))))
+    blocks = [list(b) for b in np.array_split(np.arange(n), count)]
+
+    def pairs(tile):
+        a, b = tile
+        if a == b:
+            return len(blocks[a]) * (len(blocks[a]) - 1) // 2
+        return len(blocks[a]) * len(blocks[b])
+
+    tiles = [(a, b) for a in range(count) for b in range(a, count)]
+    tiles = sorted([t for t in tiles if pairs(t)], key=pairs, reverse=True)
+
+    loads = [0] * shards
+    required = [set() for _ in range(shards)]
+    rows = dict()
+    for tile in tiles:
+        s = min(range(shards), key=lambda x: (loads[x], len(set(tile) - required[x]), x))
+        loads[s] += pairs(tile)
+        required[s].update(tile)
+        if s != shard:
+            continue
+        a, b = tile
+        for i in blocks[a]:
+            columns = [int(j) for j in blocks[b] if j > i]
+            if columns:
+                rows.setdefault(int(i), []).extend(columns)
+    return [(i, sorted(rows[i])) for i in sorted(rows)]
+
+
+def create_matrix(filename, names, **meta):
+    """
+    Create a new similarity matrix file.
+
+    The matrix is filled with NaN and the diagonal is set to 100.
+    The names of the samples and the metadata are stored in a JSON file next to the matrix.
+
+    :param str filename: the .npy file to create
+    :param list names: names of the samples
+    :rtype: numpy.memmap
+    """
+    n = len(names)
+    matrix = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32, shape=(n, n))
+    matrix[:] = np.nan
+    np.fill_diagonal(matrix, 100.0)
+    matrix.flush()
+
+    with open(filename + ".json", 'w') as fp:
+        json.dump(dict(meta, version=CORPUS_VERSION, names=list(names)), fp)
+    return matrix
+
+
+def load_matrix(filename, mode='r'):
+    """
+    Load a similarity matrix and its metadata
+
+    :param str filename: the .npy file
+    :param str mode: the mode to open the memory-mapped file with
+    :returns: the matrix and the metadata, including the names of the samples
+    :rtype: Tuple[numpy.memmap, dict]
+    """
+    with open(filename + ".json", 'r') as fp:
+        meta = json.load(fp)
+    if meta.get("version") != CORPUS_VERSION:
+        raise ValueError("Unsupported corpus version '{}'".format(meta.get("version")))
+    return np.load(filename, mmap_mode=mode), meta
+
+
+def compute_rows(samples, tasks, threshold=0.6, compressor="BZ2", jobs=None, block_size=64):
+    """
+    Calculate the similarity values for the given rows and columns
+
+    Yields a tuple (row, columns, values) for each task, in no particular order.
+    If processes are used, the tasks are split into tiles of at most block_size rows
+    and block_size columns. Only the samples of a tile are sent to the process, which compares them,
+    thus a row might be yielded in several parts.
+
+    :param list samples: a list of :class:`Sample`, might contain None for samples
+        which are not available
+    :param list tasks: list of tuples (row, columns) as returned by :func:`upper_triangle`
+    :param float threshold: the threshold for the sort method
+    :param str compressor: the compressor name
+    :param int jobs: number of processes, None to use all CPUs and 1 to not use extra processes
+    :param int block_size: the maximal number of rows and columns of a tile
+    """
+    if jobs == 1:
+        _init_worker(compressor, threshold)
+        for i, columns in tasks:
+            yield _compare_row(samples, i, columns)
+    else:
+        with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(compressor, threshold)) as executor:
+            futures = []
+            for parts in _tiles(tasks, block_size):
+                needed = {i for i, _ in parts} | {j for _, columns in parts for j in columns}
+                futures.append(executor.submit(_compare_tile, {k: samples[k] for k in needed}, parts))
+            for future in as_completed(futures):
+                yield from future.result()
+
+
+def compute_matrix(samples, filename, threshold=0.6, compressor="BZ2", jobs=None, progress=None):
+    """
+    Calculate the similarity matrix of all samples
+
+    Only the upper triangle is calculated, the values are mirrored to the lower triangle.
+
+    :param list samples: a list of :class:`Sample`
+    :param str filename: the .npy file to store the matrix in
+    :param float threshold: the threshold for the sort method
+    :param str compressor: the compressor name
+    :param int jobs: number of processes, None to use all CPUs and 1 to not use extra processes
+    :param progress: callable, which is called with the number of finished pairs after each row
+    :rtype: numpy.memmap
+    """
+    matrix = create_matrix(filename, [s.name for s in samples],
+                           compressor=compressor, threshold=threshold)
+
+    for i, columns, values in compute_rows(samples, upper_triangle(len(samples)), threshold, compressor, jobs):
+        matrix[i, columns] = values
+        matrix[columns, i] = values
+        if progress is not None:
+            progress(len(columns))
+
+    matrix.flush()
+    return matrix
+
+
+def compute_shard(filenames, output, shard, shards, sample_type="dalvik", threshold=0.6, compressor="BZ2",
+                  jobs=None, progress=None):
+    """
+    Calculate a single shard of the similarity matrix of all files and write it to output.
+
+    Only the samples required for the shard are loaded.
+    Files, which can not be loaded, result in NaN values.
+    All shards must be calculated with the same list of files (in the same order)
+    and can be combined with :func:`merge_shards` afterwards.
+
+    :param list filenames: all files of the corpus
+    :param str output: the .npz file to write
+    :param int shard: the number of the shard, starting at 0
+    :param int shards: the total number of shards
+    :param str sample_type: one of :data:`SAMPLE_TYPES`
+    :param float threshold: the threshold for the sort method
+    :param str compressor: the compressor name
+    :param int jobs: number of processes, None to use all CPUs and 1 to not use extra processes
+    :param progress: callable, which is called with the number of finished pairs after each row
+    """
+    tasks = shard_triangle(len(filenames), shard, shards)
+
+    required = sorted({i for i, _ in tasks} | {j for _, columns in tasks for j in columns})
+    samples = [None] * len(filenames)
+    for i, sample in zip(required, extract_samples([filenames[i] for i in required],
+                                                   sample_type, compressor, jobs, skip_errors=True)):
+        samples[i] = sample
+
+    rows = []
+    columns = []
+    values = []
+    for i, c, v in compute_rows(samples, tasks, threshold, compressor, jobs):
+        rows.extend([i] * len(c))
+        columns.extend(c)
+        values.extend(v)
+        if progress is not None:
+            progress(len(c))
+
+    meta = dict(version=CORPUS_VERSION, names=list(filenames), sample_type=sample_type,
+                compressor=compressor, threshold=threshold, shard=shard, shards=shards)
+    with open(output, 'wb') as fp:
+        np.savez(fp,
+                 rows=np.array(rows, dtype=np.int32),
+                 columns=np.array(columns, dtype=np.int32),
+                 values=np.array(values, dtype=np.float32),
+                 meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8))
+
+
+def merge_shards(shard_files, filename):
+    """
+    Combine the shards written by :func:`compute_shard` into a single similarity matrix
+
+    All shards must belong to the same calculation and no shard may be missing.
+
+    :param list shard_files: the .npz files of all shards
+    :param str filename: the .npy file to store the matrix in
+    :rtype: numpy.memmap
+    """
+    shards = []
+    for f in shard_files:
+        with np.load(f, allow_pickle=False) as data:
+            meta = json.loads(data["meta"].tobytes().decode('utf-8'))
+            if meta.get("version") != CORPUS_VERSION:
+                raise ValueError("Unsupported corpus version '{}' in '{}'".format(meta.get("version"), f))
+            shards.append((meta, data["rows"], data["columns"], data["values"]))
+
+    if not shards:
+        raise ValueError("No shards given!")
+
+    config = {k: v for k, v in shards[0][0].items() if k != "shard"}
+    for meta, _, _, _ in shards:
+        if {k: v for k, v in meta.items() if k != "shard"} != config:
+            raise ValueError("The shards belong to different calculations!")
+    found = sorted(meta["shard"] for meta, _, _, _ in shards)
+    if found != list(range(config["shards"])):
+        raise ValueError("Expected the shards 0 to {}, but got {}".format(config["shards"] - 1, found))
+
+    matrix = create_matrix(filename, config["names"], sample_type=config["sample_type"],
+                           compressor=config["compressor"], threshold=config["threshold"])
+    for _, rows, columns, values in shards:
+        matrix[rows, columns] = values
+        matrix[columns, rows] = values
+
+    matrix.flush()
+    return matrix
+
+
+def cluster(matrix, threshold, method="average"):
+    """
+    Hierarchical clustering of the samples.
+
+    The distance of two samples is 1 - similarity / 100.
+    Requires scipy.
+
+    :param numpy.ndarray matrix: the similarity matrix in percent
+    :param float threshold: the maximal distance inside a cluster, between 0 and 1
+    :param str method: the linkage method, see :func:`scipy.cluster.hierarchy.linkage`
+    :returns: the cluster label for each sample, starting at 1
+    :rtype: numpy.ndarray
+    """
+    try:
+        from scipy.cluster.hierarchy import linkage, fcluster
+    except ImportError:
+        raise ImportError("Clustering requires scipy!")
+
+    n = len(matrix)
+    if n < 2:
+        return np.ones(n, dtype=int)
+
+    distances = 1.0 - np.asarray(matrix, dtype=np.float64)[np.triu_indices(n, 1)] / 100.0
+    if np.isnan(distances).any():
+        raise ValueError("The similarity matrix is not complete!")
+    return fcluster(linkage(np.clip(distances, 0, 1), method=method), threshold, criterion='distance')
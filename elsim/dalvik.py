@@ -23,19 +23,27 @@ import re
 from operator import itemgetter
 import mmh3
 
-from androguard.core.bytecodes import dvm
-
 from elsim import debug
 import elsim
-from elsim.filters import filter_sort_meth_basic, FilterNone
+from elsim.filters import (filter_sort_meth_basic, FilterNone, filter_buffer_meth_buff, filter_sim_meth_ncd,
+                           filter_sim_batch_meth_ncd, filter_sim_column_meth_ncd)
 from elsim import sign
+from elsim.diff import myers_diff
+from elsim.tokens import TokenTable
 
 
 class FilterSkip:
-    def __init__(self, size=1, regexp=None):
+    """
+    Skips methods which are too short or whose class name matches a regular expression.
+
+    If a :class:`~elsim.library.LibraryDB` is set, the methods of known libraries
+    are skipped as well, by looking up their hash before any comparison.
+    """
+    def __init__(self, size=1, regexp=None, library=None):
         # Minimal size of one should always be the case. We can not compare to empty strings.
         self.size = size
         self.regexp = regexp
+        self.library = library
 
     def skip(self, m):
         if m.get_length() < self.size:
@@ -44,6 +52,9 @@ class FilterSkip:
         if self.regexp and re.match(self.regexp, m.m.get_class_name()):
             return True
 
+        if self.library is not None and m.hash in self.library:
+            return True
+
         return False
 
     def set_regexp(self, e):
@@ -57,30 +68,92 @@ class FilterSkip:
             raise ValueError("size must be positive integer")
         self.size = e
 
+    def set_library(self, e):
+        """
+        :param elsim.library.LibraryDB e: the database of known library methods, or None
+        """
+        self.library = e
+
+    def libraries(self, elements):
+        """
+        Returns the skipped elements, which are methods of known libraries,
+        grouped by the name and version of the library.
+        A method which is part of several libraries is grouped under the first one.
+
+        :param elements: the skipped elements, e.g. from :meth:`elsim.Elsim.get_skipped_elements`
+        :rtype: Dict[Tuple[str, str], list]
+        """
+        res = dict()
+        if self.library is None:
+            return res
+        for m in elements:
+            found = self.library.lookup(m.hash)
+            if found:
+                res.setdefault(found[0], []).append(m)
+        return res
+
+
+def filter_element_meth_method(element, iterator, sim):
+    return iterator.features.method(element, sim)
+
+
+def filter_buffer_meth_signature(e):
+    return e.checksum.get_signature()
+
+
+def filter_sim_meth_signature(sim, e1, e2):
+    return sim.ncd(e1.checksum.get_signature(), e2.checksum.get_signature())
+
+
+def filter_element_meth_string(element, iterator, sim):
+    return iterator.features.string(element, sim)
+
+
+def filter_element_meth_basic_block(element, iterator, sim):
+    return iterator.features.basic_block(element, sim)
+
 
 FILTERS_DALVIK_SIM = {
-    elsim.FILTER_ELEMENT_METH: lambda element, iterator, sim: Method(iterator.vmx, iterator.sig, element, sim),
-    elsim.FILTER_SIM_METH: lambda sim, e1, e2: sim.ncd(e1.checksum.get_signature(), e2.checksum.get_signature()),
+    elsim.FILTER_ELEMENT_METH: filter_element_meth_method,
+    elsim.FILTER_SIM_METH: filter_sim_meth_signature,
+    elsim.FILTER_BUFFER_METH: filter_buffer_meth_signature,
+    elsim.FILTER_SIM_BATCH_METH: filter_sim_batch_meth_ncd,
+    elsim.FILTER_SIM_COLUMN_METH: filter_sim_column_meth_ncd,
     elsim.FILTER_SORT_METH: filter_sort_meth_basic,
     elsim.FILTER_SKIPPED_METH: FilterSkip(),
 }
 
 FILTERS_DALVIK_SIM_STRING = {
-        elsim.FILTER_ELEMENT_METH: lambda element, iterator, sim: StringVM(element, sim),
-        elsim.FILTER_SIM_METH: lambda sim, e1, e2: sim.ncd(e1.checksum.get_buff(), e2.checksum.get_buff()),
+        elsim.FILTER_ELEMENT_METH: filter_element_meth_string,
+        elsim.FILTER_SIM_METH: filter_sim_meth_ncd,
+        elsim.FILTER_BUFFER_METH: filter_buffer_meth_buff,
+        elsim.FILTER_SIM_BATCH_METH: filter_sim_batch_meth_ncd,
+        elsim.FILTER_SIM_COLUMN_METH: filter_sim_column_meth_ncd,
     elsim.FILTER_SORT_METH: filter_sort_meth_basic,
     elsim.FILTER_SKIPPED_METH: FilterNone,
 }
 
 FILTERS_DALVIK_BB = {
-    elsim.FILTER_ELEMENT_METH: lambda element, iterator, sim: BasicBlock(element, sim),
-    elsim.FILTER_SIM_METH: lambda sim, e1, e2: sim.ncd(e1.checksum.get_buff(), e2.checksum.get_buff()),
+    elsim.FILTER_ELEMENT_METH: filter_element_meth_basic_block,
+    elsim.FILTER_SIM_METH: filter_sim_meth_ncd,
+    elsim.FILTER_BUFFER_METH: filter_buffer_meth_buff,
+    elsim.FILTER_SIM_BATCH_METH: filter_sim_batch_meth_ncd,
+    elsim.FILTER_SIM_COLUMN_METH: filter_sim_column_meth_ncd,
     elsim.FILTER_SORT_METH: filter_sort_meth_basic,
     elsim.FILTER_SKIPPED_METH: FilterNone,
 }
 
 
 class CheckSumMeth:
+    """
+    The components of a method, which are used to compare it.
+
+    Every component is calculated on first use and kept afterwards.
+    Identical methods only require the buffer and its hash,
+    thus the expensive signature is only extracted for methods which are compared.
+    """
+    __slots__ = ('m1', 'sim', 'use_bytecode', '__buff', '__hash', '__entropy', '__signature', '__signature_entropy')
+
     def __init__(self, m1, sim, use_bytecode=False):
         """
         :param Method m1:
@@ -89,31 +162,51 @@ class CheckSumMeth:
         """
         self.m1 = m1
         self.sim = sim
+        self.use_bytecode = use_bytecode
 
-        self.buff = ""
-        self.signature = None
-        self.signature_entropy = None
+        self.__buff = None
+        self.__hash = None
+        self.__entropy = None
+        self.__signature = None
+        self.__signature_entropy = None
 
-        # This essentially creates a long string with
-        # all the instructions as names plus their operands in
-        # a human readable form
-        for i in m1.m.get_instructions():
-            self.buff += dvm.clean_name_instruction(i)
-            self.buff += dvm.static_operand_instruction(i)
+    @property
+    def buff(self):
+        if self.__buff is None:
+            # This essentially creates a long string with
+            # all the instructions as names plus their operands in
+            # a human readable form
+            tokens = self.m1.sig.tokens
+            ids, _ = tokens.method(self.m1.m)
+            self.__buff = tokens.buffer(ids)
+        return self.__buff
 
-        self.buff = self.buff.encode('UTF-8')
-        self.entropy = sim.entropy(self.buff)
+    @property
+    def entropy(self):
+        if self.__entropy is None:
+            self.__entropy = self.sim.entropy(self.buff)
+        return self.__entropy
 
-        if use_bytecode:
-            if self.m1.m.get_code():
-                self.signature = self.m1.m.get_code().get_bc().get_insn()
-                self.signature_entropy = self.sim.entropy(self.signature)
+    @property
+    def signature(self):
+        if self.__signature is None:
+            if not self.use_bytecode:
+                self.__signature = self.m1.sig.get_method_signature(
+                        self.m1.m, predef_sign=sign.PredefinedSignature.L0_4).get_string()
+            elif self.m1.m.get_code():
+                self.__signature = self.m1.m.get_code().get_bc().get_insn()
             else:
-                self.signature = b''
-                self.signature_entropy = 0.0
-        else:
-            self.signature = self.m1.sig.get_method_signature(self.m1.m, predef_sign=sign.PredefinedSignature.L0_4).get_string()
-            self.signature_entropy = self.sim.entropy(self.signature)
+                self.__signature = b''
+        return self.__signature
+
+    @property
+    def signature_entropy(self):
+        if self.__signature_entropy is None:
+            if self.use_bytecode and not self.signature:
+                self.__signature_entropy = 0.0
+            else:
+                self.__signature_entropy = self.sim.entropy(self.signature)
+        return self.__signature_entropy
 
     def get_signature(self):
         """
@@ -133,16 +226,20 @@ class CheckSumMeth:
     def get_buff(self):
         return self.buff
 
+    def get_hash(self):
+        if self.__hash is None:
+            self.__hash = mmh3.hash128(self.buff)
+        return self.__hash
+
 
 class CheckSumBB:
+    __slots__ = ('basic_block', 'buff', 'hash')
+
     def __init__(self, basic_block, sim):
         self.basic_block = basic_block
-        self.buff = ""
-        for i in self.basic_block.bb.get_instructions():
-            self.buff += dvm.clean_name_instruction(i)
-            self.buff += dvm.static_operand_instruction(i)
-
-        self.buff = self.buff.encode('UTF-8')
+        tokens = basic_block.tokens
+        ids, _ = tokens.basic_block(basic_block.bb)
+        self.buff = tokens.buffer(ids)
         self.hash = mmh3.hash128(self.buff)
 
     def get_buff(self):
@@ -156,17 +253,21 @@ class Method:
     """
     This object is used to calculate the similarity to another EncodedMethod
     """
-    def __init__(self, vmx, sig, m, sim):
+    __slots__ = ('m', 'vmx', 'sig', 'mx', 'sim', 'features', 'sort_h', '__hash', '__checksum')
+
+    def __init__(self, vmx, sig, m, sim, features=None):
         """
 
         :param androguard.core.analysis.analysis.Analysis vmx:
         :param androguard.core.bytecodes.dvm.EncodedMethod m:
+        :param AppFeatures features: the features of the file, which contains the method (optional)
         """
         self.m = m
         self.vmx = vmx
         self.sig = sig
         self.mx = vmx.get_method(m)
         self.sim = sim
+        self.features = features
 
         self.sort_h = []
 
@@ -189,14 +290,22 @@ class Method:
     @property
     def hash(self):
         if not self.__hash:
-            self.__hash = mmh3.hash128(self.checksum.get_buff())
+            self.__hash = self.checksum.get_hash()
         return self.__hash
 
 
 class BasicBlock:
-    def __init__(self, bb, sim):
+    __slots__ = ('bb', 'sim', 'tokens', '__hash', '__checksum')
+
+    def __init__(self, bb, sim, tokens=None):
+        """
+        :param androguard.core.analysis.analysis.DVMBasicBlock bb:
+        :param elsim.similarity.Similarity sim:
+        :param elsim.tokens.TokenTable tokens: the token table of the file (optional)
+        """
         self.bb = bb
         self.sim = sim
+        self.tokens = tokens if tokens is not None else TokenTable()
         self.__hash = None
         self.__checksum = None
 
@@ -216,13 +325,15 @@ class BasicBlock:
         return self.__hash
 
     def __str__(self):
-        return self.bb.name
+        return str(self.bb.name)
 
     def show(self):
         print(self.bb.name)
 
 
 class StringVM:
+    __slots__ = ('el', 'sim', '__hash', '__checksum')
+
     def __init__(self, el, sim):
         self.el = el
         self.sim = sim
@@ -249,6 +360,8 @@ class StringVM:
 
 
 class CheckSumString:
+    __slots__ = ('m1', 'sim', 'buff')
+
     def __init__(self, m1, sim):
         self.m1 = m1
         self.sim = sim
@@ -260,16 +373,113 @@ class CheckSumString:
         return self.buff
 
 
+class AppFeatures:
+    """
+    The elements of a single analysed file, which are shared by all comparisons against it.
+
+    The methods, strings and basic blocks are only wrapped once, thus their hashes, buffers
+    and signatures are only calculated once, even if the file is compared by methods,
+    by strings and by basic blocks, or against many other files.
+    The file also gets a single :class:`~elsim.sign.Signature` and thus a single token table.
+
+    The elements keep the Similarity object of their first comparison, which is only used
+    to calculate entropies and hence does not depend on the compressor.
+
+    The proxies accept either an Analysis or an AppFeatures object::
+
+        features1 = AppFeatures(dx1)
+        features2 = AppFeatures(dx2)
+        el = Elsim(ProxyDalvik(features1), ProxyDalvik(features2), FILTERS_DALVIK_SIM)
+        els = Elsim(ProxyDalvikString(features1), ProxyDalvikString(features2), FILTERS_DALVIK_SIM_STRING)
+
+    Both sides of a single comparison must not share an AppFeatures object,
+    as the elements of both iterables have to be distinct objects.
+
+    The elements are only kept if cache is set, which is the default for AppFeatures objects
+    created explicitly. A proxy, which gets an Analysis, creates an AppFeatures object
+    without cache. Hence, the elements of a file, which is streamed by :class:`~elsim.stream.ElsimStream`,
+    are not kept for the lifetime of the proxy.
+    """
+    def __init__(self, vmx, sig=None, cache=True):
+        """
+        :param androguard.core.analysis.analysis.Analysis vmx:
+        :param elsim.sign.Signature sig: an existing Signature of the Analysis (optional)
+        :param bool cache: should the wrapped elements be kept
+        """
+        self.vmx = vmx
+        self.sig = sig if sig is not None else sign.Signature(vmx)
+        self.tokens = self.sig.tokens
+        self.cache = cache
+
+        self.__methods = dict()
+        self.__strings = dict()
+        self.__basic_blocks = dict()
+
+    @classmethod
+    def of(cls, vmx, cache=False):
+        """
+        Returns vmx if it is already an AppFeatures object, otherwise a new one for the Analysis
+
+        :param bool cache: should the elements be kept, if a new AppFeatures object is created
+        """
+        if isinstance(vmx, cls):
+            return vmx
+        return cls(vmx, cache=cache)
+
+    def __len__(self):
+        """Returns the number of kept elements"""
+        return len(self.__methods) + len(self.__strings) + len(self.__basic_blocks)
+
+    def method(self, m, sim):
+        """
+        :param androguard.core.bytecodes.dvm.EncodedMethod m:
+        :param elsim.similarity.Similarity sim:
+        :rtype: Method
+        """
+        if not self.cache:
+            return Method(self.vmx, self.sig, m, sim, self)
+        if m not in self.__methods:
+            self.__methods[m] = Method(self.vmx, self.sig, m, sim, self)
+        return self.__methods[m]
+
+    def string(self, value, sim):
+        """
+        :param androguard.core.mutf8.MUTF8String value:
+        :param elsim.similarity.Similarity sim:
+        :rtype: StringVM
+        """
+        if not self.cache:
+            return StringVM(value, sim)
+        # The strings of an Analysis are unique
+        if value not in self.__strings:
+            self.__strings[value] = StringVM(value, sim)
+        return self.__strings[value]
+
+    def basic_block(self, bb, sim):
+        """
+        :param androguard.core.analysis.analysis.DVMBasicBlock bb:
+        :param elsim.similarity.Similarity sim:
+        :rtype: BasicBlock
+        """
+        if not self.cache:
+            return BasicBlock(bb, sim, self.tokens)
+        if bb not in self.__basic_blocks:
+            self.__basic_blocks[bb] = BasicBlock(bb, sim, self.tokens)
+        return self.__basic_blocks[bb]
+
+
 class ProxyDalvik:
     """
     A simple proxy which uses the methods for comparison
     """
     def __init__(self, vmx):
         """
-        :param androgaurd.core.analysis.analysis.Analysis vmx:
+        :param vmx: the file, a new AppFeatures object without cache is created for an Analysis
+        :type vmx: androguard.core.analysis.analysis.Analysis or AppFeatures
         """
-        self.vmx = vmx
-        self.sig = sign.Signature(vmx)
+        self.features = AppFeatures.of(vmx)
+        self.vmx = self.features.vmx
+        self.sig = self.features.sig
 
     def __iter__(self):
         """
@@ -287,6 +497,8 @@ class ProxyDalvikMethod:
         :param Method el:
         """
         self.el = el
+        self.features = el.features if el.features is not None else AppFeatures(el.vmx, el.sig, cache=False)
+        self.tokens = self.features.tokens
 
     def __iter__(self):
         yield from self.el.mx.basic_blocks.get()
@@ -294,65 +506,18 @@ class ProxyDalvikMethod:
 
 class ProxyDalvikString:
     def __init__(self, vmx):
-        self.vmx = vmx
+        """
+        :param vmx: the file, a new AppFeatures object without cache is created for an Analysis
+        :type vmx: androguard.core.analysis.analysis.Analysis or AppFeatures
+        """
+        self.features = AppFeatures.of(vmx)
+        self.vmx = self.features.vmx
 
     def __iter__(self):
         for i in self.vmx.get_strings():
             yield i.get_value()
 
 
-def LCS(X, Y):
-    """Longest Common Subsequence"""
-    m = len(X)
-    n = len(Y)
-    # An (m+1) times (n+1) matrix
-    C = [[0] * (n+1) for i in range(m+1)]
-    for i in range(1, m+1):
-        for j in range(1, n+1):
-            if X[i-1] == Y[j-1]:
-                C[i][j] = C[i-1][j-1] + 1
-            else:
-                C[i][j] = max(C[i][j-1], C[i-1][j])
-    return C
-
-
-def getDiff(C, X, Y, i, j, a, r):
-    if i > 0 and j > 0 and X[i-1] == Y[j-1]:
-        getDiff(C, X, Y, i-1, j-1, a, r)
-        debug(" " + "%02X" % ord(X[i-1]))
-    else:
-        if j > 0 and (i == 0 or C[i][j-1] >= C[i-1][j]):
-            getDiff(C, X, Y, i, j-1, a, r)
-            a.append((j-1, Y[j-1]))
-            debug(" + " + "%02X" % ord(Y[j-1]))
-        elif i > 0 and (j == 0 or C[i][j-1] < C[i-1][j]):
-            getDiff(C, X, Y, i-1, j, a, r)
-            r.append((i-1, X[i-1]))
-            debug(" - " + "%02X" % ord(X[i-1]))
-
-
-def toString(bb, hS, rS):
-    map_x = {}
-    S = ""
-
-    idx = 0
-    nb = 0
-    for i in bb.get_instructions():
-        ident = dvm.clean_name_instruction(i)
-        ident += dvm.static_operand_instruction(i)
-
-        if ident not in hS:
-            hS[ident] = len(hS)
-            rS[chr(hS[ident])] = ident
-
-        S += chr(hS[ident])
-        map_x[nb] = idx
-        idx += i.get_length()
-        nb += 1
-
-    return S, map_x
-
-
 class DiffInstruction:
     def __init__(self, bb, instruction):
         self.bb = bb
@@ -382,49 +547,75 @@ class DiffBasicBlock:
             yield DiffInstruction(self.basic_block_y, i)
 
 
-def filter_diff_bb(x, y):
-    final_add = []
-    final_rm = []
+def filter_diff_bb_prepare(x, y):
+    """
+    Returns the token ids of both basic blocks, or the tokens if both come from different files
+    """
+    X, _ = x.tokens.basic_block(x.bb)
+    Y, _ = y.tokens.basic_block(y.bb)
+    if x.tokens is not y.tokens:
+        X = [x.tokens.tokens[i] for i in X]
+        Y = [y.tokens.tokens[i] for i in Y]
+    return X, Y
 
-    hS = {}
-    rS = {}
 
-    X, map_x = toString(x.bb, hS, rS)
-    Y, map_y = toString(y.bb, hS, rS)
+def filter_diff_bb_compare(state):
+    """
+    Returns the positions of the added and removed instructions of two token sequences from
+    :func:`filter_diff_bb_prepare`
+    """
+    X, Y = state
 
     debug("%s %d" % (repr(X), len(X)))
     debug("%s %d" % (repr(Y), len(Y)))
 
-    m = len(X)
-    n = len(Y)
-
-    C = LCS(X, Y)
-    a = []
-    r = []
-
-    getDiff(C, X, Y, m, n, a, r)
+    a, r = myers_diff(X, Y)
     debug(a)
     debug(r)
 
+    return a, r
+
+
+def filter_diff_bb_finish(x, y, result):
+    """
+    Creates the DiffBasicBlock from the result of :func:`filter_diff_bb_compare`
+    """
+    added, removed = result
+    final_add = []
+    final_rm = []
+
+    # The offsets of the instructions inside the basic blocks
+    _, map_x = x.tokens.basic_block(x.bb)
+    map_x = [i - map_x[0] for i in map_x]
+    _, map_y = y.tokens.basic_block(y.bb)
+    map_y = [i - map_y[0] for i in map_y]
+
     debug("DEBUG ADD")
-    for i in a:
-        instructions = [j for j in y.bb.get_instructions()]
+    instructions = list(y.bb.get_instructions())
+    for i in added:
         debug(" \t %s %s %s" % (
-            i[0], instructions[i[0]].get_name(), instructions[i[0]].get_output()))
-        final_add.append((i[0], map_y[i[0]], instructions[i[0]]))
+            i, instructions[i].get_name(), instructions[i].get_output()))
+        final_add.append((i, map_y[i], instructions[i]))
 
     debug("DEBUG REMOVE")
-    for i in r:
-        instructions = [j for j in x.bb.get_instructions()]
+    instructions = list(x.bb.get_instructions())
+    for i in removed:
         debug(" \t %s %s %s" % (
-            i[0], instructions[i[0]].get_name(), instructions[i[0]].get_output()))
-        final_rm.append((i[0], map_x[i[0]], instructions[i[0]]))
+            i, instructions[i].get_name(), instructions[i].get_output()))
+        final_rm.append((i, map_x[i], instructions[i]))
 
     return DiffBasicBlock(y, x, final_add, final_rm)
 
 
+def filter_diff_bb(x, y):
+    return filter_diff_bb_finish(x, y, filter_diff_bb_compare(filter_diff_bb_prepare(x, y)))
+
+
 FILTERS_DALVIK_DIFF_BB = {
     elsim.DIFF: filter_diff_bb,
+    elsim.DIFF_PREPARE: filter_diff_bb_prepare,
+    elsim.DIFF_COMPARE: filter_diff_bb_compare,
+    elsim.DIFF_FINISH: filter_diff_bb_finish,
 }
 
 
@@ -0,0 +1,127 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Shortest edit scripts between two sequences
+
+Implements the linear space variant of Myers (1986): An O(ND) Difference Algorithm and Its Variations.
+The time is O((N + M) D) and the space O(N + M), where D is the number of added and removed items.
+Instead of the full table of the longest common subsequence, only the furthest reaching
+paths of the current edit distance are kept. The sequences are split at the middle snake
+of an optimal path, until the remaining parts differ by at most one item.
+The parts are processed from a stack, thus long sequences do not hit the recursion limit.
+
+The items of both sequences only need to be comparable by equality,
+e.g. strings, lists of tokens or arrays of integers.
+"""
+
+
+def _middle_snake(a, a0, a1, b, b0, b1):
+    """
+    Find the middle snake of an optimal path between a[a0:a1] and b[b0:b1]
+
+    Returns the edit distance and the start and end of the snake in absolute positions.
+
+    :rtype: Tuple[int, int, int, int, int]
+    """
+    n = a1 - a0
+    m = b1 - b0
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    # Diagonal k is stored at k + offset
+    offset = max_d + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1 + offset] < forward[k + 1 + offset]):
+                x = forward[k + 1 + offset]
+            else:
+                x = forward[k - 1 + offset] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            forward[k + offset] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[delta - k + offset] >= n:
+                return 2 * d - 1, a0 + x0, b0 + y0, a0 + x, b0 + y
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1 + offset] < backward[k + 1 + offset]):
+                x = backward[k + 1 + offset]
+            else:
+                x = backward[k - 1 + offset] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a1 - x - 1] == b[b1 - y - 1]:
+                x += 1
+                y += 1
+            backward[k + offset] = x
+            if not odd and -d <= delta - k <= d and x + forward[delta - k + offset] >= n:
+                return 2 * d, a1 - x, b1 - y, a1 - x0, b1 - y0
+
+    raise AssertionError("No middle snake found")
+
+
+def myers_diff(a, b):
+    """
+    Returns the positions of the items added in b and the items removed from a
+    of a shortest edit script, which transforms a into b
+
+    :param a: the old sequence
+    :param b: the new sequence
+    :returns: the sorted positions in b and the sorted positions in a
+    :rtype: Tuple[list, list]
+    """
+    added = []
+    removed = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a0, a1, b0, b1 = stack.pop()
+
+        # Common prefix and suffix are never part of the edit script
+        while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+            a0 += 1
+            b0 += 1
+        while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+            a1 -= 1
+            b1 -= 1
+
+        if a0 == a1:
+            added.extend(range(b0, b1))
+            continue
+        if b0 == b1:
+            removed.extend(range(a0, a1))
+            continue
+
+        d, x, y, u, v = _middle_snake(a, a0, a1, b, b0, b1)
+        if d <= 1:
+            # Both parts only differ by one item, which is not part of the common prefix and suffix
+            if a1 - a0 > b1 - b0:
+                removed.append(a0)
+            else:
+                added.append(b0)
+            continue
+        stack.append((u, a1, v, b1))
+        stack.append((a0, x, b0, y))
+
+    added.sort()
+    removed.sort()
+    return added, removed
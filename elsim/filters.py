@@ -17,9 +17,14 @@
 # along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
 """
 Generic Filters for the use with Elsim
+
+All functions and classes of the filter dicts are defined on module level,
+such that the filter dicts can be pickled and sent to other processes.
 """
 from operator import itemgetter
 
+import elsim
+
 def filter_sort_meth_basic(element, similar_elements, value):
     """
     This filter sorts the items and returns the
@@ -61,3 +66,104 @@ class FilterEmpty:
             return True
 
         return False
+
+
+def filter_buffer_meth_buff(element):
+    """
+    Returns the buffer of the checksum object of the element
+    """
+    return element.checksum.get_buff()
+
+
+def filter_sim_meth_ncd(sim, element1, element2):
+    """
+    Calculate the NCD between the buffers of the checksum objects
+    """
+    return sim.ncd(element1.checksum.get_buff(), element2.checksum.get_buff())
+
+
+def filter_sim_batch_meth_ncd(sim, buff, buffs):
+    """
+    Calculate the NCD between one buffer and many others
+    """
+    return sim.ncd_row(buff, buffs)
+
+
+def filter_sim_column_meth_ncd(sim, buffs, buff):
+    """
+    Calculate the NCD between many buffers and one other
+    """
+    return sim.ncd_column(buffs, buff)
+
+
+class DetachedElement:
+    """
+    A detached element, which only holds its name, hash and the buffer to compare,
+    together with an optional dictionary of cheap features.
+
+    In contrast to the elements of the iterables, which usually hold references
+    to the analysis objects, it is small and can be sent to other processes.
+    Use it with :data:`FILTERS_DETACHED`.
+    """
+    __slots__ = ('name', 'hash', 'buff', 'features')
+
+    def __init__(self, name, h, buff, features=None):
+        """
+        :param str name: the name of the element, usually str() of the original element
+        :param int h: the hash of the element
+        :param bytes buff: the buffer which is compared
+        :param dict features: cheap features of the element, e.g. sizes or entropies (optional)
+        """
+        self.name = name
+        self.hash = h
+        self.buff = buff
+        self.features = features
+
+    @classmethod
+    def from_element(cls, element, F, features=None):
+        """
+        Detach an element of an iterable
+
+        :param element: the element, as created by FILTER_ELEMENT_METH
+        :param dict F: the filter dict of the element, which must contain FILTER_BUFFER_METH
+        :param dict features: cheap features of the element (optional)
+        :rtype: DetachedElement
+        """
+        return cls(str(element), element.hash, F[elsim.FILTER_BUFFER_METH](element), features)
+
+    @property
+    def checksum(self):
+        return self
+
+    def get_buff(self):
+        return self.buff
+
+    def __getstate__(self):
+        return self.name, self.hash, self.buff, self.features
+
+    def __setstate__(self, state):
+        self.name, self.hash, self.buff, self.features = state
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return str(self)
+
+
+def filter_element_meth_detached(element, iterable, sim):
+    """
+    Detached elements are already elements
+    """
+    return element
+
+
+FILTERS_DETACHED = {
+    elsim.FILTER_ELEMENT_METH: filter_element_meth_detached,
+    elsim.FILTER_SIM_METH: filter_sim_meth_ncd,
+    elsim.FILTER_BUFFER_METH: filter_buffer_meth_buff,
+    elsim.FILTER_SIM_BATCH_METH: filter_sim_batch_meth_ncd,
+    elsim.FILTER_SIM_COLUMN_METH: filter_sim_column_meth_ncd,
+    elsim.FILTER_SORT_METH: filter_sort_meth_basic,
+    elsim.FILTER_SKIPPED_METH: FilterNone,
+}
@@ -0,0 +1,161 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Database of methods of known libraries
+
+Most methods of an application usually come from third-party libraries.
+Comparing them is expensive and does not tell much about the application itself.
+The :class:`LibraryDB` maps the hashes of the methods of known libraries to the name
+and version of the library. The hash is the same as the one of :class:`~elsim.dalvik.Method`,
+thus a single lookup identifies a library method without any compression.
+
+The database is built from files, which contain the libraries, e.g. with the
+``elsimlibrary`` command, and is passed to :class:`~elsim.dalvik.FilterSkip`::
+
+    FILTERS_DALVIK_SIM[FILTER_SKIPPED_METH].set_library(LibraryDB("libraries.sqlite"))
+    el = Elsim(ProxyDalvik(dx1), ProxyDalvik(dx2), FILTERS_DALVIK_SIM)
+    libraries = FILTERS_DALVIK_SIM[FILTER_SKIPPED_METH].libraries(el.get_skipped_elements())
+
+Library methods are skipped and do not count towards the similarity value.
+"""
+import re
+import sqlite3
+
+from elsim.checkpoint import format_hash
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS methods (
+    hash TEXT NOT NULL,
+    library TEXT NOT NULL,
+    version TEXT NOT NULL,
+    PRIMARY KEY (hash, library, version)
+);
+"""
+
+
+class LibraryDB:
+    """
+    Maps the hashes of methods to the libraries and versions, which contain them
+    """
+    def __init__(self, filename, timeout=60.0):
+        """
+        :param str filename: path of the database, created if it does not exist
+        :param float timeout: seconds to wait for a lock, held by another process
+        """
+        self.filename = filename
+        self.timeout = timeout
+        self.__db = None
+
+    def __getstate__(self):
+        # Every process opens its own connection
+        state = self.__dict__.copy()
+        state["_LibraryDB__db"] = None
+        return state
+
+    @property
+    def db(self):
+        """
+        The connection to the database, opened on first use
+        """
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.filename, timeout=self.timeout)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.executescript(_SCHEMA)
+            self.__db.commit()
+        return self.__db
+
+    def add_hashes(self, hashes, library, version):
+        """
+        Store the hashes of methods of a library
+
+        :param hashes: the hashes of the methods
+        :param str library: the name of the library
+        :param str version: the version of the library
+        :returns: the number of hashes, which were not stored for this library and version before
+        :rtype: int
+        """
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO methods VALUES (?, ?, ?)",
+                                [(format_hash(h), library, version) for h in set(hashes)])
+            return self.db.total_changes - before
+
+    def add(self, features, library, version, include=None, exclude=None, size=1):
+        """
+        Store all methods of an analysed file, which match the given rules
+
+        :param features: the file, containing the library
+        :type features: androguard.core.analysis.analysis.Analysis or elsim.dalvik.AppFeatures
+        :param str library: the name of the library
+        :param str version: the version of the library
+        :param str include: only add classes whose name matches this regular expression (optional)
+        :param str exclude: do not add classes whose name matches this regular expression (optional)
+        :param int size: the minimal length of a method
+        :returns: the number of new hashes
+        :rtype: int
+        """
+        from elsim.dalvik import AppFeatures, ProxyDalvik
+        from elsim.similarity import Similarity
+
+        proxy = ProxyDalvik(AppFeatures.of(features))
+        sim = Similarity()
+        hashes = []
+        for m in proxy:
+            if m.get_length() < size:
+                continue
+            class_name = str(m.get_class_name())
+            if include and not re.match(include, class_name):
+                continue
+            if exclude and re.match(exclude, class_name):
+                continue
+            hashes.append(proxy.features.method(m, sim).hash)
+        return self.add_hashes(hashes, library, version)
+
+    def lookup(self, h):
+        """
+        Returns the libraries and versions, which contain the method
+
+        :param int h: the hash of the method
+        :returns: a sorted list of tuples of library and version, empty if the method is unknown
+        :rtype: list
+        """
+        cursor = self.db.execute("SELECT library, version FROM methods WHERE hash = ? ORDER BY library, version",
+                                 (format_hash(h),))
+        return cursor.fetchall()
+
+    def __contains__(self, h):
+        cursor = self.db.execute("SELECT 1 FROM methods WHERE hash = ? LIMIT 1", (format_hash(h),))
+        return cursor.fetchone() is not None
+
+    def libraries(self):
+        """
+        Returns the libraries, versions and their number of methods
+
+        :rtype: List[Tuple[str, str, int]]
+        """
+        cursor = self.db.execute("SELECT library, version, COUNT(*) FROM methods "
+                                 "GROUP BY library, version ORDER BY library, version")
+        return cursor.fetchall()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(DISTINCT hash) FROM methods").fetchone()[0]
+
+    def close(self):
+        if self.__db is not None:
+            self.__db.close()
+            self.__db = None
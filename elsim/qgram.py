@@ -0,0 +1,349 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Comparing large sets of short strings with a q-gram index
+
+:class:`~elsim.Elsim` compares every element of the first iterable, which is not identical
+to an element of the second one, against every such element of the second iterable.
+For applications with tens of thousands of strings, this are billions of NCD calculations.
+
+:class:`ElsimQGram` builds an inverted index of the q-grams of the elements of the second iterable.
+The candidates of an element of the first iterable are the elements, which share enough q-grams with it.
+Only the candidates are compared, either with FILTER_SIM_METH (the NCD) or with the normalized edit distance.
+
+Two strings with an edit distance of k share at least max(|s|, |t|) + q - 1 - k * q of their padded q-grams,
+thus similar strings always share a large part of their q-grams.
+A candidate must share at least min_overlap of the distinct q-grams of the longer string.
+Elements which are similar by NCD, but share too few q-grams, are not found and regarded as deleted.
+
+Example::
+
+    el = ElsimQGram(ProxyDalvikString(dx1), ProxyDalvikString(dx2), FILTERS_DALVIK_SIM_STRING, threshold=0.6)
+    el.show()
+"""
+import time
+from operator import itemgetter
+
+import numpy as np
+
+from elsim import ElsimIndex, FILTER_SIM_METH, FILTER_SORT_METH, FILTER_BUFFER_METH, FILTER_SIM_BATCH_METH
+from elsim.report import similarity_value, print_summary, print_stats
+
+METRICS = ("ncd", "levenshtein")
+
+
+def qgrams(buff, q=3):
+    """
+    Returns the distinct q-grams of a buffer, which is padded with q - 1 zero bytes on both sides
+
+    :param bytes buff:
+    :param int q: the length of the q-grams
+    :rtype: set
+    """
+    pad = b'\x00' * (q - 1)
+    padded = pad + bytes(buff) + pad
+    return {padded[i:i + q] for i in range(len(padded) - q + 1)}
+
+
+class QGramIndex:
+    """
+    Inverted index of the q-grams of a list of buffers
+    """
+    def __init__(self, buffers, q=3):
+        """
+        :param list buffers: the buffers to index
+        :param int q: the length of the q-grams
+        """
+        if q < 1:
+            raise ValueError("q must be at least 1!")
+        self.q = q
+        postings = dict()
+        sizes = []
+        for i, buff in enumerate(buffers):
+            grams = qgrams(buff, q)
+            sizes.append(len(grams))
+            for g in grams:
+                postings.setdefault(g, []).append(i)
+        # The number of distinct q-grams of each buffer
+        self.sizes = np.array(sizes, dtype=np.int64)
+        # The positions of the buffers, which contain a q-gram
+        self.postings = {g: np.array(p, dtype=np.int64) for g, p in postings.items()}
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def candidates(self, buff, min_overlap=0.5, max_candidates=None):
+        """
+        Returns the positions of the buffers, which share at least min_overlap of the q-grams
+        of the longer buffer, and the number of shared q-grams.
+
+        If max_candidates is given, only the buffers with the most shared q-grams are returned.
+        The positions are sorted.
+
+        :param bytes buff: the buffer to look up
+        :param float min_overlap: the minimal ratio of shared q-grams
+        :param int max_candidates: maximal number of candidates (optional)
+        :rtype: Tuple[numpy.ndarray, numpy.ndarray]
+        """
+        grams = qgrams(buff, self.q)
+        lists = [self.postings[g] for g in grams if g in self.postings]
+        if not lists:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        positions, shared = np.unique(np.concatenate(lists), return_counts=True)
+
+        # Count filter, which also removes buffers of very different length
+        required = np.ceil(min_overlap * np.maximum(len(grams), self.sizes[positions]))
+        mask = shared >= np.maximum(required, 1)
+        positions = positions[mask]
+        shared = shared[mask]
+
+        if max_candidates is not None and len(positions) > max_candidates:
+            # Most shared q-grams first, the lower position wins ties
+            order = np.lexsort((positions, -shared))[:max_candidates]
+            order.sort()
+            positions = positions[order]
+            shared = shared[order]
+        return positions, shared
+
+
+class ElsimQGram:
+    """
+    Compare two iterables, by comparing each element only to the elements
+    of the other iterable, which share enough q-grams with it.
+
+    The categories and the similarity value are defined as in :class:`~elsim.Elsim`.
+    Requires FILTER_BUFFER_METH in the filter dict.
+    If FILTER_SIM_BATCH_METH is available, the candidates of an element are compared at once.
+    """
+    def __init__(self, e1, e2, F=None, threshold=0.8, compressor=None, similarity_threshold=0.2,
+                 q=3, min_overlap=0.5, max_candidates=64, metric="ncd"):
+        """
+        :param e1: the first iterable, either a Proxy or a prebuilt :class:`~elsim.ElsimIndex`
+        :type e1: Proxy or ElsimIndex
+        :param e2: the second iterable, which is indexed by q-grams
+        :param dict F: Some Filter dictionary, can be omitted if e1 is an :class:`~elsim.ElsimIndex`
+        :param float threshold: value which used in the sort method to eliminate not interesting comparisons
+        :param str compressor: compression method name, or None to use the default one
+        :param float similarity_threshold: value to threshold similarity values with
+        :param int q: the length of the q-grams
+        :param float min_overlap: the minimal ratio of shared q-grams of a candidate
+        :param int max_candidates: maximal number of candidates per element, None for no limit
+        :param str metric: "ncd" to use FILTER_SIM_METH or "levenshtein" for the normalized edit distance
+        """
+        if not (0 <= threshold <= 1):
+            raise ValueError("threshold must be a number between 0 and 1!")
+        if not (0 <= similarity_threshold <= 1):
+            raise ValueError("similarity_threshold must be a number between 0 and 1!")
+        if not (0 <= min_overlap <= 1):
+            raise ValueError("min_overlap must be a number between 0 and 1!")
+        if max_candidates is not None and max_candidates < 1:
+            raise ValueError("max_candidates must be at least 1!")
+        if metric not in METRICS:
+            raise ValueError("metric must be one of {}!".format(", ".join(METRICS)))
+        self.threshold = threshold
+        self.similarity_threshold = similarity_threshold
+        self.q = q
+        self.min_overlap = min_overlap
+        self.max_candidates = max_candidates
+        self.metric = metric
+
+        if isinstance(e1, ElsimIndex):
+            if F is not None and F is not e1.F:
+                raise ValueError("The filter dict must be the same as the one of the ElsimIndex!")
+            index1 = e1
+        else:
+            if F is None:
+                raise ValueError("A valid filter dict is required!")
+            index1 = ElsimIndex(e1, F, compressor)
+        self.F = index1.F
+        if FILTER_BUFFER_METH not in self.F:
+            raise ValueError("The filter dict requires FILTER_BUFFER_METH!")
+
+        self.index = index1
+        self.sim = index1.sim
+        self.compressor = index1.compressor
+        self.sim.set_compress_type(self.compressor)
+        self.index2 = ElsimIndex(e2, self.F, sim=self.sim)
+
+        # Number of candidates, which were compared
+        self.pairs_evaluated = 0
+        self.elapsed = 0.0
+
+        self.__identical = []
+        self.__similar = []
+        self.__deleted = []
+        self.__new = []
+        self.__closest = dict()
+        self.__scores = dict()
+
+        self.run()
+
+    def __distances(self, j, buff, columns, buffers):
+        if self.metric == "levenshtein":
+            return [self.sim.levenshtein(buff, b) / max(len(buff), len(b), 1) for b in buffers]
+        if FILTER_SIM_BATCH_METH in self.F:
+            return self.F[FILTER_SIM_BATCH_METH](self.sim, buff, buffers)
+        return [self.F[FILTER_SIM_METH](self.sim, j, k) for k in columns]
+
+    def run(self):
+        start = time.time()
+        store1 = self.index.ref_set_ident
+        store2 = self.index2.ref_set_ident
+        common, _, only1 = store1.intersect(store2)
+        _, _, only2 = store2.intersect(store1)
+        self.__identical = [x for i in common for x in store1.group(i)]
+
+        # The columns are ordered by their hash, as in Elsim
+        columns = [store2.first(i) for i in only2]
+        buffers = [self.F[FILTER_BUFFER_METH](k) for k in columns]
+        # Empty buffers can not be compared
+        indexed = [c for c, b in enumerate(buffers) if b]
+        qindex = QGramIndex([buffers[c] for c in indexed], self.q)
+
+        matched = set()
+        for i in only1:
+            j = store1.first(i)
+            buff = self.F[FILTER_BUFFER_METH](j)
+            row = dict()
+            if buff:
+                positions, _ = qindex.candidates(buff, self.min_overlap, self.max_candidates)
+                candidates = [indexed[p] for p in positions]
+                if candidates:
+                    distances = self.__distances(j, buff, [columns[c] for c in candidates],
+                                                 [buffers[c] for c in candidates])
+                    self.pairs_evaluated += len(candidates)
+                    row = {columns[c]: float(d) for c, d in zip(candidates, distances)}
+            if row:
+                self.__closest[j] = min(row.items(), key=itemgetter(1))
+
+            sort_h = self.F[FILTER_SORT_METH](j, row, self.threshold)
+            if sort_h:
+                self.__similar.append((j, sort_h[0][0], sort_h[0][1]))
+                matched.add(sort_h[0][0])
+            else:
+                self.__deleted.append(j)
+
+        self.__new = [x for i in only2 for x in store2.group(i) if x not in matched]
+        self.elapsed = time.time() - start
+
+    def get_identical_elements(self):
+        """
+        Return the elements of the first iterable, which have an identical element in the second one
+        """
+        return list(self.__identical)
+
+    def get_similar_elements(self):
+        """
+        Return the similar elements of the first iterable
+        """
+        return [j for j, _, _ in self.__similar]
+
+    def get_new_elements(self):
+        """
+        Return the new elements of the second iterable
+        """
+        return list(self.__new)
+
+    def get_deleted_elements(self):
+        """
+        Return the deleted elements of the first iterable
+        """
+        return list(self.__deleted)
+
+    def get_skipped_elements(self):
+        """
+        Return the skipped elements of both iterables
+        """
+        return self.index.skipped | self.index2.skipped
+
+    def split_elements(self):
+        """
+        Returns a list of tuples of the similar elements and their associated element
+        """
+        return [(j, k) for j, k, _ in self.__similar]
+
+    def get_closest_element(self, i):
+        """
+        Returns a tuple of the closest candidate and its distance for element i,
+        regardless of the threshold.
+        If i has no candidates, None is returned.
+        """
+        return self.__closest.get(i)
+
+    def get_similarity_value(self, new=True, deleted=True):
+        """
+        Returns a score in percent of how similar the two iterables are,
+        see :meth:`elsim.Elsim.get_similarity_value`.
+
+        :param bool new: Should new elements regarded as beeing dissimilar
+        :param bool deleted: Should deleted elements regarded as beeing dissimilar
+        """
+        key = (bool(new), bool(deleted))
+        if key not in self.__scores:
+            self.__scores[key] = similarity_value([d for _, _, d in self.__similar],
+                                                  len(self.__identical),
+                                                  len(self.__new) if new else 0,
+                                                  len(self.__deleted) if deleted else 0,
+                                                  self.similarity_threshold)
+        return self.__scores[key]
+
+    def stats(self):
+        """
+        Returns counters and the time of the calculation,
+        with the same keys as :meth:`elsim.Elsim.stats` where applicable.
+
+        * pairs_evaluated: the number of candidate pairs, which were compared
+        * time: a dictionary with the time in seconds of the comparison, without creating the elements
+        """
+        return {
+            "elements1": len(self.index.elements),
+            "elements2": len(self.index2.elements),
+            "skipped": len(self.get_skipped_elements()),
+            "identical": len(self.__identical),
+            "similar": len(self.__similar),
+            "new": len(self.__new),
+            "deleted": len(self.__deleted),
+            "pairs_evaluated": self.pairs_evaluated,
+            "time": {"comparison": self.elapsed},
+        }
+
+    def show_stats(self):
+        """
+        Print the counters and timings of :meth:`stats` to stdout
+        """
+        print_stats(self.stats())
+
+    def show(self, new=True, deleted=True, details=False):
+        """
+        Print information about the elements to stdout
+
+        :param bool new: Should new elements regarded as beeing dissimilar (passed to get_similarity_value)
+        :param bool deleted: Should deleted elements regarded as beeing dissimilar (passed to get_similarity_value)
+        :param bool details: Print the similar elements and their closest element
+        """
+        counts = (len(self.__identical), len(self.__similar), len(self.__new), len(self.__deleted),
+                  len(self.get_skipped_elements()))
+        print_summary(self.compressor.name if self.metric == "ncd" else self.metric, counts,
+                      self.get_similarity_value(new, deleted), new, deleted)
+
+        if details and self.__similar:
+            print()
+            print("SIMILAR elements:")
+            for j, k, distance in sorted(self.__similar, key=itemgetter(2)):
+                print("\t", j)
+                print("\t\t-s->", k, distance)
@@ -0,0 +1,97 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The similarity value and the summary of a comparison
+
+All kinds of comparisons (:class:`~elsim.Elsim`, :class:`~elsim.result.ElsimResult`,
+:class:`~elsim.stream.ElsimStream`, ...) sort the elements into the same categories.
+The similarity value is calculated from the number of elements in each category
+and the distances of the similar elements, the summary is printed the same way.
+"""
+
+
+def similarity_value(distances, identical, new, deleted, similarity_threshold=0.2):
+    """
+    Returns a score in percent of how similar the two iterables are,
+    see :meth:`elsim.Elsim.get_similarity_value`.
+
+    Distances of at least similarity_threshold are regarded as maximal distance.
+
+    :param distances: the distances of the similar elements to their associated elements
+    :param int identical: the number of identical elements
+    :param int new: the number of new elements, 0 if they are not regarded as dissimilar
+    :param int deleted: the number of deleted elements, 0 if they are not regarded as dissimilar
+    :param float similarity_threshold: value to threshold similarity values with
+    :rtype: float
+    """
+    def threshold(value):
+        return 1.0 if value >= similarity_threshold else value
+
+    values = [threshold(d) for d in distances]
+    # Identical elements have a distance of 0
+    values.extend([threshold(0.0)] * identical)
+    # New and deleted elements have a distance of 1
+    values.extend([threshold(1.0)] * new)
+    values.extend([threshold(1.0)] * deleted)
+
+    # So actually we are calculating the NCS here from all the NCD values...
+    # As NCS = 1 - NCD, we just need to calculate that.
+    # Then we take the arithmetic mean and return it as percentage
+    return sum([1.0 - i for i in values]) / max(len(values), 1) * 100
+
+
+def print_summary(compression, counts, value, new=True, deleted=True):
+    """
+    Print the number of elements in each category and the similarity value to stdout
+
+    If new or deleted is not set, a '**' is printed after the element count to
+    indicate that these values are not used for the calculation of the similarity score.
+
+    :param str compression: the name of the compressor or metric
+    :param counts: the number of identical, similar, new, deleted and skipped elements
+    :param float value: the similarity value
+    :param bool new: were new elements regarded as beeing dissimilar
+    :param bool deleted: were deleted elements regarded as beeing dissimilar
+    """
+    ik, s, n, d, sk = counts
+
+    # get the length of the digits and at least 3 digits
+    max_digits = max(max(map(len, map(str, counts))), 3)
+
+    print("Compression:   {}".format(compression))
+    print("    IDENTICAL: {:>{width}}".format(ik, width=max_digits))
+    print("    SIMILAR:   {:>{width}}".format(s, width=max_digits))
+    print("    NEW:       {:>{width}}{}".format(n, " **" if not new else "", width=max_digits))
+    print("    DELETED:   {:>{width}}{}".format(d, " **" if not deleted else "", width=max_digits))
+    print("    SKIPPED:   {:>{width}}".format(sk, width=max_digits))
+    print("")
+    print("Similarity:    {:>{width}.4f}%".format(value, width=max_digits+5))
+
+
+def print_stats(stats):
+    """
+    Print counters and timings to stdout
+
+    :param dict stats: the counters, the timings in seconds are in the dictionary of the key time
+    """
+    stats = dict(stats)
+    timings = stats.pop("time", dict())
+    for key, value in stats.items():
+        print("{:<22} {:>12}".format(key + ":", value))
+    for key, value in timings.items():
+        print("{:<22} {:>12.4f}s".format("time " + key + ":", value))
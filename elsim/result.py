@@ -0,0 +1,414 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Detached results of an Elsim comparison
+
+An :class:`~elsim.Elsim` object keeps references to all elements, which in turn
+might keep references to large objects (like androguard's Analysis).
+The :class:`ElsimResult` only stores identifiers, hashes and distances
+of the elements in a few arrays and can be saved and loaded again.
+"""
+import json
+
+import numpy as np
+
+from elsim.report import similarity_value, print_summary
+
+RESULT_VERSION = 1
+
+# The element was found in the first iterable
+SIDE_FIRST = 0
+# The element was found in the second iterable
+SIDE_SECOND = 1
+# The side of the element is unknown (only used for skipped elements)
+SIDE_UNKNOWN = -1
+
+# Codes for the category of each element
+KIND_NONE = 0
+KIND_IDENTICAL = 1
+KIND_SIMILAR = 2
+KIND_NEW = 3
+KIND_DELETED = 4
+KIND_SKIPPED = 5
+
+_MASK64 = (1 << 64) - 1
+
+
+def split_hash(h):
+    """
+    Split a 128bit hash into two 64bit integers (high, low)
+
+    :param int h: the hash, as returned by mmh3.hash128
+    :rtype: Tuple[int, int]
+    """
+    h &= (1 << 128) - 1
+    return h >> 64, h & _MASK64
+
+
+def join_hash(high, low):
+    """
+    Inverse of :func:`split_hash`
+
+    :rtype: int
+    """
+    return (int(high) << 64) | int(low)
+
+
+class ElsimResult:
+    """
+    A compact snapshot of the outcome of an :class:`~elsim.Elsim` comparison.
+
+    All elements are stored in a single table, which consists of the following arrays:
+
+    * names: the string representation of the element (a list of str)
+    * hashes: a n x 2 array of uint64, containing the 128bit hash of the element
+    * sides: from which iterable the element originates (0, 1 or -1 for skipped elements)
+    * kinds: the category of the element (identical, similar, new, deleted, skipped)
+    * matches: the index of the associated element in the table or -1
+    * distances: the distance to the associated element or NaN
+
+    For similar elements of the first iterable, the match is the most similar element.
+    For deleted elements, the match is the closest element, which did not reach the threshold.
+    Identical elements are matched to one element of the second iterable with the same hash.
+
+    The similarity score is calculated only once and then cached.
+    """
+    def __init__(self, names, hashes, sides, kinds, matches, distances,
+                 compressor=None, threshold=None, similarity_threshold=0.2, meta=None):
+        """
+        :param List[str] names: the names of all elements
+        :param numpy.ndarray hashes: n x 2 uint64 array of the hashes
+        :param numpy.ndarray sides: int8 array of the origin of the elements
+        :param numpy.ndarray kinds: uint8 array of the element categories
+        :param numpy.ndarray matches: int32 array of associated elements
+        :param numpy.ndarray distances: float64 array of distances to the associated element
+        :param str compressor: name of the compressor that was used
+        :param float threshold: the threshold used for sorting
+        :param float similarity_threshold: the threshold used for calculating the similarity value
+        :param dict meta: additional information, which must be JSON serializable
+        """
+        self.names = list(names)
+        self.hashes = np.asarray(hashes, dtype=np.uint64).reshape(-1, 2)
+        self.sides = np.asarray(sides, dtype=np.int8)
+        self.kinds = np.asarray(kinds, dtype=np.uint8)
+        self.matches = np.asarray(matches, dtype=np.int32)
+        self.distances = np.asarray(distances, dtype=np.float64)
+
+        n = len(self.names)
+        for arr in (self.hashes, self.sides, self.kinds, self.matches, self.distances):
+            if len(arr) != n:
+                raise ValueError("All arrays of the result must have the same length!")
+
+        self.compressor = compressor
+        self.threshold = threshold
+        self.similarity_threshold = similarity_threshold
+        self.meta = dict(meta) if meta else dict()
+
+        self._scores = dict()
+
+    @classmethod
+    def from_elsim(cls, el):
+        """
+        Create the snapshot from an :class:`~elsim.Elsim` object
+
+        :param elsim.Elsim el:
+        :rtype: ElsimResult
+        """
+        names = []
+        hashes = []
+        sides = []
+        kinds = []
+        matches = []
+        distances = []
+        table = dict()
+
+        def add(element, side, kind):
+            if element in table:
+                idx = table[element]
+                if kind != KIND_NONE:
+                    kinds[idx] = kind
+                return idx
+            table[element] = len(names)
+            names.append(str(element))
+            hashes.append(split_hash(element.hash))
+            sides.append(side)
+            kinds.append(kind)
+            matches.append(-1)
+            distances.append(np.nan)
+            return table[element]
+
+        for element in el.get_identical_elements():
+            add(element, SIDE_FIRST, KIND_IDENTICAL)
+        for element in el.get_similar_elements():
+            add(element, SIDE_FIRST, KIND_SIMILAR)
+        for element in el.get_deleted_elements():
+            add(element, SIDE_FIRST, KIND_DELETED)
+        for element in el.get_new_elements():
+            add(element, SIDE_SECOND, KIND_NEW)
+        for elements in el.ref_set_ident[el.e2].values():
+            for element in elements:
+                add(element, SIDE_SECOND, KIND_NONE)
+        for element in el.get_skipped_elements():
+            add(element, SIDE_UNKNOWN, KIND_SKIPPED)
+        for element in el.get_unevaluated_elements():
+            add(element, SIDE_FIRST, KIND_NONE)
+
+        for element in el.get_identical_elements():
+            for other in el.ref_set_ident[el.e2][element.hash]:
+                matches[table[element]] = table[other]
+                distances[table[element]] = 0.0
+                break
+
+        for element in el.get_similar_elements():
+            other = el.get_associated_element(element)
+            matches[table[element]] = table[other]
+            distances[table[element]] = el.get_distance(element, other)
+
+        for element in el.get_deleted_elements():
+            best = el.get_closest_element(element)
+            if best is not None:
+                matches[table[element]] = table[best[0]]
+                distances[table[element]] = best[1]
+
+        return cls(names,
+                   np.array(hashes, dtype=np.uint64).reshape(-1, 2),
+                   sides, kinds, matches, distances,
+                   compressor=el.compressor.name,
+                   threshold=el.threshold,
+                   similarity_threshold=el.similarity_threshold,
+                   meta=cls._elsim_meta(el))
+
+    @staticmethod
+    def _elsim_meta(el):
+        # The compression level and the filter functions identify the distances, together with the compressor
+        meta = {"level": el.identity["level"], "filters": el.identity["filters"]}
+        if el.partial:
+            meta.update(partial=True, remainder=el.get_remainder()._asdict())
+        return meta
+
+    @property
+    def partial(self):
+        """
+        True if the similarity matrix was not fully calculated.
+        The elements, which were not evaluated, have no kind.
+        """
+        return bool(self.meta.get("partial", False))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _indices(self, kind):
+        return np.flatnonzero(self.kinds == kind)
+
+    def _names(self, kind):
+        return [self.names[i] for i in self._indices(kind)]
+
+    def get_hash(self, idx):
+        """
+        Return the 128bit hash of the element with the given index
+
+        :param int idx:
+        :rtype: int
+        """
+        return join_hash(*self.hashes[idx])
+
+    def get_identical_elements(self):
+        """Return the names of the identical elements"""
+        return self._names(KIND_IDENTICAL)
+
+    def get_similar_elements(self):
+        """Return the names of the similar elements"""
+        return self._names(KIND_SIMILAR)
+
+    def get_new_elements(self):
+        """Return the names of the new elements"""
+        return self._names(KIND_NEW)
+
+    def get_deleted_elements(self):
+        """Return the names of the deleted elements"""
+        return self._names(KIND_DELETED)
+
+    def get_skipped_elements(self):
+        """Return the names of the skipped elements"""
+        return self._names(KIND_SKIPPED)
+
+    def split_elements(self):
+        """
+        Returns a list of tuples of names of the elements which are associated to each other
+        """
+        return [(self.names[i], self.names[self.matches[i]]) for i in self._indices(KIND_SIMILAR)]
+
+    def get_similarity_value(self, new=True, deleted=True):
+        """
+        Returns a score in percent of how similar the two files are.
+
+        This gives the same value as :meth:`elsim.Elsim.get_similarity_value`.
+        The value is calculated only once per combination of the flags.
+
+        :param bool new: Should new elements regarded as beeing dissimilar
+        :param bool deleted: Should deleted elements regarded as beeing dissimilar
+        """
+        key = (bool(new), bool(deleted))
+        if key not in self._scores:
+            self._scores[key] = similarity_value(
+                self.distances[self.kinds == KIND_SIMILAR].tolist(),
+                int(np.count_nonzero(self.kinds == KIND_IDENTICAL)),
+                int(np.count_nonzero(self.kinds == KIND_NEW)) if new else 0,
+                int(np.count_nonzero(self.kinds == KIND_DELETED)) if deleted else 0,
+                self.similarity_threshold)
+        return self._scores[key]
+
+    def show(self, new=True, deleted=True, details=False):
+        """
+        Print information about the elements to stdout
+
+        The output is the same as :meth:`elsim.Elsim.show`.
+
+        :param bool new: Should new elements regarded as beeing dissimilar (passed to get_similarity_value)
+        :param bool deleted: Should deleted elements regarded as beeing dissimilar (passed to get_similarity_value)
+        :param bool details: Print all elements for the categories
+        """
+        counts = [int(np.count_nonzero(self.kinds == k)) for k in
+                  (KIND_IDENTICAL, KIND_SIMILAR, KIND_NEW, KIND_DELETED, KIND_SKIPPED)]
+        print_summary(self.compressor, counts, self.get_similarity_value(new, deleted), new, deleted)
+        if self.partial:
+            remainder = self.meta["remainder"]
+            print("PARTIAL:       {} elements ({} pairs) were not evaluated".format(remainder["rows"], remainder["pairs"]))
+
+        if details:
+            print()
+
+            for title, kind, marker in (("SIMILAR", KIND_SIMILAR, "-s->"),
+                                        ("IDENTICAL", KIND_IDENTICAL, "-i->"),
+                                        ("NEW", KIND_NEW, None),
+                                        ("DELETED", KIND_DELETED, None),
+                                        ("SKIPPED", KIND_SKIPPED, None)):
+                indices = self._indices(kind)
+                if len(indices) == 0:
+                    continue
+                print("{} elements:".format(title))
+                for i in indices:
+                    print("\t", self.names[i])
+                    if marker and self.matches[i] >= 0:
+                        if kind == KIND_SIMILAR:
+                            print("\t\t{}".format(marker), self.names[self.matches[i]], self.distances[i])
+                        else:
+                            print("\t\t{}".format(marker), self.names[self.matches[i]])
+
+    def _meta(self):
+        return {
+            "version": RESULT_VERSION,
+            "compressor": self.compressor,
+            "threshold": self.threshold,
+            "similarity_threshold": self.similarity_threshold,
+            "meta": self.meta,
+        }
+
+    def to_dict(self):
+        """
+        Returns a JSON serializable dictionary of the result.
+
+        Hashes are stored as hex strings, missing distances as None.
+
+        :rtype: dict
+        """
+        d = self._meta()
+        d.update({
+            "names": self.names,
+            "hashes": ["{:032x}".format(join_hash(*h)) for h in self.hashes],
+            "sides": self.sides.tolist(),
+            "kinds": self.kinds.tolist(),
+            "matches": self.matches.tolist(),
+            "distances": [None if np.isnan(x) else float(x) for x in self.distances],
+        })
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Load the result from a dictionary created by :meth:`to_dict`
+
+        :param dict d:
+        :rtype: ElsimResult
+        """
+        if d.get("version") != RESULT_VERSION:
+            raise ValueError("Unsupported result version '{}'".format(d.get("version")))
+
+        hashes = np.array([split_hash(int(h, 16)) for h in d["hashes"]], dtype=np.uint64).reshape(-1, 2)
+        distances = [np.nan if x is None else x for x in d["distances"]]
+        return cls(d["names"], hashes, d["sides"], d["kinds"], d["matches"], distances,
+                   compressor=d["compressor"],
+                   threshold=d["threshold"],
+                   similarity_threshold=d["similarity_threshold"],
+                   meta=d["meta"])
+
+    def save(self, filename):
+        """
+        Save the result to a file.
+
+        If the filename ends with `.json`, the result is written as JSON,
+        otherwise the (faster) binary format of numpy (`.npz`) is used.
+
+        :param str filename:
+        """
+        if filename.endswith(".json"):
+            with open(filename, "w") as fp:
+                json.dump(self.to_dict(), fp)
+            return
+
+        encoded = [x.encode('utf-8') for x in self.names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in encoded], out=offsets[1:])
+
+        with open(filename, "wb") as fp:
+            np.savez(fp,
+                     meta=np.frombuffer(json.dumps(self._meta()).encode('utf-8'), dtype=np.uint8),
+                     names=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                     offsets=offsets,
+                     hashes=self.hashes,
+                     sides=self.sides,
+                     kinds=self.kinds,
+                     matches=self.matches,
+                     distances=self.distances)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a result written by :meth:`save`
+
+        :param str filename:
+        :rtype: ElsimResult
+        """
+        if filename.endswith(".json"):
+            with open(filename, "r") as fp:
+                return cls.from_dict(json.load(fp))
+
+        with np.load(filename, allow_pickle=False) as data:
+            meta = json.loads(data["meta"].tobytes().decode('utf-8'))
+            if meta.get("version") != RESULT_VERSION:
+                raise ValueError("Unsupported result version '{}'".format(meta.get("version")))
+
+            blob = data["names"].tobytes()
+            offsets = data["offsets"]
+            names = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+            return cls(names, data["hashes"], data["sides"], data["kinds"], data["matches"], data["distances"],
+                       compressor=meta["compressor"],
+                       threshold=meta["threshold"],
+                       similarity_threshold=meta["similarity_threshold"],
+                       meta=meta["meta"])
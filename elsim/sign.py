@@ -24,7 +24,7 @@ from operator import itemgetter
 import binascii
 import enum
 
-from androguard.core.bytecodes import dvm
+from elsim.tokens import TokenTable
 
 TAINTED_PACKAGE_CREATE = 0
 TAINTED_PACKAGE_CALL = 1
@@ -123,6 +123,9 @@ class Signature:
         # Contains the lower level signatures for faster lookup
         self._global_cached = {}
 
+        # The interned instruction tokens of all methods
+        self.tokens = TokenTable()
+
         # Defines which functions shall be called for what kind of signature
         self.levels = {
             # Classical method signature with basic blocks, strings, fields, packages
@@ -213,18 +216,14 @@ class Signature:
 
         return res
 
-    @staticmethod
-    def _get_hex(analysis_method, *args):
+    def _get_hex(self, analysis_method, *args):
         """
         Returns the decoded bytecode as text without any newlines
 
         :param androguard.core.analysis.analysis.MethodAnalysis analysis_method:
         """
-        buff = ""
-        for i in analysis_method.get_method().get_instructions():
-            buff += dvm.clean_name_instruction(i)
-            buff += dvm.static_operand_instruction(i)
-        return buff
+        ids, _ = self.tokens.method(analysis_method.get_method())
+        return self.tokens.text(ids)
 
     def _get_bb(self, analysis_method, functions, options):
         """
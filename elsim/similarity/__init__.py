@@ -21,6 +21,7 @@ This module implements similarity and complexity measures
 # You should have received a copy of the GNU Lesser General Public License
 # along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
 import re
+from collections import OrderedDict
 from enum import IntEnum
 from elsim.similarity import libsimilarity as ls
 
@@ -57,21 +58,78 @@ class Similarity:
     Therefore it is required to encode strings using an appropriate encoding scheme.
     If str are supplied, they will automatically get encoded using UTF-8.
 
-    To increase the computation speed, all inputs to methods of this class
-    are cached. Adler32 hash is used as a key for checking the cache.
+    To increase the computation speed, the compressed sizes of all inputs
+    to :meth:`ncd`, :meth:`ncs` and :meth:`cmid` are cached.
+    The input itself is used as the key, hence only bytes can be cached.
+    The cache holds at most `cache_size` entries, the least recently used
+    entries are removed first.
     This means, that there is a slight decrease in speed when using only
     a few items, but there should be an increase if a reasonable number
-    of strings is compared.
+    of strings is compared, as every string has to be compressed only once.
+
+    The number of calls to these functions, the number of cache hits and the
+    number of bytes given to the compressor are counted in :attr:`calls`,
+    :attr:`cache_hits` and :attr:`compressed_bytes`.
     """
-    def __init__(self, ctype=Compress.ZLIB, level=9):
+    def __init__(self, ctype=Compress.ZLIB, level=9, cache_size=65536):
         """
 
         :param Compress ctype: type of compressor to use
         :param int level: level of compression to apply
+        :param int cache_size: maximal number of compressed sizes to cache, 0 disables the cache
         """
         self.level = level
-        self.ctype = ctype
-        self.set_compress_type(self.ctype)
+        self.ctype = None
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.calls = 0
+        self.cache_hits = 0
+        self.compressed_bytes = 0
+        self.set_compress_type(ctype)
+
+    def _get_cached_size(self, s):
+        """
+        Returns the cached compressed size of s or 0 if the size is not known.
+        The value zero is understood by libsimilarity as "not cached".
+        """
+        if type(s) is not bytes:
+            return 0
+        size = self._cache.get(s, 0)
+        if size:
+            self._cache.move_to_end(s)
+        return size
+
+    def _set_cached_size(self, s, size):
+        """Store the compressed size of s in the cache"""
+        if self.cache_size <= 0 or type(s) is not bytes or s in self._cache:
+            return
+        self._cache[s] = size
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _call_cached(self, func, s1, s2):
+        """
+        Call one of the NCD like functions from libsimilarity
+        with the cached compressed sizes and update the cache afterwards.
+        """
+        cached1 = self._get_cached_size(s1)
+        cached2 = self._get_cached_size(s2)
+
+        self.calls += 1
+        self.cache_hits += bool(cached1) + bool(cached2)
+        # The concatenation is always compressed, the single strings only if not cached
+        self.compressed_bytes += (len(s1) + len(s2)) * 2 - (len(s1) if cached1 else 0) - (len(s2) if cached2 else 0)
+
+        n, ls1, ls2 = func(self.level, s1, s2, cached1, cached2)
+        self._set_cached_size(s1, ls1)
+        self._set_cached_size(s2, ls2)
+        return n
+
+    def clear_cache(self):
+        """
+        Remove all entries from the cache of compressed sizes
+        """
+        self._cache.clear()
 
     def compress(self, s1):
         """
@@ -82,6 +140,22 @@ class Similarity:
         """
         return ls.compress(self.level, s1)
 
+    def compressed_size(self, s1):
+        """
+        Returns the length of the compressed string, using the cache of compressed sizes
+
+        :param bytes s1: the string to compress
+        :rtype: int
+        """
+        size = self._get_cached_size(s1)
+        if size:
+            self.cache_hits += 1
+            return size
+        self.compressed_bytes += len(s1)
+        size = ls.compress(self.level, s1)
+        self._set_cached_size(s1, size)
+        return size
+
     def ncd(self, s1, s2):
         """
         Calculate Normalized Compression Distance (NCD)
@@ -107,12 +181,51 @@ class Similarity:
         :param bytes s1: The first string
         :param bytes s2: The second string
         """
-        # FIXME: use the cache again
-        # there is a flaw in the old design, as it would use a single cache for all functions
-        # hence, if you calculate ncd(s1, s2) and then ncs(s1, s2), you would get the result from
+        # Only the compressed sizes of the inputs are cached, never the result.
+        # The old design used a single cache for the results of all functions,
+        # hence, if you calculated ncd(s1, s2) and then ncs(s1, s2), you would get the result from
         # before!
-        n, ls1, ls2 = ls.ncd(self.level, s1, s2)
-        return n
+        return self._call_cached(ls.ncd, s1, s2)
+
+    def ncd_row(self, s1, others):
+        """
+        Calculate the Normalized Compression Distance between s1 and each of the other strings.
+
+        This is the same as calling :meth:`ncd` for each pair, but all values
+        are calculated within a single call to libsimilarity.
+
+        :param bytes s1: The first string
+        :param list others: the strings to compare s1 with
+        :rtype: List[float]
+        """
+        cached1 = self._get_cached_size(s1)
+        cached = [self._get_cached_size(s2) for s2 in others]
+
+        distances, ls1, sizes = ls.ncd_row(self.level, s1, others, cached1, cached)
+
+        self.calls += len(others)
+        # s1 is compressed at most once
+        self.cache_hits += (len(others) if cached1 else max(len(others) - 1, 0)) + sum(map(bool, cached))
+        self.compressed_bytes += (0 if cached1 else len(s1)) + \
+            sum((len(s1) + len(s2)) + (0 if c else len(s2)) for s2, c in zip(others, cached))
+
+        self._set_cached_size(s1, ls1)
+        for s2, size in zip(others, sizes):
+            self._set_cached_size(s2, size)
+        return distances
+
+    def ncd_column(self, others, s2):
+        """
+        Calculate the Normalized Compression Distance between each of the other strings and s2.
+
+        The NCD is not symmetric, hence this is not the same as :meth:`ncd_row` for s2.
+        The compressed size of s2 is calculated only once.
+
+        :param list others: the strings to compare with s2
+        :param bytes s2: The second string
+        :rtype: List[float]
+        """
+        return [self.ncd(s1, s2) for s1 in others]
 
     def ncs(self, s1, s2):
         """
@@ -127,9 +240,7 @@ class Similarity:
         :param bytes s1: The first string
         :param bytes s2: The second string
         """
-        # FIXME: use the cache again
-        n, ls1, ls2 = ls.ncs(self.level, s1, s2)
-        return n
+        return self._call_cached(ls.ncs, s1, s2)
 
     def cmid(self, s1, s2):
         """
@@ -145,9 +256,7 @@ class Similarity:
         :param bytes s1: The first string
         :param bytes s2: The second string
         """
-        # FIXME: use the cache again
-        n, ls1, ls2 = ls.cmid(self.level, s1, s2)
-        return n
+        return self._call_cached(ls.cmid, s1, s2)
 
     def kolmogorov(self, s1):
         """
@@ -226,8 +335,14 @@ class Similarity:
         """"
         Set the type of compressor to use
 
+        The compressor is a global setting in libsimilarity, hence
+        it is always set, even if this object already uses the same compressor.
+
         :param Compress t: the compression method
         """
+        if t != self.ctype:
+            # The compressed sizes are only valid for a single compressor
+            self.clear_cache()
         self.ctype = t
         ls.set_compress_type(t)
 
@@ -262,5 +377,7 @@ class Similarity:
         """
         if not (1 <= level <= 9):
             raise ValueError("For your own safety, the compression level must be 1 <= level <= 9!")
+        if level != self.level:
+            self.clear_cache()
         self.level = level
 
@@ -562,6 +562,87 @@ static PyObject *similarity_ncd(PyObject *self, PyObject *args) {
     return ret;
 }
 
+static PyObject *similarity_ncd_row(PyObject *self, PyObject *args) {
+    // takes level, one byte input, a sequence of byte inputs, the optional compressed length of the first input
+    // and an optional sequence of compressed lengths (0 if not known) for the other inputs.
+    // returns a list of floats, the compressed size of the first input and a list of compressed sizes.
+    Py_buffer s1;
+    PyObject *others;
+    PyObject *others_cached = NULL;
+    Py_ssize_t s1_cached = 0;
+    int level;
+
+    if (!PyArg_ParseTuple(args, "iy*O|nO", &level, &s1, &others, &s1_cached, &others_cached))
+        return NULL;
+
+    PyObject *seq = PySequence_Fast(others, "expected a sequence of bytes");
+    if (seq == NULL) {
+        PyBuffer_Release(&s1);
+        return NULL;
+    }
+    Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+
+    PyObject *seq_cached = NULL;
+    if (others_cached != NULL && others_cached != Py_None) {
+        seq_cached = PySequence_Fast(others_cached, "expected a sequence of integers");
+        if (seq_cached == NULL || PySequence_Fast_GET_SIZE(seq_cached) != n) {
+            if (seq_cached != NULL) {
+                PyErr_SetString(PyExc_ValueError, "The number of cached sizes must match the number of inputs");
+                Py_DECREF(seq_cached);
+            }
+            Py_DECREF(seq);
+            PyBuffer_Release(&s1);
+            return NULL;
+        }
+    }
+
+    PyObject *distances = PyList_New(n);
+    PyObject *sizes = PyList_New(n);
+    if (distances == NULL || sizes == NULL) {
+        goto error;
+    }
+
+    for (Py_ssize_t i = 0; i < n; i++) {
+        Py_buffer s2;
+        Py_ssize_t s2_cached = 0;
+
+        if (seq_cached != NULL) {
+            s2_cached = PyLong_AsSsize_t(PySequence_Fast_GET_ITEM(seq_cached, i));
+            if (s2_cached == -1 && PyErr_Occurred()) {
+                goto error;
+            }
+        }
+        if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(seq, i), &s2, PyBUF_SIMPLE) != 0) {
+            goto error;
+        }
+
+        // the compressed size of s1 is calculated only once and reused for all other inputs
+        libsimilarity_t simstruct = {s1.buf, s1.len, s2.buf, s2.len, &s1_cached, &s2_cached};
+        int r = ncd(level, &simstruct);
+        PyBuffer_Release(&s2);
+        if (r != 0) {
+            PyErr_SetString(PyExc_ValueError, "An error occured during calculation");
+            goto error;
+        }
+
+        PyList_SET_ITEM(distances, i, PyFloat_FromDouble(simstruct.res));
+        PyList_SET_ITEM(sizes, i, PyLong_FromSsize_t(s2_cached));
+    }
+
+    Py_DECREF(seq);
+    Py_XDECREF(seq_cached);
+    PyBuffer_Release(&s1);
+    return Py_BuildValue("NnN", distances, s1_cached, sizes);
+
+error:
+    Py_XDECREF(distances);
+    Py_XDECREF(sizes);
+    Py_DECREF(seq);
+    Py_XDECREF(seq_cached);
+    PyBuffer_Release(&s1);
+    return NULL;
+}
+
 static PyObject *similarity_ncs(PyObject *self, PyObject *args) {
     // takes level and two byte inputs and optional two compressed lengths, returns float and both comp. lengths
     Py_buffer s1;
@@ -637,6 +718,7 @@ static PyMethodDef similarity_methods[] = {
     {"kolmogorov", similarity_kolmogorov, METH_VARARGS, "Estimate Kolmogorov Complexity based on compression"},
     {"bennett", similarity_bennett, METH_VARARGS, "Estimate Logical Depth (Bennett) by compression and runtime"},
     {"ncd", similarity_ncd, METH_VARARGS, "Calculate Normalized Compression Distance for two inputs"},
+    {"ncd_row", similarity_ncd_row, METH_VARARGS, "Calculate Normalized Compression Distance between one input and a sequence of inputs"},
     {"ncs", similarity_ncs, METH_VARARGS, "Calculate Normaluzed Compression Similarity for two inputs"},
     {"cmid", similarity_cmid, METH_VARARGS, "Calculate Compression based Mututal Inclusuion Degree for two inputs"},
     {"set_compress_type", similarity_set_compress_type, METH_VARARGS, "Set the compression method"},
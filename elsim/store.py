@@ -0,0 +1,313 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compact storage of elements grouped by their hashes
+
+Instead of keeping a set of hashes and a dictionary of sets per hash,
+the hashes are kept in a sorted array and the elements in a single list,
+ordered by their hash.
+Identical and different hashes of two stores are found by intersecting the
+sorted arrays.
+
+The rows of a large similarity matrix can be kept in a memory-mapped file
+instead of dictionaries by using :class:`DiskRows`.
+The hashes of a stream of elements can be counted with :class:`HashCounter`,
+which keeps only the unique hashes and their number of occurrences.
+"""
+import tempfile
+from collections.abc import Mapping
+
+import numpy as np
+
+from elsim.result import split_hash, join_hash
+
+# A 128bit hash as a single sortable value
+HASH_DTYPE = np.dtype([('high', '<u8'), ('low', '<u8')])
+
+
+def _keys(hashes):
+    """
+    Convert a n x 2 array of uint64 into an array of HASH_DTYPE
+    """
+    return np.ascontiguousarray(hashes, dtype=np.uint64).view(HASH_DTYPE).reshape(-1)
+
+
+class ElementStore(Mapping):
+    """
+    Maps the hash of an element to all elements sharing this hash.
+
+    The store is immutable and built from a list of elements at once.
+    The unique hashes are stored in sorted order, which is also the
+    order of iteration.
+    """
+    def __init__(self, elements):
+        """
+        :param list elements: Elements, which provide the hash property
+        """
+        elements = list(elements)
+        hashes = np.array([split_hash(e.hash) for e in elements], dtype=np.uint64).reshape(-1, 2)
+        keys = _keys(hashes)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+
+        # All elements, ordered by hash
+        self.elements = [elements[i] for i in order]
+
+        # The first element of each hash group
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.intp)
+        # Unique and sorted hashes
+        self.sorted_keys = keys[starts]
+        # offsets[i]:offsets[i + 1] are the elements with hash sorted_keys[i]
+        self.offsets = np.r_[starts, len(keys)].astype(np.intp)
+
+    @property
+    def hashes(self):
+        """
+        The unique hashes as a n x 2 array of uint64
+        """
+        return self.sorted_keys.view(np.uint64).reshape(-1, 2)
+
+    def find(self, h):
+        """
+        Returns the position of the hash in the store or -1
+
+        :param int h: the hash of an element
+        :rtype: int
+        """
+        key = np.array([split_hash(h)], dtype=HASH_DTYPE)
+        idx = int(np.searchsorted(self.sorted_keys, key)[0])
+        if idx < len(self.sorted_keys) and self.sorted_keys[idx] == key[0]:
+            return idx
+        return -1
+
+    def group(self, idx):
+        """
+        Returns all elements at the given position
+
+        :rtype: list
+        """
+        return self.elements[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def first(self, idx):
+        """
+        Returns a single element at the given position
+        """
+        return self.elements[self.offsets[idx]]
+
+    def intersect(self, other):
+        """
+        Compare the hashes of two stores.
+
+        Returns three arrays of positions:
+        the common hashes in this store, the common hashes in the other store
+        and the hashes only found in this store.
+
+        :param ElementStore other:
+        :rtype: Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        """
+        _, common, other_common = np.intersect1d(self.sorted_keys, other.sorted_keys, assume_unique=True, return_indices=True)
+        mask = np.ones(len(self.sorted_keys), dtype=bool)
+        mask[common] = False
+        return common, other_common, np.flatnonzero(mask)
+
+    def __getitem__(self, h):
+        idx = self.find(h)
+        if idx < 0:
+            raise KeyError(h)
+        return self.group(idx)
+
+    def __contains__(self, h):
+        return self.find(h) >= 0
+
+    def __iter__(self):
+        for high, low in self.hashes:
+            yield join_hash(high, low)
+
+    def __len__(self):
+        return len(self.sorted_keys)
+
+
+class HashCounter:
+    """
+    Counts the hashes of a stream of elements, without keeping the elements.
+
+    The hashes are collected in a buffer, which is merged into the sorted unique hashes,
+    once it is full. Hence, the memory is bounded by the number of unique hashes.
+    """
+    def __init__(self, buffer_size=65536):
+        """
+        :param int buffer_size: number of hashes to collect before merging them
+        """
+        self.buffer_size = buffer_size
+        # Unique and sorted hashes
+        self.sorted_keys = np.empty(0, dtype=HASH_DTYPE)
+        # The number of occurrences for each hash in sorted_keys
+        self.counts = np.empty(0, dtype=np.int64)
+        self.__buffer = []
+
+    def add(self, h):
+        """
+        Count a single hash
+
+        :param int h: the hash of an element
+        """
+        self.__buffer.append(split_hash(h))
+        if len(self.__buffer) >= self.buffer_size:
+            self.merge()
+
+    def merge(self):
+        """
+        Merge the collected hashes into the unique hashes
+        """
+        if not self.__buffer:
+            return
+        keys = np.concatenate([self.sorted_keys, _keys(np.array(self.__buffer, dtype=np.uint64).reshape(-1, 2))])
+        counts = np.r_[self.counts, np.ones(len(self.__buffer), dtype=np.int64)]
+        self.__buffer = []
+        self.sorted_keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse.reshape(-1), weights=counts, minlength=len(self.sorted_keys)).astype(np.int64)
+
+    def total(self, exclude=None):
+        """
+        Returns the number of counted hashes
+
+        :param ElementStore exclude: do not count the hashes of this store (optional)
+        :rtype: int
+        """
+        self.merge()
+        if exclude is None:
+            return int(self.counts.sum())
+        _, common, _ = np.intersect1d(self.sorted_keys, exclude.sorted_keys, assume_unique=True, return_indices=True)
+        return int(self.counts.sum() - self.counts[common].sum())
+
+    def contains(self, hashes):
+        """
+        Returns for each hash, if it was counted before.
+        The collected hashes are not merged.
+
+        :param list hashes: the hashes to look up
+        :rtype: numpy.ndarray
+        """
+        split = [split_hash(h) for h in hashes]
+        keys = _keys(np.array(split, dtype=np.uint64).reshape(-1, 2))
+        idx = np.searchsorted(self.sorted_keys, keys)
+        found = np.zeros(len(keys), dtype=bool)
+        valid = idx < len(self.sorted_keys)
+        found[valid] = self.sorted_keys[idx[valid]] == keys[valid]
+        if self.__buffer:
+            buffered = set(self.__buffer)
+            found |= np.array([h in buffered for h in split], dtype=bool)
+        return found
+
+    def __contains__(self, h):
+        self.merge()
+        key = np.array([split_hash(h)], dtype=HASH_DTYPE)
+        idx = int(np.searchsorted(self.sorted_keys, key)[0])
+        return idx < len(self.sorted_keys) and self.sorted_keys[idx] == key[0]
+
+    def __len__(self):
+        self.merge()
+        return len(self.sorted_keys)
+
+
+class DiskRow(Mapping):
+    """
+    A single row of :class:`DiskRows`, which maps the elements of the columns to the distance.
+    Distances which were never set are not part of the row.
+    """
+    def __init__(self, rows, idx):
+        self.__rows = rows
+        self.__idx = idx
+
+    def __values(self):
+        return self.__rows.matrix[self.__idx]
+
+    def __getitem__(self, k):
+        value = self.__values()[self.__rows.column_index[k]]
+        if np.isnan(value):
+            raise KeyError(k)
+        return float(value)
+
+    def __iter__(self):
+        columns = self.__rows.columns
+        for i in np.flatnonzero(~np.isnan(self.__values())):
+            yield columns[i]
+
+    def __len__(self):
+        return int(np.count_nonzero(~np.isnan(self.__values())))
+
+    def items(self):
+        values = self.__values()
+        columns = self.__rows.columns
+        return [(columns[i], float(values[i])) for i in np.flatnonzero(~np.isnan(values))]
+
+
+class DiskRows(Mapping):
+    """
+    The rows of a similarity matrix, stored in a memory-mapped float32 file.
+
+    Rows are added as dictionaries, which map the elements of the columns
+    to the distance and are returned as :class:`DiskRow`.
+    The file is created in the given directory (or the default temporary directory)
+    and removed, once the object is closed or deleted.
+    """
+    def __init__(self, columns, rows, directory=None):
+        """
+        :param list columns: the elements of the columns
+        :param int rows: the maximal number of rows
+        :param str directory: directory for the file
+        """
+        self.columns = list(columns)
+        self.column_index = {k: i for i, k in enumerate(self.columns)}
+        self.__rows = dict()
+        self.__fp = tempfile.NamedTemporaryFile(dir=directory, prefix='elsim-', suffix='.npy')
+        self.matrix = np.lib.format.open_memmap(self.__fp.name, mode='w+', dtype=np.float32,
+                                                shape=(max(rows, 1), max(len(self.columns), 1)))
+
+    def __setitem__(self, j, row):
+        if j in self.__rows:
+            idx = self.__rows[j]
+        else:
+            idx = len(self.__rows)
+            if idx >= len(self.matrix):
+                raise ValueError("No space left for another row!")
+            self.__rows[j] = idx
+
+        values = np.full(self.matrix.shape[1], np.nan, dtype=np.float32)
+        for k, v in row.items():
+            values[self.column_index[k]] = v
+        self.matrix[idx] = values
+
+    def __getitem__(self, j):
+        return DiskRow(self, self.__rows[j])
+
+    def __contains__(self, j):
+        return j in self.__rows
+
+    def __iter__(self):
+        return iter(self.__rows)
+
+    def __len__(self):
+        return len(self.__rows)
+
+    def close(self):
+        """
+        Remove the file
+        """
+        self.matrix = None
+        self.__fp.close()
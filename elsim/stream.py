@@ -0,0 +1,309 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Comparing an iterable against a huge stream of elements
+
+:class:`~elsim.Elsim` keeps all elements of both iterables and the whole similarity matrix.
+If a small iterable is compared against a huge one, e.g. the methods of a single
+application against a large library corpus, this is not feasible.
+
+:class:`ElsimStream` indexes the first iterable and consumes the second one in chunks.
+For every element of the first iterable, only the closest element of the second iterable
+is kept. Of the second iterable, only the hashes and their number of occurrences
+are kept in a :class:`~elsim.store.HashCounter`, which is required to count the new elements.
+
+The categories and the similarity value are the same as the ones of :class:`~elsim.Elsim`,
+as long as FILTER_SORT_METH only depends on the closest element,
+which is true for :func:`~elsim.filters.filter_sort_meth_basic`.
+The new elements of the second iterable are only counted and not returned.
+The proxy of the second iterable must not keep its elements either,
+e.g. :class:`~elsim.dalvik.ProxyDalvik` of an Analysis does not keep them,
+while an :class:`~elsim.dalvik.AppFeatures` object keeps them by default.
+
+Example::
+
+    index = ElsimIndex(ProxyDalvik(dx), FILTERS_DALVIK_SIM, "BZ2")
+    el = ElsimStream(index, ProxyDalvik(library_corpus), threshold=0.4)
+    el.show()
+"""
+import time
+from operator import itemgetter
+
+import numpy as np
+
+from elsim import (ElsimIndex, FILTER_ELEMENT_METH, FILTER_SIM_METH, FILTER_SORT_METH, FILTER_SKIPPED_METH,
+                   FILTER_BUFFER_METH, FILTER_SIM_BATCH_METH)
+from elsim.report import similarity_value, print_summary
+from elsim.store import HashCounter
+
+
+class ElsimStream:
+    """
+    Compare an indexed iterable against a stream of elements, with memory bounded by the first iterable.
+
+    The elements of the second iterable are read in chunks.
+    The elements of each chunk, which are not identical to an element of the first iterable
+    and whose hash was not seen in an earlier chunk, are compared against every element
+    of the first iterable, which did not get an identical element so far.
+
+    If the filter dict contains FILTER_SIM_BATCH_METH and FILTER_BUFFER_METH, a row of a chunk
+    is compared at once. In this case, elements with empty buffers are never compared,
+    as they might still get an identical element later on.
+    """
+    def __init__(self, e1, e2, F=None, threshold=0.8, compressor=None, similarity_threshold=0.2, chunk_size=1024):
+        """
+        :param e1: the first iterable, either a Proxy or a prebuilt :class:`~elsim.ElsimIndex`
+        :type e1: Proxy or ElsimIndex
+        :param e2: the second iterable, which is only iterated once
+        :param dict F: Some Filter dictionary, can be omitted if e1 is an :class:`~elsim.ElsimIndex`
+        :param float threshold: value which used in the sort method to eliminate not interesting comparisons
+        :param str compressor: compression method name, or None to use the default one
+        :param float similarity_threshold: value to threshold similarity values with
+        :param int chunk_size: number of elements of the second iterable, which are compared at once
+        """
+        if not (0 <= threshold <= 1):
+            raise ValueError("threshold must be a number between 0 and 1!")
+        if not (0 <= similarity_threshold <= 1):
+            raise ValueError("similarity_threshold must be a number between 0 and 1!")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1!")
+        self.threshold = threshold
+        self.similarity_threshold = similarity_threshold
+        self.chunk_size = chunk_size
+
+        if isinstance(e1, ElsimIndex):
+            if F is not None and F is not e1.F:
+                raise ValueError("The filter dict must be the same as the one of the ElsimIndex!")
+            index = e1
+        else:
+            if F is None:
+                raise ValueError("A valid filter dict is required!")
+            index = ElsimIndex(e1, F, compressor)
+
+        self.index = index
+        self.F = index.F
+        self.sim = index.sim
+        self.compressor = index.compressor
+        self.sim.set_compress_type(self.compressor)
+        self.e2 = e2
+
+        store = index.ref_set_ident
+        self.store = store
+        # The hashes of the second iterable
+        self.hashes = HashCounter()
+        # Number of skipped elements in the second iterable
+        self.skipped2 = 0
+        # Number of pairs, which were evaluated
+        self.pairs_evaluated = 0
+        self.elapsed = 0.0
+
+        # For each hash of the first iterable: was an identical element found,
+        # the closest element, its distance and its hash
+        self.__identical = np.zeros(len(store), dtype=bool)
+        self.__best = [None] * len(store)
+        self.__best_distance = np.full(len(store), np.inf)
+        self.__best_hash = [None] * len(store)
+
+        self.__batch = FILTER_SIM_BATCH_METH in self.F and FILTER_BUFFER_METH in self.F
+        self.__buffers = None
+        if self.__batch:
+            self.__buffers = [self.F[FILTER_BUFFER_METH](store.first(i)) for i in range(len(store))]
+
+        self.__scores = dict()
+        self.__similar = []
+        self.__deleted = []
+        self.__new = 0
+
+        self.run()
+
+    def __chunks(self):
+        """
+        Yield the not skipped elements of the second iterable in chunks
+        """
+        chunk = []
+        for element in self.e2:
+            e = self.F[FILTER_ELEMENT_METH](element, self.e2, self.sim)
+            if self.F[FILTER_SKIPPED_METH].skip(e):
+                self.skipped2 += 1
+                continue
+            chunk.append(e)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def run(self):
+        start = time.time()
+        for chunk in self.__chunks():
+            self.__compare_chunk(chunk)
+        self.__sort()
+        self.elapsed = time.time() - start
+
+    def __compare_chunk(self, chunk):
+        columns = dict()
+        for e in chunk:
+            h = e.hash
+            idx = self.store.find(h)
+            if idx >= 0:
+                self.__identical[idx] = True
+            elif h not in columns:
+                columns[h] = e
+
+        # Elements with the hash of an earlier chunk were already compared
+        if columns:
+            seen = self.hashes.contains(list(columns))
+            columns = [k for k, s in zip(columns.values(), seen) if not s]
+        for e in chunk:
+            self.hashes.add(e.hash)
+
+        if not columns:
+            return
+
+        buffers = None
+        if self.__batch:
+            buffers = [self.F[FILTER_BUFFER_METH](k) for k in columns]
+            columns = [k for k, b in zip(columns, buffers) if b]
+            buffers = [b for b in buffers if b]
+            if not columns:
+                return
+        hashes = [k.hash for k in columns]
+
+        for i in np.flatnonzero(~self.__identical):
+            j = self.store.first(i)
+            if self.__batch:
+                if not self.__buffers[i]:
+                    continue
+                distances = self.F[FILTER_SIM_BATCH_METH](self.sim, self.__buffers[i], buffers)
+            else:
+                distances = [self.F[FILTER_SIM_METH](self.sim, j, k) for k in columns]
+            self.pairs_evaluated += len(columns)
+
+            distances = np.asarray(distances, dtype=np.float64)
+            distance = distances.min()
+            # Of all equally close elements, the one with the smallest hash is taken,
+            # which is the first one in the sorted columns of Elsim
+            h, k = min((hashes[c], c) for c in np.flatnonzero(distances == distance))
+            if distance < self.__best_distance[i] or (distance == self.__best_distance[i] and h < self.__best_hash[i]):
+                self.__best_distance[i] = distance
+                self.__best_hash[i] = h
+                self.__best[i] = columns[k]
+
+    def __sort(self):
+        """
+        Sort the elements of the first iterable into similar and deleted
+        and count the new elements of the second iterable
+        """
+        matched = set()
+        for i in np.flatnonzero(~self.__identical):
+            j = self.store.first(i)
+            row = {self.__best[i]: float(self.__best_distance[i])} if self.__best[i] is not None else dict()
+            sort_h = self.F[FILTER_SORT_METH](j, row, self.threshold)
+            if sort_h:
+                self.__similar.append((j, sort_h[0][0], sort_h[0][1]))
+                matched.add(self.__best_hash[i])
+            else:
+                self.__deleted.append(j)
+
+        # Only the first element of each matched hash is not new
+        self.__new = self.hashes.total(exclude=self.store) - len(matched)
+
+    def get_identical_elements(self):
+        """
+        Return the elements of the first iterable, which have an identical element in the second one
+        """
+        return [e for i in np.flatnonzero(self.__identical) for e in self.store.group(i)]
+
+    def get_similar_elements(self):
+        """
+        Return the similar elements of the first iterable
+        """
+        return [j for j, _, _ in self.__similar]
+
+    def get_deleted_elements(self):
+        """
+        Return the deleted elements of the first iterable
+        """
+        return list(self.__deleted)
+
+    def get_skipped_elements(self):
+        """
+        Return the skipped elements of the first iterable, the ones of the second iterable are only counted
+        """
+        return self.index.skipped
+
+    def count_new_elements(self):
+        """
+        Returns the number of new elements in the second iterable
+
+        :rtype: int
+        """
+        return self.__new
+
+    def split_elements(self):
+        """
+        Returns a list of tuples of the similar elements and their associated element
+        """
+        return [(j, k) for j, k, _ in self.__similar]
+
+    def get_closest_element(self, i):
+        """
+        Returns a tuple of the closest element and its distance for element i,
+        regardless of the threshold.
+        If there are no elements to compare to, None is returned.
+        """
+        idx = self.store.find(i.hash)
+        if idx < 0 or self.__best[idx] is None or self.__identical[idx]:
+            return None
+        return self.__best[idx], float(self.__best_distance[idx])
+
+    def get_similarity_value(self, new=True, deleted=True):
+        """
+        Returns a score in percent of how similar the two iterables are,
+        see :meth:`elsim.Elsim.get_similarity_value`.
+
+        :param bool new: Should new elements regarded as beeing dissimilar
+        :param bool deleted: Should deleted elements regarded as beeing dissimilar
+        """
+        key = (bool(new), bool(deleted))
+        if key not in self.__scores:
+            self.__scores[key] = similarity_value([d for _, _, d in self.__similar],
+                                                  len(self.get_identical_elements()),
+                                                  self.__new if new else 0,
+                                                  len(self.__deleted) if deleted else 0,
+                                                  self.similarity_threshold)
+        return self.__scores[key]
+
+    def show(self, new=True, deleted=True, details=False):
+        """
+        Print information about the elements to stdout
+
+        :param bool new: Should new elements regarded as beeing dissimilar (passed to get_similarity_value)
+        :param bool deleted: Should deleted elements regarded as beeing dissimilar (passed to get_similarity_value)
+        :param bool details: Print the similar elements and their closest element
+        """
+        counts = (len(self.get_identical_elements()), len(self.__similar), self.__new, len(self.__deleted),
+                  len(self.index.skipped) + self.skipped2)
+        print_summary(self.compressor.name, counts, self.get_similarity_value(new, deleted), new, deleted)
+
+        if details and self.__similar:
+            print()
+            print("SIMILAR elements:")
+            for j, k, distance in sorted(self.__similar, key=itemgetter(2)):
+                print("\t", j)
+                print("\t\t-s->", k, distance)
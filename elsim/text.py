@@ -20,10 +20,13 @@ import re
 import mmh3
 
 import elsim
-from elsim.filters import FilterEmpty, filter_sort_meth_basic
+from elsim.filters import (FilterEmpty, filter_sort_meth_basic, filter_buffer_meth_buff, filter_sim_meth_ncd,
+                           filter_sim_batch_meth_ncd, filter_sim_column_meth_ncd)
 
 
 class CheckSumText:
+    __slots__ = ('buff',)
+
     def __init__(self, s1):
         """
         :param Text s1: the element
@@ -41,6 +44,8 @@ class Text:
 
     trailing and leading whitespaces are removed from the text.
     """
+    __slots__ = ('string', 'sim', '__hash', '__checksum')
+
     def __init__(self, element, sim):
         self.string = element.strip(b' ')
         self.sim = sim
@@ -68,9 +73,16 @@ class Text:
         return str(self)
 
 
+def filter_element_meth_text(element, iterable, sim):
+    return Text(element, sim)
+
+
 FILTERS_TEXT = {
-    elsim.FILTER_ELEMENT_METH: lambda element, iterable, sim: Text(element, sim),
-    elsim.FILTER_SIM_METH: lambda sim, element1, element2: sim.ncd(element1.checksum.get_buff(), element2.checksum.get_buff()),
+    elsim.FILTER_ELEMENT_METH: filter_element_meth_text,
+    elsim.FILTER_SIM_METH: filter_sim_meth_ncd,
+    elsim.FILTER_BUFFER_METH: filter_buffer_meth_buff,
+    elsim.FILTER_SIM_BATCH_METH: filter_sim_batch_meth_ncd,
+    elsim.FILTER_SIM_COLUMN_METH: filter_sim_column_meth_ncd,
     elsim.FILTER_SORT_METH: filter_sort_meth_basic,
     elsim.FILTER_SKIPPED_METH: FilterEmpty,
 }
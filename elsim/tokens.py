@@ -0,0 +1,117 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Interned instruction tokens of Dalvik methods
+
+The checksums of methods and basic blocks, the hex signature and the diffs of basic blocks
+all describe an instruction by its cleaned name and its static operands.
+A :class:`TokenTable` decodes the instructions of each method only once into an array of integers,
+where every distinct token is stored once in the table.
+The buffers, which are hashed and compressed, are joined from these arrays,
+and the diffs compare the arrays directly.
+
+There is one table for each :class:`~elsim.sign.Signature`, i.e. for each analysed file.
+The ids of two tables can not be compared.
+"""
+from array import array
+from bisect import bisect_left
+
+from androguard.core.bytecodes import dvm
+
+
+def instruction_token(instruction):
+    """
+    Returns the cleaned name and the static operands of an instruction
+
+    :rtype: str
+    """
+    return dvm.clean_name_instruction(instruction) + dvm.static_operand_instruction(instruction)
+
+
+class TokenTable:
+    """
+    Maps the tokens of instructions to integers and keeps the token arrays of the methods
+    """
+    def __init__(self):
+        # The token of each id
+        self.tokens = []
+        # The id of each token
+        self.ids = dict()
+        # The ids and offsets of the instructions for each method
+        self.__methods = dict()
+
+    def intern(self, token):
+        """
+        Returns the id of the token, a new id is assigned if the token was never seen before
+
+        :param str token:
+        :rtype: int
+        """
+        i = self.ids.get(token)
+        if i is None:
+            i = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return i
+
+    def method(self, method):
+        """
+        Returns the token ids and the offsets of all instructions of the method.
+        The instructions are only decoded on the first call.
+
+        :param androguard.core.bytecodes.dvm.EncodedMethod method:
+        :rtype: Tuple[array.array, array.array]
+        """
+        if method not in self.__methods:
+            ids = array('I')
+            offsets = array('I')
+            idx = 0
+            for i in method.get_instructions():
+                ids.append(self.intern(instruction_token(i)))
+                offsets.append(idx)
+                idx += i.get_length()
+            self.__methods[method] = ids, offsets
+        return self.__methods[method]
+
+    def basic_block(self, bb):
+        """
+        Returns the token ids and the offsets of the instructions of a basic block
+
+        :param androguard.core.analysis.analysis.DVMBasicBlock bb:
+        :rtype: Tuple[array.array, array.array]
+        """
+        ids, offsets = self.method(bb.method)
+        start = bisect_left(offsets, bb.start)
+        end = bisect_left(offsets, bb.end)
+        return ids[start:end], offsets[start:end]
+
+    def text(self, ids):
+        """
+        Returns the joined tokens
+
+        :rtype: str
+        """
+        tokens = self.tokens
+        return "".join([tokens[i] for i in ids])
+
+    def buffer(self, ids):
+        """
+        Returns the joined tokens as UTF-8
+
+        :rtype: bytes
+        """
+        return self.text(ids).encode('UTF-8')
@@ -21,10 +21,13 @@
 import mmh3
 
 import elsim
-from elsim.filters import FilterNone, filter_sort_meth_basic
+from elsim.filters import (FilterNone, filter_sort_meth_basic, filter_buffer_meth_buff, filter_sim_meth_ncd,
+                           filter_sim_batch_meth_ncd, filter_sim_column_meth_ncd)
 
 
 class CheckSumFunc:
+    __slots__ = ('f', 'sim', 'buff', 'entropy', 'signature', 'signature_entropy')
+
     def __init__(self, f, sim):
         self.f = f
         self.sim = sim
@@ -60,6 +63,8 @@ class CheckSumFunc:
 
 
 class Instruction:
+    __slots__ = ('mnemonic',)
+
     def __init__(self, i):
         self.mnemonic = i[1]
 
@@ -68,6 +73,8 @@ class Instruction:
 
 
 class Function:
+    __slots__ = ('function', 'sim', '__hash', '__checksum')
+
     def __init__(self, el, sim):
         self.function = el
         self.sim = sim
@@ -97,9 +104,16 @@ class Function:
         return self.__hash
 
 
+def filter_element_meth_function(element, iterable, sim):
+    return Function(element, sim)
+
+
 FILTERS_X86 = {
-        elsim.FILTER_ELEMENT_METH: lambda element, iterable, sim: Function(element, sim),
-        elsim.FILTER_SIM_METH: lambda sim, m1, m2: sim.ncd(m1.checksum.get_buff(), m2.checksum.get_buff()),
+        elsim.FILTER_ELEMENT_METH: filter_element_meth_function,
+        elsim.FILTER_SIM_METH: filter_sim_meth_ncd,
+        elsim.FILTER_BUFFER_METH: filter_buffer_meth_buff,
+        elsim.FILTER_SIM_BATCH_METH: filter_sim_batch_meth_ncd,
+        elsim.FILTER_SIM_COLUMN_METH: filter_sim_column_meth_ncd,
         elsim.FILTER_SORT_METH: filter_sort_meth_basic,
         elsim.FILTER_SKIPPED_METH: FilterNone,
 }
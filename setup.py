@@ -40,6 +40,8 @@ setup(
             "elsimbenchmark = elsim.cli.benchmark:cli",
             "androdb = elsim.cli.androdb:cli",
             "androsign = elsim.cli.androsign:cli",
+            "elsimcorpus = elsim.cli.corpus:cli",
+            "elsimlibrary = elsim.cli.library:cli",
             ],
         },
     ext_modules=[
@@ -0,0 +1,113 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from elsim import Elsim, corpus
+from elsim.text import ProxyText, FILTERS_TEXT
+
+TEXT_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples', 'text')
+TEXT_FILES = [os.path.join(TEXT_DIR, f) for f in ('COPYING.LESSER', 'COPYING.LESSER.MODIF',
+                                                   'COPYING.LESSER.MODIF_ADD', 'COPYING.LESSER.MODIF.info')]
+
+try:
+    import scipy
+except ImportError:
+    scipy = None
+
+
+class CorpusTests(unittest.TestCase):
+    def setUp(self):
+        self.samples = corpus.extract_samples(TEXT_FILES, "text", jobs=1)
+
+    def test_matrix(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'matrix.npy')
+            matrix = corpus.compute_matrix(self.samples, filename, jobs=1)
+
+            self.assertEqual(matrix.shape, (4, 4))
+            self.assertFalse(np.isnan(matrix).any())
+            np.testing.assert_array_equal(matrix, matrix.T)
+            np.testing.assert_array_equal(np.diag(matrix), 100)
+
+            with open(TEXT_FILES[0], 'rb') as fp:
+                b1 = fp.read()
+            with open(TEXT_FILES[1], 'rb') as fp:
+                b2 = fp.read()
+            el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6)
+            self.assertAlmostEqual(matrix[0, 1], el.get_similarity_value(), places=3)
+
+            loaded, meta = corpus.load_matrix(filename)
+            np.testing.assert_array_equal(loaded, matrix)
+            self.assertEqual(meta["names"], TEXT_FILES)
+
+    def test_parallel(self):
+        with tempfile.TemporaryDirectory() as d:
+            serial = corpus.compute_matrix(self.samples, os.path.join(d, 'a.npy'), jobs=1)
+            parallel = corpus.compute_matrix(self.samples, os.path.join(d, 'b.npy'), jobs=2)
+            np.testing.assert_allclose(serial, parallel)
+
+        tasks = corpus.upper_triangle(len(self.samples))
+        serial = {(i, j): v for i, c, values in corpus.compute_rows(self.samples, tasks, jobs=1)
+                  for j, v in zip(c, values)}
+        tiled = {(i, j): v for i, c, values in corpus.compute_rows(self.samples, tasks, jobs=2, block_size=1)
+                 for j, v in zip(c, values)}
+        self.assertEqual(serial.keys(), tiled.keys())
+        for k, v in serial.items():
+            self.assertAlmostEqual(v, tiled[k])
+
+    def test_shards(self):
+        pairs = sorted((i, j) for i, columns in corpus.upper_triangle(7) for j in columns)
+        sharded = sorted((i, j) for shard in range(3) for i, columns in corpus.shard_triangle(7, shard, 3) for j in columns)
+        self.assertEqual(pairs, sharded)
+        with self.assertRaises(ValueError):
+            corpus.shard_triangle(7, 3, 3)
+
+        # Each shard only requires a part of the samples
+        pairs = sorted((i, j) for i, columns in corpus.upper_triangle(40) for j in columns)
+        sharded = []
+        for shard in range(8):
+            tasks = corpus.shard_triangle(40, shard, 8)
+            sharded.extend((i, j) for i, columns in tasks for j in columns)
+            self.assertLessEqual(len({i for i, _ in tasks} | {j for _, columns in tasks for j in columns}), 20)
+            self.assertLessEqual(sum(len(columns) for _, columns in tasks), 100)
+        self.assertEqual(pairs, sorted(sharded))
+
+        with tempfile.TemporaryDirectory() as d:
+            full = corpus.compute_matrix(self.samples, os.path.join(d, 'full.npy'), jobs=1)
+
+            shards = []
+            for shard in range(3):
+                shards.append(os.path.join(d, 'shard{}.npz'.format(shard)))
+                corpus.compute_shard(TEXT_FILES, shards[-1], shard, 3, "text", jobs=1)
+
+            with self.assertRaises(ValueError):
+                corpus.merge_shards(shards[:2], os.path.join(d, 'merged.npy'))
+
+            merged = corpus.merge_shards(shards, os.path.join(d, 'merged.npy'))
+            np.testing.assert_allclose(full, merged)
+
+    @unittest.skipIf(scipy is None, "scipy is not installed")
+    def test_cluster(self):
+        matrix = np.array([[100, 90, 10], [90, 100, 20], [10, 20, 100]], dtype=np.float32)
+        labels = corpus.cluster(matrix, 0.5)
+        self.assertEqual(labels[0], labels[1])
+        self.assertNotEqual(labels[0], labels[2])
@@ -0,0 +1,187 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import unittest
+
+try:
+    from androguard.misc import AnalyzeDex
+except ImportError:
+    AnalyzeDex = None
+
+ANDROID_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples', 'android')
+
+
+@unittest.skipIf(AnalyzeDex is None, "androguard is not installed")
+class CheckSumMethTests(unittest.TestCase):
+    def setUp(self):
+        from elsim.sign import Signature
+        self.dx = AnalyzeDex(os.path.join(ANDROID_DIR, 'classes_tc.dex'))[2]
+        self.calls = 0
+        get_method_signature = Signature.get_method_signature
+
+        def counting(sig, *args, **kwargs):
+            self.calls += 1
+            return get_method_signature(sig, *args, **kwargs)
+
+        Signature.get_method_signature = counting
+        self.addCleanup(setattr, Signature, 'get_method_signature', get_method_signature)
+
+    def test_identical_without_signature(self):
+        from elsim import Elsim
+        from elsim.dalvik import FILTERS_DALVIK_SIM
+        from elsim.dalvik import ProxyDalvik
+        el = Elsim(ProxyDalvik(self.dx), ProxyDalvik(self.dx), FILTERS_DALVIK_SIM, 0.6, "BZ2")
+        self.assertGreater(len(el.get_identical_elements()), 0)
+        self.assertEqual(len(el.get_similar_elements()), 0)
+        self.assertEqual(self.calls, 0)
+
+    def test_components_cached(self):
+        from elsim.dalvik import FILTERS_DALVIK_SIM
+        from elsim import FILTER_ELEMENT_METH
+        from elsim.dalvik import ProxyDalvik
+        from elsim.similarity import Similarity
+        proxy = ProxyDalvik(self.dx)
+        m = FILTERS_DALVIK_SIM[FILTER_ELEMENT_METH](next(iter(proxy)), proxy, Similarity())
+        self.assertIsInstance(m.hash, int)
+        self.assertEqual(self.calls, 0)
+        signature = m.checksum.get_signature()
+        self.assertIs(m.checksum.get_signature(), signature)
+        self.assertEqual(self.calls, 1)
+        self.assertGreaterEqual(m.checksum.get_signature_entropy(), 0.0)
+        self.assertGreaterEqual(m.checksum.get_entropy(), 0.0)
+
+
+@unittest.skipIf(AnalyzeDex is None, "androguard is not installed")
+class TokenTableTests(unittest.TestCase):
+    def test_tokens(self):
+        from androguard.core.bytecodes import dvm
+        from elsim.sign import Signature
+        dx = AnalyzeDex(os.path.join(ANDROID_DIR, 'classes_tc.dex'))[2]
+        sig = Signature(dx)
+        tokens = sig.tokens
+        for mx in dx.get_methods():
+            if mx.is_external():
+                continue
+            m = mx.get_method()
+            expected = "".join(dvm.clean_name_instruction(i) + dvm.static_operand_instruction(i)
+                               for i in m.get_instructions())
+            ids, _ = tokens.method(m)
+            self.assertEqual(tokens.text(ids), expected)
+            self.assertIs(tokens.method(m)[0], ids)
+            self.assertEqual(sig._get_hex(mx), expected)
+
+            for bb in mx.basic_blocks.get():
+                ids, offsets = tokens.basic_block(bb)
+                instructions = list(bb.get_instructions())
+                self.assertEqual(len(ids), len(instructions))
+                self.assertEqual([tokens.tokens[i] for i in ids],
+                                 [dvm.clean_name_instruction(i) + dvm.static_operand_instruction(i)
+                                  for i in instructions])
+        self.assertEqual(len(tokens.tokens), len(set(tokens.tokens)))
+
+
+@unittest.skipIf(AnalyzeDex is None, "androguard is not installed")
+class AppFeaturesTests(unittest.TestCase):
+    def test_shared_elements(self):
+        from elsim import Elsim, FILTER_ELEMENT_METH
+        from elsim.dalvik import (AppFeatures, ProxyDalvik, ProxyDalvikMethod, ProxyDalvikString, FILTERS_DALVIK_SIM,
+                                  FILTERS_DALVIK_BB, FILTERS_DALVIK_SIM_STRING)
+        from elsim.similarity import Similarity
+        dx1 = AnalyzeDex(os.path.join(ANDROID_DIR, 'classes_tc.dex'))[2]
+        dx2 = AnalyzeDex(os.path.join(ANDROID_DIR, 'classes_tc_diff.dex'))[2]
+        features1 = AppFeatures(dx1)
+        features2 = AppFeatures(dx2)
+        self.assertIs(AppFeatures.of(features1), features1)
+        self.assertIs(ProxyDalvik(features1).sig, ProxyDalvikString(features1).features.sig)
+
+        reference = Elsim(ProxyDalvik(dx1), ProxyDalvik(dx2), FILTERS_DALVIK_SIM, 0.6, "BZ2")
+        el = Elsim(ProxyDalvik(features1), ProxyDalvik(features2), FILTERS_DALVIK_SIM, 0.6, "BZ2")
+        again = Elsim(ProxyDalvik(features1), ProxyDalvik(features2), FILTERS_DALVIK_SIM, 0.6, "BZ2")
+        self.assertEqual(el.get_similarity_value(), reference.get_similarity_value())
+        self.assertEqual(again.get_similarity_value(), el.get_similarity_value())
+        self.assertEqual(set(again.get_similar_elements()), set(el.get_similar_elements()))
+
+        proxy = ProxyDalvik(features1)
+        m = next(iter(proxy))
+        sim = Similarity()
+        self.assertIs(FILTERS_DALVIK_SIM[FILTER_ELEMENT_METH](m, proxy, sim),
+                      FILTERS_DALVIK_SIM[FILTER_ELEMENT_METH](m, ProxyDalvik(features1), sim))
+
+        i, j = el.split_elements()[0]
+        self.assertIs(ProxyDalvikMethod(i).features, features1)
+        elb = Elsim(ProxyDalvikMethod(i), ProxyDalvikMethod(j), FILTERS_DALVIK_BB, 0.6, "BZ2")
+        self.assertGreater(len(elb.get_similar_elements()) + len(elb.get_identical_elements()), 0)
+
+        els = Elsim(ProxyDalvikString(features1), ProxyDalvikString(features2), FILTERS_DALVIK_SIM_STRING, 0.6, "BZ2")
+        self.assertGreater(els.get_similarity_value(), 0.0)
+
+    def test_stream_without_cache(self):
+        from elsim import Elsim, ElsimIndex
+        from elsim.dalvik import AppFeatures, ProxyDalvik, FILTERS_DALVIK_SIM
+        from elsim.stream import ElsimStream
+        dx1 = AnalyzeDex(os.path.join(ANDROID_DIR, 'classes_tc.dex'))[2]
+        dx2 = AnalyzeDex(os.path.join(ANDROID_DIR, 'classes_tc_diff.dex'))[2]
+        index = ElsimIndex(ProxyDalvik(AppFeatures(dx1)), FILTERS_DALVIK_SIM, "BZ2")
+        cached = len(index.iterable.features)
+        self.assertGreater(cached, 0)
+
+        proxy = ProxyDalvik(dx2)
+        self.assertFalse(proxy.features.cache)
+        el = ElsimStream(index, proxy, threshold=0.6, chunk_size=8)
+        self.assertEqual(len(proxy.features), 0)
+        self.assertEqual(len(index.iterable.features), cached)
+        reference = Elsim(ProxyDalvik(dx1), ProxyDalvik(dx2), FILTERS_DALVIK_SIM, 0.6, "BZ2")
+        self.assertAlmostEqual(el.get_similarity_value(), reference.get_similarity_value())
+
+
+@unittest.skipIf(AnalyzeDex is None, "androguard is not installed")
+class LibraryDBTests(unittest.TestCase):
+    def test_library(self):
+        import pickle
+        import tempfile
+        from elsim import Elsim, FILTER_SKIPPED_METH
+        from elsim.dalvik import AppFeatures, ProxyDalvik, FilterSkip, FILTERS_DALVIK_SIM
+        from elsim.library import LibraryDB
+
+        dx1 = AppFeatures(AnalyzeDex(os.path.join(ANDROID_DIR, 'classes_tc.dex'))[2])
+        dx2 = AppFeatures(AnalyzeDex(os.path.join(ANDROID_DIR, 'classes_tc_diff.dex'))[2])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = LibraryDB(os.path.join(tmpdir, "libraries.sqlite"))
+            n = db.add(dx1, "tc", "1.0", include=r"^Lorg/t0t0/androguard/TC/TCC")
+            self.assertGreater(n, 0)
+            self.assertEqual(db.add(dx1, "tc", "1.0", include=r"^Lorg/t0t0/androguard/TC/TCC"), 0)
+            self.assertEqual(db.libraries(), [("tc", "1.0", n)])
+            self.assertEqual(len(pickle.loads(pickle.dumps(db))), len(db))
+
+            F = dict(FILTERS_DALVIK_SIM)
+            F[FILTER_SKIPPED_METH] = FilterSkip(library=db)
+            reference = Elsim(ProxyDalvik(dx1), ProxyDalvik(dx2), FILTERS_DALVIK_SIM, 0.6, "BZ2")
+            el = Elsim(ProxyDalvik(dx1), ProxyDalvik(dx2), F, 0.6, "BZ2")
+
+            skipped = el.get_skipped_elements()
+            self.assertGreater(len(skipped), len(reference.get_skipped_elements()))
+            libraries = F[FILTER_SKIPPED_METH].libraries(skipped)
+            self.assertEqual(list(libraries), [("tc", "1.0")])
+            self.assertEqual(len(libraries["tc", "1.0"]), len(skipped))
+            for m in libraries["tc", "1.0"]:
+                self.assertIn(m.hash, db)
+                self.assertEqual(db.lookup(m.hash), [("tc", "1.0")])
+            # Library methods are never compared
+            for m in el.get_similar_elements():
+                self.assertNotIn(m.hash, db)
+            db.close()
@@ -0,0 +1,61 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import random
+import unittest
+
+from elsim.diff import myers_diff
+
+
+def lcs_length(a, b):
+    C = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            if a[i - 1] == b[j - 1]:
+                C[i][j] = C[i - 1][j - 1] + 1
+            else:
+                C[i][j] = max(C[i - 1][j], C[i][j - 1])
+    return C[-1][-1]
+
+
+class MyersDiffTests(unittest.TestCase):
+    def test_simple(self):
+        self.assertEqual(myers_diff("", ""), ([], []))
+        self.assertEqual(myers_diff("abc", "abc"), ([], []))
+        self.assertEqual(myers_diff("", "ab"), ([0, 1], []))
+        self.assertEqual(myers_diff("ab", ""), ([], [0, 1]))
+        # The example of Myers (1986) has an edit distance of 5
+        added, removed = myers_diff("abcabba", "cbabac")
+        self.assertEqual(len(added) + len(removed), 5)
+
+    def test_shortest(self):
+        rnd = random.Random(42)
+        for _ in range(500):
+            a = [rnd.randint(0, 3) for _ in range(rnd.randint(0, 20))]
+            b = [rnd.randint(0, 3) for _ in range(rnd.randint(0, 20))]
+            added, removed = myers_diff(a, b)
+            common = lcs_length(a, b)
+            self.assertEqual(len(added), len(b) - common)
+            self.assertEqual(len(removed), len(a) - common)
+            self.assertEqual([x for i, x in enumerate(a) if i not in removed],
+                             [x for i, x in enumerate(b) if i not in added])
+
+    def test_long(self):
+        # Far beyond the recursion limit and a quadratic table
+        a = list(range(50000))
+        b = a[:20000] + [-1] + a[20001:]
+        self.assertEqual(myers_diff(a, b), ([20000], [20000]))
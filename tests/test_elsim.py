@@ -0,0 +1,634 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import pickle
+import tempfile
+import threading
+import unittest
+from difflib import SequenceMatcher
+
+from elsim import Elsim, Eldiff, ElsimIndex, Proxy, DIFF, DIFF_PREPARE, DIFF_COMPARE, DIFF_FINISH, FILTER_BUFFER_METH, FILTER_SIM_BATCH_METH, FILTER_SIM_COLUMN_METH, FILTER_SIM_METH, SIMILARITY_ELEMENTS
+from elsim.cache import DistanceCache
+from elsim.checkpoint import format_hash
+from elsim.filters import DetachedElement, FILTERS_DETACHED
+from elsim.result import ElsimResult
+from elsim.similarity import Similarity
+from elsim.store import ElementStore
+from elsim.text import ProxyText, Text, FILTERS_TEXT
+
+TEXT_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples', 'text')
+
+
+class WordDiff:
+    def __init__(self, added, deleted):
+        self.added = added
+        self.deleted = deleted
+
+    def get_added_elements(self):
+        return iter(self.added)
+
+    def get_deleted_elements(self):
+        return iter(self.deleted)
+
+
+def word_diff_prepare(x, y):
+    return x.split(), y.split()
+
+
+def word_diff_compare(state):
+    a, b = state
+    added, deleted = [], []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b).get_opcodes():
+        if tag != 'equal':
+            deleted.extend(a[i1:i2])
+            added.extend(b[j1:j2])
+    return added, deleted
+
+
+def word_diff_finish(x, y, result):
+    return WordDiff(*result)
+
+
+def word_diff(x, y):
+    return word_diff_finish(x, y, word_diff_compare(word_diff_prepare(x, y)))
+
+
+FILTERS_WORD_DIFF = {
+    DIFF: word_diff,
+    DIFF_PREPARE: word_diff_prepare,
+    DIFF_COMPARE: word_diff_compare,
+    DIFF_FINISH: word_diff_finish,
+}
+
+
+def half_sim(sim, e1, e2):
+    return FILTERS_TEXT[FILTER_SIM_METH](sim, e1, e2) / 2
+
+
+def load_text(name):
+    with open(os.path.join(TEXT_DIR, name), 'rb') as fp:
+        return fp.read()
+
+
+class ElsimResultTests(unittest.TestCase):
+    def setUp(self):
+        self.el = Elsim(ProxyText(load_text('COPYING.LESSER')),
+                        ProxyText(load_text('COPYING.LESSER.MODIF')),
+                        FILTERS_TEXT, threshold=0.6, compressor='BZ2')
+
+    def assertSameResult(self, el, res):
+        self.assertEqual(sorted(map(str, el.get_identical_elements())), sorted(res.get_identical_elements()))
+        self.assertEqual(sorted(map(str, el.get_similar_elements())), sorted(res.get_similar_elements()))
+        self.assertEqual(sorted(map(str, el.get_new_elements())), sorted(res.get_new_elements()))
+        self.assertEqual(sorted(map(str, el.get_deleted_elements())), sorted(res.get_deleted_elements()))
+        self.assertEqual(sorted(map(str, el.get_skipped_elements())), sorted(res.get_skipped_elements()))
+        for new in (True, False):
+            for deleted in (True, False):
+                self.assertEqual(el.get_similarity_value(new, deleted),
+                                 res.get_similarity_value(new, deleted))
+
+    def test_snapshot(self):
+        res = self.el.get_result()
+        self.assertSameResult(self.el, res)
+        self.assertEqual(sorted((str(a), str(b)) for a, b in self.el.split_elements()),
+                         sorted(res.split_elements()))
+
+    def test_save_load(self):
+        res = self.el.get_result()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ('result.json', 'result.npz'):
+                filename = os.path.join(tmpdir, name)
+                res.save(filename)
+                loaded = ElsimResult.load(filename)
+
+                self.assertSameResult(self.el, loaded)
+                self.assertEqual(loaded.names, res.names)
+                self.assertTrue((loaded.hashes == res.hashes).all())
+                self.assertEqual(loaded.compressor, 'BZ2')
+                for i in range(len(res)):
+                    self.assertEqual(loaded.get_hash(i), res.get_hash(i))
+
+    def test_distance_precision(self):
+        # A distance just below the similarity threshold must not be rounded up to it
+        res = ElsimResult(['a', 'b'], [[1, 2], [3, 4]], [0, 1], [2, 0], [1, -1], [0.19999999, float('nan')],
+                          similarity_threshold=0.2)
+        self.assertEqual(res.distances[0], 0.19999999)
+        self.assertAlmostEqual(res.get_similarity_value(), 80.000001)
+
+
+class ElsimIndexTests(unittest.TestCase):
+    def test_query(self):
+        """Querying the index must give the same result as Elsim"""
+        reference = load_text('COPYING.LESSER')
+        index = ElsimIndex(ProxyText(reference), FILTERS_TEXT, 'BZ2')
+
+        for name in ('COPYING.LESSER.MODIF', 'COPYING.LESSER.MODIF_ADD',
+                     'COPYING.LESSER.MODIF_ADDREMOVE', 'COPYING.LESSER.MODIF_REORDER'):
+            other = load_text(name)
+            el = Elsim(ProxyText(reference), ProxyText(other), FILTERS_TEXT, threshold=0.6, compressor='BZ2')
+            eli = index.query(ProxyText(other), threshold=0.6)
+
+            self.assertEqual(len(el.get_identical_elements()), len(eli.get_identical_elements()))
+            self.assertEqual(len(el.get_similar_elements()), len(eli.get_similar_elements()))
+            self.assertEqual(len(el.get_new_elements()), len(eli.get_new_elements()))
+            self.assertEqual(len(el.get_deleted_elements()), len(eli.get_deleted_elements()))
+            self.assertAlmostEqual(el.get_similarity_value(), eli.get_similarity_value())
+
+    def test_mismatch(self):
+        index = ElsimIndex(ProxyText(b'hello world'), FILTERS_TEXT, 'BZ2')
+        with self.assertRaises(ValueError):
+            Elsim(index, ProxyText(b'hello world'), FILTERS_TEXT, compressor='ZLIB')
+        with self.assertRaises(ValueError):
+            Elsim(index, ProxyText(b'hello world'), dict(FILTERS_TEXT))
+
+
+class ElsimStreamingTests(unittest.TestCase):
+    def setUp(self):
+        self.b1 = load_text('COPYING.LESSER')
+        self.b2 = load_text('COPYING.LESSER.MODIF_REORDER')
+
+    def test_iter_rows(self):
+        el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6, lazy=True)
+        self.assertEqual(el.get_similar_elements(), [])
+
+        progress = []
+        el.progress = progress.append
+        rows = list(el.iter_rows())
+
+        self.assertFalse(el.cancelled)
+        self.assertEqual(len(rows), len(progress))
+        self.assertEqual(progress[-1].rows_done, progress[-1].rows_total)
+        self.assertEqual(progress[-1].pairs_done, progress[-1].pairs_total)
+        self.assertEqual(progress[-1].eta, 0)
+
+        ref = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6)
+        self.assertEqual(len(ref.get_similar_elements()), len(el.get_similar_elements()))
+        self.assertAlmostEqual(ref.get_similarity_value(), el.get_similarity_value())
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        cancel.set()
+        el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6, cancel=cancel)
+        self.assertTrue(el.cancelled)
+        self.assertEqual(el.get_similar_elements(), [])
+        self.assertEqual(len(el.get_identical_elements()), 107)
+
+        el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6, lazy=True)
+        for _ in el.iter_rows():
+            break
+        self.assertTrue(el.cancelled)
+        self.assertEqual(len(el.get_similar_elements()), 1)
+
+    def test_score_before_run(self):
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+        ref = Elsim(ProxyText(self.b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6)
+        el = Elsim(ProxyText(self.b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, lazy=True)
+        self.assertEqual(el.get_similarity_value(), 100.0)
+        el.run()
+        self.assertAlmostEqual(el.get_similarity_value(), ref.get_similarity_value())
+        self.assertLess(el.get_similarity_value(), 100.0)
+
+
+class ElsimBudgetTests(unittest.TestCase):
+    def setUp(self):
+        self.b1 = load_text('COPYING.LESSER')
+        self.b2 = load_text('COPYING.LESSER.MODIF.info')
+
+    def test_max_pairs(self):
+        ref = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6)
+        self.assertFalse(ref.partial)
+        self.assertEqual(ref.get_remainder().rows, 0)
+
+        el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6, lazy=True, max_pairs=20)
+        rows = list(el.iter_rows())
+        self.assertTrue(el.partial)
+        self.assertTrue(el.budget_exhausted)
+        self.assertFalse(el.cancelled)
+
+        # the largest elements are evaluated first
+        sizes = [len(row.element.checksum.get_buff()) for row in rows]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+
+        unevaluated = el.get_unevaluated_elements()
+        remainder = el.get_remainder()
+        self.assertEqual(remainder.rows, len(unevaluated))
+        self.assertEqual(len(rows) + remainder.rows, len(ref.get_similar_elements()) + len(ref.get_deleted_elements()))
+        self.assertIsNotNone(remainder.seconds)
+        for e in unevaluated:
+            self.assertNotIn(e, el.get_similar_elements())
+            self.assertNotIn(e, el.get_deleted_elements())
+
+        res = ElsimResult.from_elsim(el)
+        self.assertTrue(res.partial)
+        self.assertEqual(res.meta["remainder"]["rows"], remainder.rows)
+
+    def test_free_pairs(self):
+        """Pairs taken from the cache or a previous result do not count towards max_pairs"""
+        ref = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6)
+        with tempfile.TemporaryDirectory() as d:
+            cache = DistanceCache(os.path.join(d, 'cache.sqlite'))
+            Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6, cache=cache)
+            el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6, cache=cache, max_pairs=0)
+            self.assertFalse(el.partial)
+            self.assertFalse(el.budget_exhausted)
+            self.assertEqual(el.stats()["pairs_evaluated"], 0)
+            self.assertAlmostEqual(el.get_similarity_value(), ref.get_similarity_value())
+            cache.close()
+
+        el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6,
+                   previous=ElsimResult.from_elsim(ref), max_pairs=0)
+        self.assertFalse(el.partial)
+        self.assertAlmostEqual(el.get_similarity_value(), ref.get_similarity_value())
+
+    def test_max_time(self):
+        el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6, max_time=0)
+        self.assertTrue(el.partial)
+        self.assertTrue(el.budget_exhausted)
+        self.assertIsNone(el.get_remainder().seconds)
+
+        with self.assertRaises(ValueError):
+            Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, max_pairs=-1)
+
+
+class ElementStoreTests(unittest.TestCase):
+    def test_store(self):
+        sim = Similarity()
+        elements = [Text(x, sim) for x in (b'a', b'b', b' a ', b'c')]
+        store = ElementStore(elements)
+
+        self.assertEqual(len(store), 3)
+        self.assertEqual(len(store.elements), 4)
+        self.assertEqual(set(store), {e.hash for e in elements})
+        self.assertEqual(set(store.keys()), set(store))
+        self.assertEqual(len(store.items()), 3)
+        self.assertIn(elements[0].hash, store)
+        self.assertNotIn(Text(b'd', sim).hash, store)
+        self.assertEqual(set(store[elements[0].hash]), {elements[0], elements[2]})
+        with self.assertRaises(KeyError):
+            store[Text(b'd', sim).hash]
+
+        other = ElementStore([Text(x, sim) for x in (b'b', b'd')])
+        common, other_common, only = store.intersect(other)
+        self.assertEqual([store.first(i).string for i in common], [b'b'])
+        self.assertEqual([other.first(i).string for i in other_common], [b'b'])
+        self.assertEqual(sorted(store.first(i).string for i in only), [b'a', b'c'])
+
+        empty = ElementStore([])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(len(store.intersect(empty)[2]), 3)
+
+
+class ElsimCheckpointTests(unittest.TestCase):
+    def setUp(self):
+        self.b1 = load_text('COPYING.LESSER')
+        self.b2 = load_text('COPYING.LESSER.MODIF.info')
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'checkpoint.jsonl')
+
+            el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6,
+                       max_pairs=50, checkpoint=filename)
+            self.assertTrue(el.partial)
+            done = 108 - el.get_remainder().rows
+
+            progress = []
+            el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6,
+                       checkpoint=filename, progress=progress.append)
+            self.assertFalse(el.partial)
+            self.assertEqual(set(el.checkpoint), {format_hash(e.hash) for e in el.get_similar_elements() + el.get_deleted_elements()})
+            # only the missing rows were evaluated
+            self.assertEqual(progress[-1].pairs_done, progress[-1].pairs_total)
+            self.assertEqual(el.get_remainder().pairs, 0)
+
+            ref = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6)
+            self.assertAlmostEqual(ref.get_similarity_value(), el.get_similarity_value())
+            self.assertEqual(len(ref.get_similar_elements()), len(el.get_similar_elements()))
+
+            # all rows are available now, nothing needs to be calculated
+            el = Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6,
+                       checkpoint=filename, max_pairs=0)
+            self.assertFalse(el.partial)
+            self.assertGreater(done, 0)
+
+            with self.assertRaises(ValueError):
+                Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, compressor="ZLIB", checkpoint=filename)
+            with self.assertRaises(ValueError):
+                Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.4, checkpoint=filename)
+            F = dict(FILTERS_TEXT, **{FILTER_SIM_METH: lambda sim, e1, e2: 0.0})
+            with self.assertRaises(ValueError):
+                Elsim(ProxyText(self.b1), ProxyText(self.b2), F, threshold=0.6, checkpoint=filename)
+
+            # Rows are only appended if new distances were evaluated
+            size = os.path.getsize(filename)
+            Elsim(ProxyText(self.b1), ProxyText(self.b2), FILTERS_TEXT, threshold=0.6, checkpoint=filename)
+            self.assertEqual(os.path.getsize(filename), size)
+
+
+class ElsimStatsTests(unittest.TestCase):
+    def test_stats(self):
+        el = Elsim(ProxyText(load_text('COPYING.LESSER')), ProxyText(load_text('COPYING.LESSER.MODIF.info')),
+                   FILTERS_TEXT, threshold=0.6)
+        stats = el.stats()
+
+        self.assertEqual(stats["rows"] * stats["columns"], stats["pairs_total"])
+        self.assertEqual(stats["pairs_evaluated"], stats["pairs_total"])
+        self.assertEqual(stats["pairs_pruned"], 0)
+        self.assertEqual(stats["compressor_calls"], stats["pairs_evaluated"])
+        self.assertGreater(stats["compressor_bytes"], 0)
+        self.assertEqual(stats["similar"], len(el.get_similar_elements()))
+        self.assertEqual(set(stats["time"]), {"elements", "checksum", "hashing", "identical",
+                                              "similarity", "sorting", "new"})
+
+        el = Elsim(ProxyText(load_text('COPYING.LESSER')), ProxyText(load_text('COPYING.LESSER.MODIF.info')),
+                   FILTERS_TEXT, threshold=0.6, max_pairs=50)
+        stats = el.stats()
+        self.assertEqual(stats["pairs_evaluated"] + stats["pairs_pruned"], stats["pairs_total"])
+        self.assertGreater(stats["pairs_pruned"], 0)
+
+
+class ElsimBatchTests(unittest.TestCase):
+    def test_batch(self):
+        F = {k: v for k, v in FILTERS_TEXT.items() if k not in (FILTER_SIM_BATCH_METH, FILTER_BUFFER_METH)}
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+
+        batch = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6)
+        single = Elsim(ProxyText(b1), ProxyText(b2), F, threshold=0.6)
+
+        self.assertEqual(batch.stats()["pairs_evaluated"], single.stats()["pairs_evaluated"])
+        self.assertEqual(batch.stats()["compressor_calls"], single.stats()["compressor_calls"])
+        self.assertAlmostEqual(batch.get_similarity_value(), single.get_similarity_value())
+        self.assertEqual({str(e) for e in batch.get_similar_elements()}, {str(e) for e in single.get_similar_elements()})
+        for e in batch.get_similar_elements():
+            self.assertEqual(batch.get_closest_element(e)[1], min(batch.filters[SIMILARITY_ELEMENTS][e].values()))
+
+
+class ElsimPreviousTests(unittest.TestCase):
+    def test_previous(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+        previous = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6).get_result()
+
+        # nothing changed, hence nothing needs to be evaluated
+        el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, previous=previous)
+        self.assertEqual(el.stats()["pairs_evaluated"], 0)
+        self.assertEqual(el.stats()["pairs_resumed"], el.stats()["pairs_total"])
+        self.assertAlmostEqual(el.get_similarity_value(), previous.get_similarity_value())
+
+        # only the new sentences are compared
+        b3 = b2 + b'. Some new sentence about software. Another one about licenses'
+        ref = Elsim(ProxyText(b1), ProxyText(b3), FILTERS_TEXT, threshold=0.6)
+        el = Elsim(ProxyText(b1), ProxyText(b3), FILTERS_TEXT, threshold=0.6, previous=previous)
+        self.assertLess(el.stats()["pairs_evaluated"], ref.stats()["pairs_evaluated"])
+        self.assertAlmostEqual(el.get_similarity_value(), ref.get_similarity_value())
+        self.assertEqual({str(e) for e in el.get_similar_elements()}, {str(e) for e in ref.get_similar_elements()})
+        self.assertEqual({str(e) for e in el.get_new_elements()}, {str(e) for e in ref.get_new_elements()})
+        closest = {str(e): ref.get_closest_element(e)[1] for e in ref.get_similar_elements()}
+        for e in el.get_similar_elements():
+            self.assertAlmostEqual(el.get_closest_element(e)[1], closest[str(e)])
+
+        with self.assertRaises(ValueError):
+            Elsim(ProxyText(b1), ProxyText(b3), FILTERS_TEXT, compressor="ZLIB", previous=previous)
+        with self.assertRaises(ValueError):
+            Elsim(ProxyText(b1), ProxyText(b3), FILTERS_TEXT, threshold=0.4, previous=previous)
+        with self.assertRaises(ValueError):
+            Elsim(ProxyText(b1), ProxyText(b3), FILTERS_TEXT, threshold=0.6, similarity_threshold=0.5,
+                  previous=previous)
+        F = dict(FILTERS_TEXT, **{FILTER_SIM_METH: lambda sim, e1, e2: 0.0})
+        with self.assertRaises(ValueError):
+            Elsim(ProxyText(b1), ProxyText(b3), F, threshold=0.6, previous=previous)
+        previous.meta["level"] = 1
+        with self.assertRaises(ValueError):
+            Elsim(ProxyText(b1), ProxyText(b3), FILTERS_TEXT, threshold=0.6, previous=previous)
+
+
+class ElsimSpillTests(unittest.TestCase):
+    def test_spill(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+
+        ref = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6)
+        with tempfile.TemporaryDirectory() as d:
+            el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, max_memory=1024, spill_dir=d)
+            self.assertTrue(el.spilled)
+            self.assertTrue(el.stats()["spilled"])
+            self.assertEqual(len(os.listdir(d)), 1)
+
+            self.assertAlmostEqual(el.get_similarity_value(), ref.get_similarity_value(), places=4)
+            self.assertEqual({str(e) for e in el.get_similar_elements()},
+                             {str(e) for e in ref.get_similar_elements()})
+            self.assertEqual({str(e) for e in el.get_deleted_elements()},
+                             {str(e) for e in ref.get_deleted_elements()})
+            closest = {str(e): ref.get_closest_element(e)[1] for e in ref.get_similar_elements()}
+            for e in el.get_similar_elements():
+                self.assertAlmostEqual(el.get_closest_element(e)[1], closest[str(e)], places=5)
+
+            el.filters[SIMILARITY_ELEMENTS].close()
+            self.assertEqual(os.listdir(d), [])
+
+        self.assertFalse(Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, max_memory=1 << 30).spilled)
+
+
+class ElsimPipelineTests(unittest.TestCase):
+    def test_pipeline(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+
+        # The NCD of ZLIB is far from symmetric
+        ref = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, compressor="ZLIB")
+        el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, compressor="ZLIB",
+                   jobs=2, queue_size=4)
+
+        self.assertEqual(el.stats()["pairs_evaluated"], ref.stats()["pairs_evaluated"])
+        # All pairs were calculated by the pipeline
+        self.assertEqual(el.stats()["compressor_calls"], 0)
+        self.assertEqual(el.get_similarity_value(), ref.get_similarity_value())
+        self.assertEqual({str(e) for e in el.get_similar_elements()}, {str(e) for e in ref.get_similar_elements()})
+        self.assertEqual({str(e) for e in el.get_new_elements()}, {str(e) for e in ref.get_new_elements()})
+        closest = {str(e): ref.get_closest_element(e)[1] for e in ref.get_similar_elements()}
+        for e in el.get_similar_elements():
+            self.assertEqual(el.get_closest_element(e)[1], closest[str(e)])
+
+        # Every pair has exactly the distance of the serial calculation
+        distances = {(str(j), str(k)): d for j, row in ref.filters[SIMILARITY_ELEMENTS].items() for k, d in row.items()}
+        pipelined = {(str(j), str(k)): d for j, row in el.filters[SIMILARITY_ELEMENTS].items() for k, d in row.items()}
+        self.assertEqual(len(distances), ref.stats()["pairs_total"])
+        self.assertEqual(pipelined, distances)
+
+        F = {k: v for k, v in FILTERS_TEXT.items() if k != FILTER_SIM_COLUMN_METH}
+        with self.assertRaises(ValueError):
+            Elsim(ProxyText(b1), ProxyText(b2), F, jobs=2)
+
+
+class ElsimEstimateTests(unittest.TestCase):
+    def test_estimate(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+        el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, lazy=True)
+
+        estimate = el.estimate_similarity_value(sample_size=40, seed=42)
+        self.assertEqual(estimate.rows_sampled, 40)
+        self.assertEqual(estimate.rows_total, 108)
+        self.assertEqual(estimate.pairs, 40 * 5)
+        self.assertLessEqual(estimate.low, estimate.value)
+        self.assertLessEqual(estimate.value, estimate.high)
+
+        # Sampling all rows gives the exact value
+        exact = {}
+        for new, deleted in ((True, True), (False, False), (True, False)):
+            exact[new, deleted] = el.estimate_similarity_value(sample_size=1000, new=new, deleted=deleted)
+
+        # The object can still be used for the exact calculation
+        el.run()
+        for (new, deleted), estimate in exact.items():
+            self.assertAlmostEqual(estimate.value, el.get_similarity_value(new, deleted))
+            self.assertAlmostEqual(estimate.low, estimate.high)
+
+
+class ElsimBestMatchTests(unittest.TestCase):
+    def test_best_match(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+
+        ref = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6)
+        el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, best_match=True)
+
+        stats = el.stats()
+        self.assertLess(stats["pairs_evaluated"], ref.stats()["pairs_evaluated"])
+        self.assertEqual(stats["pairs_resumed"], 0)
+        self.assertEqual(stats["pairs_evaluated"] + stats["pairs_pruned"], stats["pairs_total"])
+        self.assertEqual(el.get_similarity_value(), ref.get_similarity_value())
+        self.assertEqual({str(e) for e in el.get_similar_elements()}, {str(e) for e in ref.get_similar_elements()})
+        self.assertEqual({str(e) for e in el.get_new_elements()}, {str(e) for e in ref.get_new_elements()})
+
+        # Stopping at the first close element evaluates even less pairs
+        el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, best_match=True, epsilon=0.3)
+        self.assertLess(el.stats()["pairs_evaluated"], stats["pairs_evaluated"])
+
+        F = {k: v for k, v in FILTERS_TEXT.items() if k not in (FILTER_SIM_BATCH_METH, FILTER_BUFFER_METH)}
+        with self.assertRaises(ValueError):
+            Elsim(ProxyText(b1), ProxyText(b2), F, best_match=True)
+
+
+class ElsimCacheTests(unittest.TestCase):
+    def test_cache(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+        ref = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6)
+
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "cache.sqlite")
+            cache = DistanceCache(filename, metric="text")
+            el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, cache=cache)
+            self.assertEqual(el.stats()["pairs_evaluated"], ref.stats()["pairs_evaluated"])
+            self.assertEqual(cache.stats()["hits"], 0)
+            self.assertEqual(len(cache), ref.stats()["pairs_total"])
+
+            # A new object, as used by another process, finds all pairs
+            cache = pickle.loads(pickle.dumps(cache))
+            el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, cache=cache)
+            self.assertEqual(el.stats()["pairs_evaluated"], 0)
+            self.assertEqual(el.stats()["pairs_resumed"], el.stats()["pairs_total"])
+            self.assertEqual(cache.stats()["hit_rate"], 1.0)
+            self.assertEqual(el.get_similarity_value(), ref.get_similarity_value())
+            self.assertEqual({str(e) for e in el.get_new_elements()}, {str(e) for e in ref.get_new_elements()})
+
+            # Another compressor does not use the cached distances
+            el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, compressor="ZLIB", cache=cache)
+            self.assertEqual(el.stats()["pairs_evaluated"], ref.stats()["pairs_evaluated"])
+            cache.close()
+
+            # The least recently used entries are removed
+            cache = DistanceCache(filename, metric="text", max_entries=100)
+            cache.add_row(1, "BZ2", 9, {2: 0.5})
+            self.assertLessEqual(len(cache), 100)
+            self.assertGreater(cache.stats()["evictions"], 0)
+            self.assertEqual(cache.get_row(1, "BZ2", 9, [2]), {2: 0.5})
+            cache.close()
+
+    def test_filter_identity(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+        F = {k: v for k, v in FILTERS_TEXT.items() if k != FILTER_SIM_BATCH_METH}
+        F_half = dict(F)
+        F_half[FILTER_SIM_METH] = half_sim
+
+        with tempfile.TemporaryDirectory() as d:
+            cache = DistanceCache(os.path.join(d, "cache.sqlite"))
+            el = Elsim(ProxyText(b1), ProxyText(b2), F, threshold=0.6, cache=cache)
+            pairs = el.stats()["pairs_evaluated"]
+            self.assertEqual(len(cache), pairs)
+
+            # The distances of another FILTER_SIM_METH are not shared
+            half = Elsim(ProxyText(b1), ProxyText(b2), F_half, threshold=0.6, cache=cache)
+            self.assertEqual(half.stats()["pairs_evaluated"], pairs)
+            self.assertEqual(len(cache), 2 * pairs)
+            for j in half.get_similar_elements():
+                k = half.get_associated_element(j)
+                self.assertAlmostEqual(half.get_distance(j, k), half_sim(half.sim, j, k))
+
+
+class PicklableFilterTests(unittest.TestCase):
+    def test_filters(self):
+        from elsim.dalvik import FILTERS_DALVIK_SIM, FILTERS_DALVIK_SIM_STRING, FILTERS_DALVIK_BB
+        from elsim.x86 import FILTERS_X86
+        for F in (FILTERS_TEXT, FILTERS_DETACHED, FILTERS_DALVIK_SIM, FILTERS_DALVIK_SIM_STRING,
+                  FILTERS_DALVIK_BB, FILTERS_X86):
+            self.assertEqual(pickle.loads(pickle.dumps(F)).keys(), F.keys())
+
+    def test_detached(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+        F = FILTERS_TEXT
+        index1 = ElsimIndex(ProxyText(b1), F)
+        index2 = ElsimIndex(ProxyText(b2), F)
+        detached1 = pickle.loads(pickle.dumps([DetachedElement.from_element(e, F) for e in index1.elements]))
+        detached2 = pickle.loads(pickle.dumps([DetachedElement.from_element(e, F) for e in index2.elements]))
+        self.assertEqual([str(e) for e in detached1], [str(e) for e in index1.elements])
+
+        ref = Elsim(ProxyText(b1), ProxyText(b2), F, threshold=0.6)
+        el = Elsim(Proxy(detached1), Proxy(detached2), FILTERS_DETACHED, threshold=0.6)
+        self.assertEqual(el.get_similarity_value(), ref.get_similarity_value())
+
+
+class EldiffTests(unittest.TestCase):
+    PAIRS = [("a b c", "a c d"), ("x y", "x y z"), ("one two", "two three")]
+
+    def test_lazy(self):
+        calls = []
+
+        def diff(x, y):
+            calls.append((x, y))
+            return word_diff(x, y)
+
+        eld = Eldiff(iter(self.PAIRS), {DIFF: diff})
+        self.assertEqual(calls, [])
+        self.assertEqual(eld.get_added_elements(), {"a c d": ["d"], "x y z": ["z"], "two three": ["three"]})
+        self.assertEqual(eld.get_deleted_elements(), {"a b c": ["b"], "x y": [], "one two": ["one"]})
+        self.assertEqual(eld.filters["link_elements"]["x y z"], "x y")
+        # Every diff is only calculated once
+        list(eld.diffs())
+        self.assertEqual(calls, self.PAIRS)
+
+    def test_parallel(self):
+        sequential = Eldiff(iter(self.PAIRS), FILTERS_WORD_DIFF)
+        parallel = Eldiff(iter(self.PAIRS), FILTERS_WORD_DIFF, jobs=2, queue_size=1)
+        self.assertEqual([(i, j, x.added, x.deleted) for i, j, x in parallel.diffs()],
+                         [(i, j, x.added, x.deleted) for i, j, x in sequential.diffs()])
+        self.assertEqual(parallel.get_added_elements(), sequential.get_added_elements())
@@ -0,0 +1,87 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import unittest
+
+from elsim import Elsim, ElsimIndex
+from elsim.qgram import ElsimQGram, QGramIndex, qgrams
+from elsim.text import ProxyText, FILTERS_TEXT
+
+TEXT_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples', 'text')
+
+
+def load_text(name):
+    with open(os.path.join(TEXT_DIR, name), 'rb') as fp:
+        return fp.read()
+
+
+class QGramIndexTests(unittest.TestCase):
+    def test_qgrams(self):
+        self.assertEqual(qgrams(b'ab', 2), {b'\x00a', b'ab', b'b\x00'})
+        self.assertEqual(qgrams(b'aaaa', 3), {b'\x00\x00a', b'\x00aa', b'aaa', b'aa\x00', b'a\x00\x00'})
+        self.assertEqual(len(qgrams(b'', 3)), 1)
+
+    def test_candidates(self):
+        index = QGramIndex([b'hello world', b'hello word', b'something else', b'hello'], 3)
+        self.assertEqual(len(index), 4)
+        positions, shared = index.candidates(b'hello world', 0.5)
+        self.assertEqual(list(positions), [0, 1])
+        self.assertEqual(shared[0], len(qgrams(b'hello world')))
+        positions, _ = index.candidates(b'hello world', 0.0)
+        self.assertEqual(list(positions), [0, 1, 3])
+        positions, _ = index.candidates(b'hello world', 0.0, max_candidates=1)
+        self.assertEqual(list(positions), [0])
+        positions, _ = index.candidates(b'xyz', 0.5)
+        self.assertEqual(len(positions), 0)
+        with self.assertRaises(ValueError):
+            QGramIndex([], 0)
+
+
+class ElsimQGramTests(unittest.TestCase):
+    def test_same_as_elsim(self):
+        reference = load_text('COPYING.LESSER')
+        index = ElsimIndex(ProxyText(reference), FILTERS_TEXT, 'BZ2')
+        for name in ('COPYING.LESSER.MODIF_ADDREMOVE', 'COPYING.LESSER.MODIF_REORDER'):
+            other = load_text(name)
+            el = Elsim(ProxyText(reference), ProxyText(other), FILTERS_TEXT, threshold=0.6, compressor='BZ2')
+            for e1 in (ProxyText(reference), index):
+                elq = ElsimQGram(e1, ProxyText(other), FILTERS_TEXT, threshold=0.6, compressor='BZ2')
+
+                self.assertEqual(len(el.get_identical_elements()), len(elq.get_identical_elements()))
+                self.assertEqual(len(el.get_similar_elements()), len(elq.get_similar_elements()))
+                self.assertEqual(len(el.get_new_elements()), len(elq.get_new_elements()))
+                self.assertEqual(len(el.get_deleted_elements()), len(elq.get_deleted_elements()))
+                self.assertAlmostEqual(el.get_similarity_value(), elq.get_similarity_value())
+                self.assertEqual(sorted((str(i), str(j)) for i, j in el.split_elements()),
+                                 sorted((str(i), str(j)) for i, j in elq.split_elements()))
+                self.assertLessEqual(elq.pairs_evaluated, len(el.get_similar_elements()) * 2)
+
+    def test_levenshtein_metric(self):
+        elq = ElsimQGram(ProxyText(load_text('COPYING.LESSER')), ProxyText(load_text('COPYING.LESSER.MODIF_REORDER')),
+                         FILTERS_TEXT, threshold=0.6, metric="levenshtein")
+        self.assertEqual(len(elq.get_similar_elements()), 2)
+        for i, _ in elq.split_elements():
+            self.assertLess(elq.get_closest_element(i)[1], 0.6)
+
+    def test_arguments(self):
+        with self.assertRaises(ValueError):
+            ElsimQGram(ProxyText(b'hello world'), ProxyText(b'hello world'), FILTERS_TEXT, metric="jaccard")
+        with self.assertRaises(ValueError):
+            ElsimQGram(ProxyText(b'hello world'), ProxyText(b'hello world'))
+        with self.assertRaises(ValueError):
+            ElsimQGram(ProxyText(b'hello world'), ProxyText(b'hello world'), FILTERS_TEXT, min_overlap=2)
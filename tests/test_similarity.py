@@ -115,3 +115,48 @@ class SimilarityTestsNative(unittest.TestCase):
                 self.assertAlmostEqual(s.ncd(mystr, mystr), (s2 - s1) / s1)
                 self.assertAlmostEqual(s.ncs(mystr, mystr), 1.0 - ((s2 - s1) / s1))
 
+
+    def test_cache(self):
+        """The cached compressed sizes must not change the result"""
+        s = Similarity(Compress.BZ2)
+        nocache = Similarity(Compress.BZ2, cache_size=0)
+
+        a = b'hello world, hello elsim'
+        b = b'hello world, goodbye elsim'
+        c = b'something completely different'
+
+        for x, y in ((a, b), (a, c), (b, c), (a, b)):
+            self.assertEqual(s.ncd(x, y), nocache.ncd(x, y))
+            self.assertEqual(s.ncs(x, y), nocache.ncs(x, y))
+        self.assertEqual(len(s._cache), 3)
+        self.assertEqual(len(nocache._cache), 0)
+
+        s.set_compress_type(Compress.ZLIB)
+        self.assertEqual(len(s._cache), 0)
+
+    def test_ncd_row(self):
+        """A whole row must give the same result as single calls"""
+        s = Similarity(Compress.BZ2)
+        ref = Similarity(Compress.BZ2, cache_size=0)
+
+        a = b'hello world, hello elsim'
+        others = [b'hello world, goodbye elsim', b'something completely different', a]
+
+        self.assertEqual(s.ncd_row(a, others), [ref.ncd(a, x) for x in others])
+        # now with the cached sizes
+        self.assertEqual(s.ncd_row(a, others), [ref.ncd(a, x) for x in others])
+        self.assertEqual(s.ncd_row(a, []), [])
+        with self.assertRaises(ValueError):
+            s.ncd_row(a, [b''])
+
+    def test_compressed_size(self):
+        s = Similarity(Compress.BZ2)
+        a = b'hello world, hello elsim'
+        self.assertEqual(s.compressed_size(a), s.compress(a))
+        # the size is taken from the cache the second time
+        self.assertEqual(s.compressed_size(a), s.compress(a))
+        self.assertEqual(s.cache_hits, 1)
+        # and it is the same as calculated by ncd
+        ref = Similarity(Compress.BZ2)
+        ref.ncd(a, b'something else')
+        self.assertEqual(ref._get_cached_size(a), s.compressed_size(a))
@@ -0,0 +1,86 @@
+# This file is part of Elsim
+#
+# Copyright (C) 2019, Sebastian Bachmann <hello at reox.at>
+# All rights reserved.
+#
+# Elsim is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Elsim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Elsim.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import unittest
+
+from elsim import Elsim, ElsimIndex, FILTER_SIM_BATCH_METH
+from elsim.store import HashCounter
+from elsim.stream import ElsimStream
+from elsim.text import ProxyText, FILTERS_TEXT
+
+TEXT_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples', 'text')
+
+
+def load_text(name):
+    with open(os.path.join(TEXT_DIR, name), 'rb') as fp:
+        return fp.read()
+
+
+class HashCounterTests(unittest.TestCase):
+    def test_counter(self):
+        c = HashCounter(buffer_size=3)
+        for h in [5, 1 << 100, 5, 7, 5, 9, 1 << 100]:
+            c.add(h)
+        self.assertEqual(len(c), 4)
+        self.assertEqual(c.total(), 7)
+        self.assertIn(1 << 100, c)
+        self.assertNotIn(6, c)
+        c.add(11)
+        self.assertEqual(list(c.contains([5, 6, 11, 1 << 100])), [True, False, True, True])
+
+
+class ElsimStreamTests(unittest.TestCase):
+    def assertSameResult(self, el, stream):
+        self.assertEqual(len(el.get_identical_elements()), len(stream.get_identical_elements()))
+        self.assertEqual(len(el.get_deleted_elements()), len(stream.get_deleted_elements()))
+        self.assertEqual(len(el.get_new_elements()), stream.count_new_elements())
+        self.assertEqual(sorted((str(a), str(el.get_associated_element(a))) for a in el.get_similar_elements()),
+                         sorted((str(a), str(b)) for a, b in stream.split_elements()))
+        self.assertEqual(el.get_similarity_value(), stream.get_similarity_value())
+        self.assertEqual(el.get_similarity_value(False, False), stream.get_similarity_value(False, False))
+
+    def test_stream(self):
+        b1 = load_text('COPYING.LESSER')
+        index = ElsimIndex(ProxyText(b1), FILTERS_TEXT, "BZ2")
+        for name in ('COPYING.LESSER.MODIF', 'COPYING.LESSER.MODIF_ADD', 'COPYING.LESSER.MODIF.info'):
+            b2 = load_text(name)
+            el = Elsim(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, compressor="BZ2")
+            for chunk_size in (1, 7, 1024):
+                with self.subTest(name=name, chunk_size=chunk_size):
+                    self.assertSameResult(el, ElsimStream(index, ProxyText(b2), threshold=0.6, chunk_size=chunk_size))
+
+    def test_single(self):
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+        F = {k: v for k, v in FILTERS_TEXT.items() if k != FILTER_SIM_BATCH_METH}
+        el = Elsim(ProxyText(b1), ProxyText(b2), F, threshold=0.6)
+        stream = ElsimStream(ProxyText(b1), ProxyText(b2), F, threshold=0.6, chunk_size=16)
+        self.assertSameResult(el, stream)
+        self.assertGreater(stream.pairs_evaluated, 0)
+
+    def test_repeated_hashes(self):
+        """Elements with a hash of an earlier chunk are not compared again"""
+        b1 = load_text('COPYING.LESSER')
+        b2 = load_text('COPYING.LESSER.MODIF.info')
+        el = Elsim(ProxyText(b1), ProxyText(b2 + b2), FILTERS_TEXT, threshold=0.6)
+        once = ElsimStream(ProxyText(b1), ProxyText(b2), FILTERS_TEXT, threshold=0.6, chunk_size=4)
+        twice = ElsimStream(ProxyText(b1), ProxyText(b2 + b2), FILTERS_TEXT, threshold=0.6, chunk_size=4)
+        self.assertSameResult(el, twice)
+        # Only the sentence, which joins both copies, is new
+        rows = len(el.get_similar_elements()) + len(el.get_deleted_elements())
+        self.assertLessEqual(twice.pairs_evaluated, once.pairs_evaluated + rows)